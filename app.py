@@ -1,9 +1,41 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
+import hashlib
 import uuid
+import shutil
 import threading
-from mp4_compressor import compress_mp4_for_youtube
+from mp4_compressor import find_ffmpeg
+from job_scheduler import (JobScheduler, QueueFullError, default_worker_count,
+                           threads_per_job, parse_priority, PRIORITY_BATCH, REQUEUE,
+                           PRIORITY_INTERACTIVE)
+import job_control
+from job_control import CANCELLED, ABANDONED, PREEMPTED, RELEASED, LOST, REQUEUE_REASONS
+from job_store import create_job_store
+from job_queue import create_job_queue
+from job_events import JobEvents
+import ingest
+import chunked_upload
+from chunked_upload import UploadError
+from encode_plan import (choose_encode_path, stream_args, audio_args,
+                         parse_bitrate, format_bitrate, PATH_MESSAGES, PATH_TRANSCODE)
+from encode_profile import choose_profile, profile_video_args, parse_goal, describe
+from encoders import (available_backends, choose_encoder, apply_encoder, resolve_backend,
+                      DEFAULT_BACKEND)
+from result_cache import ResultCache, ContentHasher, cache_key
+from downloads import send_download
+from target_size import (parse_size, format_size, solve_video_bitrate, audio_budget,
+                         abr_video_args, encode_to_size, stats_prefix, has_stats, cleanup_stats,
+                         two_pass_preset)
+from preview import preview_encode
+from governor import Governor, LEVEL_NORMAL, LEVELS
+from metrics import Registry
+from tracing import Tracer
+from ffmpeg_progress import ProgressReader, PROGRESS_ARGS
+from segment_encoder import load_checkpoint
+import video_probe
+import renditions
 import time
 
 app = Flask(__name__, static_folder='static')
@@ -13,28 +45,481 @@ app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching for large files
 
+# Encode worker pool: workers x threads per job should match the machine's cores.
+# ENCODE_WORKERS is for the whole host. Each of the WEB_CONCURRENCY gunicorn processes
+# runs its own pool, so each gets a share (in queue mode every run_worker.py has it all).
+web_processes = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+if os.environ.get('ENCODE_MODE', 'local') != 'local':
+    web_processes = 1
+encode_workers = int(os.environ.get('ENCODE_WORKERS', 0)) or default_worker_count()
+app.config['ENCODE_WORKERS'] = max(1, encode_workers // web_processes)
+app.config['ENCODE_THREADS_PER_JOB'] = (int(os.environ.get('ENCODE_THREADS_PER_JOB', 0))
+                                        or threads_per_job(app.config['ENCODE_WORKERS'] * web_processes))
+app.config['MAX_QUEUED_JOBS'] = int(os.environ.get('MAX_QUEUED_JOBS', 20))
+# Stream-copy inputs that already meet the target profile instead of re-encoding
+app.config['PASSTHROUGH_ENABLED'] = os.environ.get('PASSTHROUGH_ENABLED', '1') != '0'
+# Segment-parallel encoding for long inputs (split on keyframes, encode chunks, concat)
+app.config['SEGMENT_ENCODING'] = os.environ.get('SEGMENT_ENCODING', '1') != '0'
+app.config['SEGMENT_MIN_DURATION'] = float(os.environ.get('SEGMENT_MIN_DURATION', 300))
+app.config['SEGMENT_SECONDS'] = float(os.environ.get('SEGMENT_SECONDS', 30))
+app.config['SEGMENT_PROCESSES'] = int(os.environ.get('SEGMENT_PROCESSES', 0))  # 0 = auto
+app.config['SEGMENT_SHARED_DIR'] = os.environ.get('SEGMENT_SHARED_DIR', '')  # '' = local pool only
+# Push-based progress (/events SSE stream and long-poll /status?wait=)
+app.config['STATUS_PUSH_INTERVAL'] = float(os.environ.get('STATUS_PUSH_INTERVAL', 0.5))  # min seconds between updates
+app.config['STATUS_RECHECK_INTERVAL'] = 2.0  # re-read the store for updates made by other workers
+app.config['LONG_POLL_MAX_WAIT'] = 25
+app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))
+# Each held long-poll or stream occupies a gunicorn thread; beyond this many per process
+# they get 503 + Retry-After, leaving threads for uploads, plain polls and downloads
+app.config['MAX_HELD_REQUESTS'] = int(os.environ.get('MAX_HELD_REQUESTS', 4))
+# Content-addressed cache of finished encodes (same input + same settings = no re-encode)
+app.config['RESULT_CACHE_ENABLED'] = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', os.path.join('outputs', 'cache'))
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get('RESULT_CACHE_MAX_MB', 5120))
+app.config['RESULT_CACHE_MAX_AGE'] = int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600))  # seconds
+# Downloads: keep outputs for a grace period so interrupted downloads can resume,
+# optionally letting a front proxy send the file (x-accel = nginx, x-sendfile = Apache)
+app.config['DOWNLOAD_RETENTION'] = int(os.environ.get('DOWNLOAD_RETENTION', 900))  # seconds after last download
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD', '')
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-outputs/')
+# Target-size mode: two-pass encodes; pass-1 stats are kept per input for retries
+app.config['PASSLOG_DIR'] = os.environ.get('PASSLOG_DIR', os.path.join('uploads', 'passlogs'))
+app.config['PASSLOG_MAX_AGE'] = int(os.environ.get('PASSLOG_MAX_AGE', 24 * 3600))  # seconds
+# /preview: sampled clips encoded in parallel to project size, encode time and quality
+app.config['PREVIEW_SAMPLES'] = int(os.environ.get('PREVIEW_SAMPLES', 4))
+app.config['PREVIEW_SAMPLE_SECONDS'] = float(os.environ.get('PREVIEW_SAMPLE_SECONDS', 4))
+app.config['PREVIEW_MAX_CONCURRENT'] = int(os.environ.get('PREVIEW_MAX_CONCURRENT', 2))
+# Output ladder (encode_profile.py): default speed/size goal and largest output short side
+app.config['ENCODE_GOAL'] = parse_goal(os.environ.get('ENCODE_GOAL'))
+app.config['MAX_OUTPUT_HEIGHT'] = int(os.environ.get('MAX_OUTPUT_HEIGHT', 1080))  # 0 = keep source size
+# Encoder backends (encoders.py): x264, x265, svtav1 or vp9 where this ffmpeg has them
+app.config['ENCODER'] = os.environ.get('ENCODER', 'x264')
+app.config['ENCODER_IDLE'] = os.environ.get('ENCODER_IDLE', '')  # '' = same as ENCODER
+app.config['ENCODER_POLICY'] = os.environ.get('ENCODER_POLICY', '1') != '0'  # adapt preset/codec to queue depth
+# Host load governor (governor.py): faster presets / fewer threads when CPU or memory runs hot
+app.config['GOVERNOR_ENABLED'] = os.environ.get('GOVERNOR_ENABLED', '1') != '0'
+app.config['GOVERNOR_INTERVAL'] = float(os.environ.get('GOVERNOR_INTERVAL', 2))  # seconds between samples
+app.config['GOVERNOR_CPU_HIGH'] = float(os.environ.get('GOVERNOR_CPU_HIGH', 85))  # percent
+app.config['GOVERNOR_CPU_CRITICAL'] = float(os.environ.get('GOVERNOR_CPU_CRITICAL', 95))
+app.config['GOVERNOR_MEMORY_HIGH'] = float(os.environ.get('GOVERNOR_MEMORY_HIGH', 90))
+app.config['GOVERNOR_RENICE'] = int(os.environ.get('GOVERNOR_RENICE', 10))  # 0 = never renice
+app.config['GOVERNOR_RENICE_AFTER'] = float(os.environ.get('GOVERNOR_RENICE_AFTER', 60))  # seconds
+app.config['GOVERNOR_CGROUP'] = os.environ.get('GOVERNOR_CGROUP', '')  # writable cgroup v2 dir for ffmpeg
+app.config['GOVERNOR_RESERVE_CORES'] = int(os.environ.get('GOVERNOR_RESERVE_CORES', 1))
+# Prometheus metrics: gunicorn workers share snapshots through this directory ('' = this process only)
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join('uploads', 'metrics'))
+app.config['METRICS_PUBLISH_INTERVAL'] = float(os.environ.get('METRICS_PUBLISH_INTERVAL', 5))  # seconds
+# Per-job phase spans + ffmpeg stderr tail, one JSON-lines file per job ('' = off)
+app.config['TRACE_DIR'] = os.environ.get('TRACE_DIR', os.path.join('uploads', 'traces'))
+app.config['TRACE_MAX_AGE'] = int(os.environ.get('TRACE_MAX_AGE', 24 * 3600))  # seconds
+# Cancellation: jobs nobody polls (status / SSE) for ABANDON_TIMEOUT seconds are stopped
+app.config['ABANDON_TIMEOUT'] = float(os.environ.get('ABANDON_TIMEOUT', 120))  # 0 = never
+app.config['HEARTBEAT_DIR'] = os.environ.get('HEARTBEAT_DIR', os.path.join('uploads', 'heartbeats'))
+app.config['JOB_WATCH_INTERVAL'] = float(os.environ.get('JOB_WATCH_INTERVAL', 2))  # seconds
+app.config['KILL_GRACE'] = float(os.environ.get('KILL_GRACE', 5))  # seconds from SIGTERM to SIGKILL
+app.config['PREEMPT_BATCH_JOBS'] = os.environ.get('PREEMPT_BATCH_JOBS', '0') != '0'
+# Crash recovery: unfinished jobs whose worker process died (recycled by --max-requests,
+# restarted) are queued again by a surviving worker; segmented encodes resume per segment
+app.config['JOB_RECOVERY'] = os.environ.get('JOB_RECOVERY', '1') != '0'
+app.config['JOB_RECOVERY_INTERVAL'] = float(os.environ.get('JOB_RECOVERY_INTERVAL', 10))  # seconds
+app.config['JOB_RECOVERY_MAX_ATTEMPTS'] = int(os.environ.get('JOB_RECOVERY_MAX_ATTEMPTS', 3))
+app.config['JOB_OWNER_TIMEOUT'] = float(os.environ.get('JOB_OWNER_TIMEOUT', 60))  # owners on other hosts
+
 # Create directories
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# Store compression status
-compression_status = {}
+# Store compression status (memory, or sqlite:///path shared across gunicorn workers)
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE', 'sqlite:///jobs.db')
+job_events = JobEvents()
+job_store = create_job_store(app.config['JOB_STORE'], on_update=job_events.notify)
+
+# Where encodes run: 'local' (in these web workers) or 'queue' (run_worker.py processes
+# lease jobs from JOB_QUEUE; the web tier only enqueues and serves status)
+app.config['ENCODE_MODE'] = os.environ.get('ENCODE_MODE', 'local')
+app.config['JOB_QUEUE'] = os.environ.get('JOB_QUEUE', app.config['JOB_STORE'])
+app.config['JOB_LEASE_SECONDS'] = float(os.environ.get('JOB_LEASE_SECONDS', 60))
+app.config['ENCODE_WORKER'] = False  # set by run_worker.py
+job_queue = create_job_queue(app.config['JOB_QUEUE']) if app.config['ENCODE_MODE'] == 'queue' else None
+
+# Worker threads start lazily on the first submit (safe with gunicorn --preload)
+scheduler = JobScheduler(workers=app.config['ENCODE_WORKERS'],
+                         max_queued=app.config['MAX_QUEUED_JOBS'],
+                         threads=app.config['ENCODE_THREADS_PER_JOB'])
+
+preview_slots = threading.BoundedSemaphore(app.config['PREVIEW_MAX_CONCURRENT'])
+held_request_slots = threading.BoundedSemaphore(app.config['MAX_HELD_REQUESTS'])
+
+governor = Governor(interval=app.config['GOVERNOR_INTERVAL'],
+                    cpu_high=app.config['GOVERNOR_CPU_HIGH'],
+                    cpu_critical=app.config['GOVERNOR_CPU_CRITICAL'],
+                    memory_high=app.config['GOVERNOR_MEMORY_HIGH'],
+                    renice=app.config['GOVERNOR_RENICE'],
+                    renice_after=app.config['GOVERNOR_RENICE_AFTER'],
+                    cgroup_path=app.config['GOVERNOR_CGROUP'],
+                    reserve_cores=app.config['GOVERNOR_RESERVE_CORES'])
+
+# Parse `ffmpeg -encoders` once at startup
+encoder_backends = available_backends(find_ffmpeg())
+print(f"Encoder backends available: {', '.join(encoder_backends)}")
+app.config['ENCODER'] = resolve_backend(app.config['ENCODER'], encoder_backends)
+if app.config['ENCODER_IDLE']:
+    app.config['ENCODER_IDLE'] = resolve_backend(app.config['ENCODER_IDLE'], encoder_backends)
+
+result_cache = ResultCache(app.config['RESULT_CACHE_DIR'],
+                           max_bytes=app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024,
+                           max_age=app.config['RESULT_CACHE_MAX_AGE'])
+
+# Metrics (served at /metrics)
+metrics = Registry(app.config['METRICS_DIR'])
+PHASE_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+metric_queue_depth = metrics.gauge('videoshrink_queue_depth', 'Jobs waiting for an encode worker',
+                                   'max' if job_queue else 'sum')  # every process sees the shared queue
+metric_active_encodes = metrics.gauge('videoshrink_active_encodes', 'Jobs being encoded')
+metric_workers = metrics.gauge('videoshrink_encode_workers', 'Encode worker slots')
+metric_encode_fps = metrics.gauge('videoshrink_encode_fps', 'Frames per second across running encodes')
+metric_encode_speed = metrics.gauge('videoshrink_encode_speed',
+                                    'Sum of running encode speeds (x realtime)')
+metric_host_cpu = metrics.gauge('videoshrink_host_cpu_percent', 'Smoothed host CPU (governor)', 'max')
+metric_host_memory = metrics.gauge('videoshrink_host_memory_percent', 'Host memory in use (governor)',
+                                   'max')
+metric_governor_level = metrics.gauge('videoshrink_governor_level',
+                                      'Governor load level (1 for the current level)', 'max')
+metric_governor_decisions = metrics.counter('videoshrink_governor_decisions_total',
+                                            'Jobs started per governor load level')
+metric_jobs = metrics.counter('videoshrink_jobs_total', 'Finished jobs by outcome')
+metric_encode_paths = metrics.counter('videoshrink_encode_path_total', 'Jobs per encode path')
+metric_input_bytes = metrics.counter('videoshrink_input_bytes_total', 'Bytes of uploaded video')
+metric_output_bytes = metrics.counter('videoshrink_output_bytes_total', 'Bytes of compressed video')
+metric_download_bytes = metrics.counter('videoshrink_download_bytes_total', 'Bytes of video served')
+metric_cache = metrics.counter('videoshrink_cache_requests_total', 'Cache lookups by cache and result')
+metric_ratio = metrics.histogram('videoshrink_compression_ratio', 'Output size / input size',
+                                 [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0])
+metric_realtime = metrics.histogram('videoshrink_encode_realtime_factor',
+                                    'Seconds of video encoded per second of wall time',
+                                    [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64])
+metric_phase = metrics.histogram('videoshrink_phase_seconds', 'Time spent per job phase', PHASE_BUCKETS)
+
+# fps / speed of running encodes, parsed from ffmpeg -progress output
+live_encode_rates = {}
+live_encode_rates_lock = threading.Lock()
+
+def record_encode_rate(job_id, fps=None, speed=None):
+    with live_encode_rates_lock:
+        rates = live_encode_rates.setdefault(job_id, {'fps': 0.0, 'speed': 0.0})
+        if fps is not None:
+            rates['fps'] = fps
+        if speed is not None:
+            rates['speed'] = speed
+
+def clear_encode_rate(job_id):
+    with live_encode_rates_lock:
+        live_encode_rates.pop(job_id, None)
+
+def encode_stats():
+    """
+    Scheduler stats for load decisions and metrics. With the shared queue,
+    'queued' counts jobs waiting for any worker, and web processes have no slots.
+    """
+    stats = scheduler.stats()
+    if job_queue is not None:
+        stats['queued'] = job_queue.stats()['queued']
+        if not app.config['ENCODE_WORKER']:
+            stats['workers'] = 0
+    return stats
+
+def collect_metrics():
+    """Refresh gauges that mirror scheduler, encoder and governor state"""
+    stats = encode_stats()
+    metric_queue_depth.set(stats['queued'])
+    metric_active_encodes.set(stats['running'])
+    metric_workers.set(stats['workers'])
+    with live_encode_rates_lock:
+        rates = list(live_encode_rates.values())
+    metric_encode_fps.set(round(sum(rate['fps'] for rate in rates), 2))
+    metric_encode_speed.set(round(sum(rate['speed'] for rate in rates), 2))
+    probe_stats = video_probe.cache_stats()
+    metric_cache.mirror(probe_stats['hits'], cache='probe', result='hit')
+    metric_cache.mirror(probe_stats['misses'], cache='probe', result='miss')
+    if app.config['GOVERNOR_ENABLED']:
+        state = governor.snapshot()
+        metric_host_cpu.set(state['cpu'])
+        metric_host_memory.set(state['memory'])
+        metric_governor_level.replace({(('level', level),): int(level == state['level'])
+                                       for level in LEVELS})
+        for level, count in state['decisions'].items():
+            metric_governor_decisions.mirror(count, level=level)
+
+metrics.on_collect(collect_metrics)
+
+def start_process_threads():
+    """
+    Start this process's load sampler and metrics publisher. Called from requests and jobs rather
+    than at import: with gunicorn --preload the import runs in the master, and
+    its threads don't survive the fork into the workers.
+    """
+    if app.config['GOVERNOR_ENABLED']:
+        governor.start()
+    metrics.start_publishing(app.config['METRICS_PUBLISH_INTERVAL'])
+
+def observe_span(span):
+    # Successful phase spans double as the phase latency histogram
+    if span['status'] == 'ok':
+        metric_phase.observe(span['duration'], phase=span['name'])
+
+tracer = Tracer(app.config['TRACE_DIR'], on_span=observe_span)
+
+# Client heartbeats: status polls and SSE streams touch <HEARTBEAT_DIR>/<job_id>.
+# A file, so the worker running a job sees polls served by the other gunicorn workers.
+HEARTBEAT_INTERVAL = 5  # seconds between touches per job and process
+ACTIVE_STATUSES = ('uploading', 'queued', 'processing')
+CANCEL_MESSAGES = {
+    CANCELLED: 'Cancelled',
+    ABANDONED: 'Cancelled: nobody was waiting for the result',
+}
+heartbeat_touched = {}
+heartbeat_lock = threading.Lock()
+
+def heartbeat_path(job_id):
+    return os.path.join(app.config['HEARTBEAT_DIR'], job_id)
+
+def touch_heartbeat(job_id, force=False):
+    """Note that a client is still waiting for job_id"""
+    now = time.monotonic()
+    with heartbeat_lock:
+        interval = min(HEARTBEAT_INTERVAL, app.config['ABANDON_TIMEOUT'] / 4)
+        if not force and now - heartbeat_touched.get(job_id, 0) < interval:
+            return
+        heartbeat_touched[job_id] = now
+    try:
+        os.makedirs(app.config['HEARTBEAT_DIR'], exist_ok=True)
+        with open(heartbeat_path(job_id), 'a'):
+            pass
+        os.utime(heartbeat_path(job_id))
+    except OSError as e:
+        print(f"Heartbeat for job {job_id} failed: {e}")
+
+def drop_heartbeat(job_id):
+    with heartbeat_lock:
+        heartbeat_touched.pop(job_id, None)
+    try:
+        os.remove(heartbeat_path(job_id))
+    except OSError:
+        pass
+
+def is_abandoned(job_id):
+    """True if no client has asked about job_id for ABANDON_TIMEOUT seconds"""
+    timeout = app.config['ABANDON_TIMEOUT']
+    if not timeout:
+        return False
+    source = ingest.get(job_id)
+    if source is not None and not source.done:
+        return False  # the upload is still arriving
+    try:
+        return time.time() - os.path.getmtime(heartbeat_path(job_id)) > timeout
+    except OSError:
+        return False
+
+def cancel_job(job_id, reason=CANCELLED):
+    """
+    Stop a job this process owns: a queued one leaves the queue now, a running
+    one has its ffmpeg process groups terminated. Returns 'queued',
+    'running', 'leased' (a queue worker has it and acts on cancel_requested)
+    or None (not ours).
+    """
+    state = scheduler.cancel(job_id)
+    if state is None and job_queue is not None:
+        state = job_queue.cancel(job_id)
+    if state == 'queued':
+        job = job_store.get(job_id) or {}
+        finish_cancelled(job_id, reason, job.get('input_path'), job.get('output_path'))
+    elif state == 'running':
+        stopped = job_control.cancel(job_id, reason, grace=app.config['KILL_GRACE'])
+        print(f"Job {job_id} {reason}: stopping {stopped} ffmpeg process group(s)")
+        job_store.update(job_id, message='Cancelling...')
+    elif state == 'leased':
+        job_store.update(job_id, message='Cancelling...')
+    return state
+
+def finish_cancelled(job_id, reason, input_path, output_path):
+    """Mark a job cancelled and remove its files"""
+    job_store.update(job_id, status='cancelled', queue_position=None,
+                     message=CANCEL_MESSAGES.get(reason, 'Cancelled'), cancel_reason=reason)
+    metric_jobs.inc(outcome=reason)
+    start_time = (job_store.get(job_id) or {}).get('start_time')
+    if start_time:
+        tracer.record_since(job_id, 'total', start_time, status='cancelled', reason=reason)
+    ingest.remove(job_id)
+    remove_job_files(job_id, input_path, output_path)
+    print(f"Job {job_id} {reason}")
+
+def remove_job_files(job_id, input_path, output_path):
+    """Delete a job's upload, output, rendition and segment files (failed or cancelled jobs)"""
+    drop_heartbeat(job_id)
+    try:
+        for path in (input_path, output_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        for entry in (job_store.get(job_id) or {}).get('renditions', {}).values():
+            if entry.get('path') and os.path.exists(entry['path']):
+                os.remove(entry['path'])
+        shutil.rmtree(segment_workdir(job_id), ignore_errors=True)
+    except Exception as cleanup_error:
+        print(f"Cleanup error for job {job_id}: {cleanup_error}")
+
+def fail_job(job_id, error, input_path, output_path):
+    """Mark a job failed and remove its files"""
+    job_store.update(job_id, status='error', message=f'Error: {error}')
+    metric_jobs.inc(outcome='error')
+    start_time = (job_store.get(job_id) or {}).get('start_time')
+    if start_time:
+        tracer.record_since(job_id, 'total', start_time, status='error', error=str(error)[:500])
+    ingest.remove(job_id)
+    remove_job_files(job_id, input_path, output_path)
+
+def owner_gone(job):
+    """True if the worker process that owns an unfinished job has died"""
+    owner = job.get('owner')
+    if not owner or owner == job_control.process_owner():
+        return False  # jobs from before owners were recorded are left alone
+    alive = job_control.owner_alive(owner)
+    if alive is None:
+        # Another host: it refreshes owner_seen while it holds the job
+        alive = time.time() - job.get('owner_seen', 0) < app.config['JOB_OWNER_TIMEOUT']
+    return not alive
+
+def recover_jobs():
+    """
+    Claim unfinished jobs whose owner died and queue them here again. The job
+    store is the journal: each job keeps its input, output and settings.
+    """
+    me = job_control.process_owner()
+    now = time.time()
+    for job_id in scheduler.job_ids():
+        job_store.update(job_id, owner_seen=now)
+    # With the shared queue, leases cover queued and running jobs
+    statuses = ACTIVE_STATUSES if job_queue is None else ('uploading',)
+    for job_id, job in job_store.with_status(statuses):
+        if not owner_gone(job):
+            continue
+        # Compare-and-set: with several survivors only one gets the job
+        if not job_store.update_if(job_id, 'owner', job['owner'], owner=me, owner_seen=now):
+            continue
+        try:
+            resume_job(job_id, job)
+        except Exception as e:
+            print(f"Recovery of job {job_id} failed: {e}")
+            fail_job(job_id, f'Could not resume after a restart: {e}',
+                     job.get('input_path'), job.get('output_path'))
+
+def resume_job(job_id, job):
+    """Queue a claimed orphan again, or finish it if it can't (or shouldn't) run"""
+    input_path, output_path = job.get('input_path'), job.get('output_path')
+    stopped = job_control.stop_orphans(job_id, grace=app.config['KILL_GRACE'])
+    attempts = job.get('recoveries', 0) + 1
+    print(f"Recovering job {job_id} from {job['owner']} ({job['status']}, "
+          f"attempt {attempts}, {stopped} leftover ffmpeg process(es) stopped)")
+    if job.get('owner_seen'):
+        tracer.record_since(job_id, 'interrupted', job['owner_seen'], attempt=attempts)
+    
+    if job.get('cancel_requested'):
+        finish_cancelled(job_id, job['cancel_requested'], input_path, output_path)
+        return
+    if is_abandoned(job_id):
+        finish_cancelled(job_id, ABANDONED, input_path, output_path)
+        return
+    if job['status'] == 'uploading' or (job.get('streaming') and not job.get('upload_complete')):
+        error = 'Upload interrupted by a server restart, please upload again'
+    elif not input_path or not os.path.exists(input_path):
+        error = 'Interrupted by a server restart and the upload is no longer available'
+    elif attempts > app.config['JOB_RECOVERY_MAX_ATTEMPTS']:
+        error = f'Interrupted by {attempts - 1} server restarts, giving up'
+    else:
+        error = None
+    if error:
+        fail_job(job_id, error, input_path, output_path)
+        return
+    
+    if output_path and os.path.exists(output_path):
+        os.remove(output_path)  # partial; segment outputs in the work dir are kept
+    job_store.update(job_id, status='queued', progress=0, recoveries=attempts,
+                     message='Resuming after a server restart...')
+    touch_heartbeat(job_id, force=True)
+    enqueue_job(job_id, input_path, output_path, job.get('bitrate', '2M'),
+                job.get('priority', PRIORITY_INTERACTIVE), job.get('content_digest'), force=True)
+
+def watch_jobs():
+    """
+    Apply cancel requests (made through any worker) and abandonment to this
+    process's jobs, and every JOB_RECOVERY_INTERVAL pick up jobs orphaned by
+    dead workers.
+    """
+    last_recovery = None
+    while True:
+        if app.config['JOB_RECOVERY'] and (
+                last_recovery is None
+                or time.monotonic() - last_recovery >= app.config['JOB_RECOVERY_INTERVAL']):
+            last_recovery = time.monotonic()
+            try:
+                recover_jobs()
+            except Exception as e:
+                print(f"Job recovery error: {e}")
+        time.sleep(app.config['JOB_WATCH_INTERVAL'])
+        for job_id in scheduler.job_ids():
+            try:
+                if job_control.cancel_reason(job_id) not in (None,) + REQUEUE_REASONS:
+                    continue  # already being stopped
+                reason = (job_store.get(job_id) or {}).get('cancel_requested')
+                if not reason and is_abandoned(job_id):
+                    reason = ABANDONED
+                if reason:
+                    cancel_job(job_id, reason)
+            except Exception as e:
+                print(f"Job watcher error for {job_id}: {e}")
+
+job_watcher_lock = threading.Lock()
+job_watcher_started = []
+
+def start_job_watcher():
+    """Start the watcher thread with the first request or job (like the scheduler's workers)"""
+    with job_watcher_lock:
+        if job_watcher_started:
+            return
+        thread = threading.Thread(target=watch_jobs, name='job-watcher')
+        thread.daemon = True
+        thread.start()
+        job_watcher_started.append(thread)
 
 def cleanup_old_files():
-    """Remove files older than 1 hour"""
+    """Remove files older than 1 hour (cached results follow the cache's own LRU/age policy)"""
     import glob
     current_time = time.time()
+    cache_folder = os.path.abspath(result_cache.folder)
     
     for folder in [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']]:
         for file_path in glob.glob(os.path.join(folder, '*')):
+            if os.path.dirname(os.path.abspath(file_path)) == cache_folder:
+                continue
             try:
                 if os.path.isfile(file_path):
                     file_age = current_time - os.path.getmtime(file_path)
                     if file_age > 3600:  # 1 hour
                         os.remove(file_path)
                         print(f"Cleaned up old file: {file_path}")
+                elif file_path.endswith('_segments') and current_time - os.path.getmtime(file_path) > 3600:
+                    # Resume checkpoint of a job that is no longer running anywhere
+                    job = job_store.get(os.path.basename(file_path)[:-len('_segments')]) or {}
+                    if job.get('status') not in ACTIVE_STATUSES:
+                        shutil.rmtree(file_path, ignore_errors=True)
+                        print(f"Cleaned up old segments: {file_path}")
             except Exception as e:
                 print(f"Error cleaning up {file_path}: {e}")
+    
+    chunked_upload.cleanup_stale_uploads(app.config['UPLOAD_FOLDER'], 3600)
+    result_cache.evict()
+    if os.path.isdir(app.config['PASSLOG_DIR']):
+        cleanup_stats(app.config['PASSLOG_DIR'], app.config['PASSLOG_MAX_AGE'])
+    tracer.cleanup(app.config['TRACE_MAX_AGE'])
 
 # Run cleanup every hour
 import threading
@@ -44,6 +529,12 @@ def periodic_cleanup():
 
 periodic_cleanup()  # Start cleanup timer
 
+@app.before_request
+def start_background_threads():
+    # Per worker process, after gunicorn forks: the watcher also recovers orphaned jobs
+    start_job_watcher()
+    start_process_threads()
+
 @app.route('/')
 def index():
     response = app.make_response(render_template('index.html'))
@@ -54,7 +545,13 @@ def index():
 def debug():
     from mp4_compressor import find_ffmpeg
     ffmpeg_path = find_ffmpeg()
-    return f"FFmpeg path: {ffmpeg_path}"
+    return f"FFmpeg path: {ffmpeg_path}, encoders: {', '.join(encoder_backends)}"
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target (all gunicorn workers, merged)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
@@ -72,6 +569,12 @@ def upload_file():
         if not any(file.filename.lower().endswith(ext) for ext in allowed_extensions):
             return jsonify({'error': 'Only MP4 and MOV files are supported'}), 400
         
+        try:
+            target_bytes = parse_target_size(request.form.get('target_size'))
+            rendition_names = parse_rendition_request(request.form.get('renditions'), target_bytes)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         print(f"Processing file: {file.filename}")
         
         # Generate unique ID for this compression job
@@ -80,7 +583,12 @@ def upload_file():
         # Save uploaded file
         filename = secure_filename(file.filename)
         input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
-        file.save(input_path)
+        hasher = ContentHasher()  # result-cache key, computed while saving
+        with tracer.span(job_id, 'upload', mode='form') as span, open(input_path, 'wb') as f:
+            for chunk in iter(lambda: file.stream.read(ingest.CHUNK_SIZE), b''):
+                f.write(chunk)
+                hasher.update(chunk)
+            span['bytes'] = f.tell()
         
         # Get parameters
         output_filename = request.form.get('output_filename', 'compressed_video.mp4')
@@ -88,162 +596,978 @@ def upload_file():
             output_filename += '.mp4'
         
         bitrate = request.form.get('bitrate', '2M')
+        goal = parse_goal(request.form.get('goal'), app.config['ENCODE_GOAL'])
         
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}_{output_filename}")
-        
-        # Get file size for initial info
-        file_size_mb = os.path.getsize(input_path) / (1024 * 1024)
-        
-        # Initialize status
-        compression_status[job_id] = {
-            'status': 'processing',
-            'progress': 0,
-            'message': 'Initializing...',
-            'input_file': filename,
-            'output_file': output_filename,
-            'file_size': f'{file_size_mb:.1f} MB',
-            'start_time': time.time()
-        }
-        
-        # Start compression in background
-        thread = threading.Thread(target=compress_video_background, 
-                                args=(job_id, input_path, output_path, bitrate))
-        thread.daemon = True
-        thread.start()
+        # Hand the job to the bounded worker pool
+        priority = parse_priority(request.form.get('priority'))
+        try:
+            position = start_job(job_id, input_path, filename, output_filename, bitrate, priority,
+                                 hasher.hexdigest(), target_bytes, goal, rendition_names)
+        except QueueFullError as e:
+            return queue_full_response(job_id, input_path, e)
         
-        print(f"Job created: {job_id}")
-        return jsonify({'job_id': job_id})
+        print(f"Job created: {job_id} (queue position {position})")
+        return jsonify({'job_id': job_id, 'queue_position': position, 'cached': position == 0})
         
     except Exception as e:
         print(f"Upload error: {e}")
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
-def compress_video_background(job_id, input_path, output_path, bitrate):
+def start_job(job_id, input_path, filename, output_filename, bitrate, priority,
+              content_digest=None, target_bytes=None, goal=None, rendition_names=None):
+    """
+    Record a new job for a stored upload and queue it (raises QueueFullError).
+    Returns the queue position, or 0 if the result came from the cache.
+    """
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}_{output_filename}")
+    input_size = os.path.getsize(input_path)
+    file_size_mb = input_size / (1024 * 1024)
+    metric_input_bytes.inc(input_size)
+    
+    job_store.create(job_id, {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting in queue...',
+        'input_file': filename,
+        'output_file': output_filename,
+        'file_size': f'{file_size_mb:.1f} MB',
+        'start_time': time.time(),
+        'goal': goal or app.config['ENCODE_GOAL'],
+        'owner': job_control.process_owner(),
+        'owner_seen': time.time(),
+        **target_fields(target_bytes),
+        **rendition_fields(rendition_names)
+    })
+    return enqueue_job(job_id, input_path, output_path, bitrate, priority, content_digest)
+
+def enqueue_job(job_id, input_path, output_path, bitrate, priority, content_digest=None,
+                force=False):
+    """
+    Queue a job on the worker pool and record its position (raises QueueFullError
+    unless force is set). With the upload's content digest a cached result
+    completes the job instead (returns 0). The job store keeps everything needed
+    to queue the job again after a crash (recover_jobs).
+    """
+    if content_digest and complete_from_cache(job_id, input_path, output_path, bitrate, content_digest):
+        metric_jobs.inc(outcome='cached')
+        return 0
+    # Written before submitting: a free worker starts the job at once and sets its own status.
+    # With the shared queue a run_worker.py process leases it; the lease replaces the owner.
+    job_store.update(job_id, queued_at=time.time(),
+                     input_path=input_path, output_path=output_path,
+                     bitrate=bitrate, priority=priority,
+                     owner=job_control.process_owner() if job_queue is None else None,
+                     owner_seen=time.time(), message='Waiting in queue...')
+    status = (job_store.get(job_id) or {}).get('status')
+    if job_queue is not None:
+        position = job_queue.put(job_id, {'input_path': input_path, 'output_path': output_path,
+                                          'bitrate': bitrate, 'priority': priority},
+                                 priority, None if force else app.config['MAX_QUEUED_JOBS'])
+    else:
+        position = scheduler.submit(job_id, compress_video_background,
+                                    args=(job_id, input_path, output_path, bitrate),
+                                    priority=priority, force=force)
+    # Only if no worker has picked it up yet
+    job_store.update_if(job_id, 'status', status, queue_position=position,
+                        message=f'Waiting in queue (position {position})...')
+    touch_heartbeat(job_id, force=True)
+    start_job_watcher()
+    start_process_threads()
+    
+    # Interactive job and every worker busy: stop a batch job to make room
+    if app.config['PREEMPT_BATCH_JOBS'] and job_queue is None and priority < PRIORITY_BATCH:
+        victim = scheduler.preempt_candidate(priority)
+        if victim:
+            print(f"Preempting batch job {victim} for job {job_id}")
+            job_control.cancel(victim, PREEMPTED, grace=app.config['KILL_GRACE'])
+    return position
+
+def parse_target_size(value):
+    """Target size from a request ('25M', '25MB', bytes), or None when not given"""
+    if not value:
+        return None
+    target_bytes = parse_size(value)
+    if target_bytes <= 0:
+        raise ValueError(f"Invalid size: {value}")
+    return target_bytes
+
+def target_fields(target_bytes):
+    """Job fields for target-size mode (none when encoding by bitrate)"""
+    if not target_bytes:
+        return {}
+    return {'target_bytes': target_bytes, 'target_size': format_size(target_bytes)}
+
+def parse_rendition_request(value, target_bytes=None):
+    """Rendition names from a request ('1080p,720p,480p'), or [] for a single output"""
+    names = renditions.parse_renditions(value)
+    if names and target_bytes:
+        raise ValueError("target_size can't be combined with renditions")
+    return names
+
+def rendition_fields(names):
+    """Job fields for multi-rendition mode (none for a single output)"""
+    if not names:
+        return {}
+    return {'renditions': {name: {'status': 'queued', 'progress': 0} for name in names}}
+
+def size_report(original_size, compressed_size, target_bytes=None):
+    """Job fields describing a finished output's size"""
+    report = {
+        'original_size': f"{original_size / (1024*1024):.1f} MB",
+        'compressed_size': f"{compressed_size / (1024*1024):.1f} MB",
+        'reduction': f"{(1 - compressed_size/original_size) * 100:.1f}%",
+    }
+    if target_bytes:
+        report['target_deviation'] = f"{(compressed_size / target_bytes - 1) * 100:+.1f}%"
+    return report
+
+def job_profile(info, bitrate, goal=None):
+    """Output resolution, fps cap, preset and CRF for a job (see encode_profile.py)"""
+    return choose_profile(info, bitrate, goal or app.config['ENCODE_GOAL'],
+                          app.config['MAX_OUTPUT_HEIGHT'])
+
+def pick_encoder(profile, switch_codec=True, extra_shift=0):
+    """
+    Apply the encoder policy to a profile for a job starting now: faster presets
+    (and x264) while jobs are waiting, slower ones (and ENCODER_IDLE) when quiet.
+    extra_shift moves the preset further (the load governor's decision).
+    A queue-mode web process has no encode slots of its own; the load that
+    counts is the worker's when it starts the job, so (for previews) it
+    assumes no shift. Returns (profile, decision).
+    """
+    if app.config['ENCODER_POLICY'] and (job_queue is None or app.config['ENCODE_WORKER']):
+        choice = choose_encoder(encode_stats(), encoder_backends, app.config['ENCODER'],
+                                app.config['ENCODER_IDLE'], switch_codec)
+    else:
+        encoder = app.config['ENCODER'] if switch_codec else DEFAULT_BACKEND
+        choice = {'encoder': resolve_backend(encoder, encoder_backends), 'preset_shift': 0,
+                  'load': None}
+    choice['preset_shift'] += extra_shift
+    return apply_encoder(profile, choice), choice
+
+def result_cache_key(content_digest, bitrate, target_bytes=None, goal=None):
+    """Cache key for an input and the settings that decide its encoded bytes"""
+    if target_bytes:
+        bitrate = None  # solved from the target size
+    else:
+        try:
+            bitrate = parse_bitrate(bitrate)
+        except ValueError:
+            pass  # ffmpeg will reject it; the key just has to be stable
+    return cache_key(content_digest, {
+        'bitrate': bitrate,
+        'target_size': target_bytes,
+        'passthrough': app.config['PASSTHROUGH_ENABLED'],
+        # The profile follows from these and the probed input
+        'goal': goal or app.config['ENCODE_GOAL'],
+        'max_height': app.config['MAX_OUTPUT_HEIGHT'],
+        # Load-dependent preset moves are not part of the key: any of them is a valid result
+        'encoder': app.config['ENCODER'],
+        'encoder_idle': app.config['ENCODER_IDLE'],
+    })
+
+def complete_from_cache(job_id, input_path, output_path, bitrate, content_digest):
+    """Finish a job with a cached result if there is one. Returns True on a hit."""
+    if not app.config['RESULT_CACHE_ENABLED']:
+        return False
+    job = job_store.get(job_id)
+    if job.get('renditions'):
+        return False  # the cache holds single outputs
+    target_bytes = job.get('target_bytes')
+    key = result_cache_key(content_digest, bitrate, target_bytes, job.get('goal'))
+    if not result_cache.fetch(key, output_path):
+        metric_cache.inc(cache='result', result='miss')
+        job_store.update(job_id, content_digest=content_digest)
+        return False
+    metric_cache.inc(cache='result', result='hit')
+    
+    original_size = os.path.getsize(input_path)
+    compressed_size = os.path.getsize(output_path)
+    os.remove(input_path)  # not needed: nothing will be encoded
+    job_store.update(job_id, status='completed', progress=100, cache_hit=True,
+                     message='Compression completed! (cached result)', download_path=output_path,
+                     **size_report(original_size, compressed_size, target_bytes))
+    print(f"Job {job_id} served from result cache ({key[:12]})")
+    return True
+
+def store_result(job_id, output_path, bitrate, content_digest, target_bytes=None, goal=None):
+    """Add a finished encode to the result cache"""
+    if not app.config['RESULT_CACHE_ENABLED'] or not content_digest:
+        return
+    try:
+        result_cache.store(result_cache_key(content_digest, bitrate, target_bytes, goal), output_path)
+    except OSError as e:
+        print(f"Result cache store failed for job {job_id}: {e}")
+
+def queue_full_response(job_id, input_path, error):
+    """Drop a rejected job and tell the client to retry (HTTP 429)"""
+    job_store.delete(job_id)
+    if os.path.exists(input_path):
+        os.remove(input_path)
+    metric_jobs.inc(outcome='rejected')
+    print(f"Rejected job {job_id}: {error}")
+    response = jsonify({'error': 'Server is busy, please try again shortly',
+                        'queue_position': error.queued + 1,
+                        'max_queued': error.max_queued})
+    response.headers['Retry-After'] = '30'
+    return response, 429
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads', methods=['POST'])
+def init_chunked_upload():
+    """Start a resumable upload: JSON {filename, size, chunk_size?, output_filename?, bitrate?}"""
+    body = request.get_json(silent=True) or {}
+    filename = body.get('filename', '')
+    allowed_extensions = ['.mp4', '.mov']
+    if not any(filename.lower().endswith(ext) for ext in allowed_extensions):
+        return jsonify({'error': 'Only MP4 and MOV files are supported'}), 400
+    
+    output_filename = body.get('output_filename') or 'compressed_video.mp4'
+    if not output_filename.endswith('.mp4'):
+        output_filename += '.mp4'
     try:
-        compression_status[job_id]['message'] = 'Preparing video...'
-        compression_status[job_id]['progress'] = 8
+        size = int(body.get('size') or 0)
+        chunk_size = int(body['chunk_size']) if body.get('chunk_size') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size and chunk_size must be whole numbers of bytes'}), 400
+    try:
+        target_bytes = parse_target_size(body.get('target_size'))
+        rendition_names = parse_rendition_request(body.get('renditions'), target_bytes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    meta = chunked_upload.init_upload(
+        app.config['UPLOAD_FOLDER'], secure_filename(filename), size,
+        app.config['MAX_CONTENT_LENGTH'], chunk_size,
+        params={'output_filename': secure_filename(output_filename),
+                'bitrate': body.get('bitrate', '2M'),
+                'target_bytes': target_bytes,
+                'goal': parse_goal(body.get('goal'), app.config['ENCODE_GOAL']),
+                'renditions': rendition_names,
+                'priority': body.get('priority')})
+    print(f"Chunked upload started: {meta['upload_id']} ({meta['total_chunks']} chunks)")
+    return jsonify({key: meta[key] for key in ('upload_id', 'chunk_size', 'total_chunks')})
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def chunked_upload_state(upload_id):
+    return jsonify(chunked_upload.upload_state(app.config['UPLOAD_FOLDER'], upload_id))
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """Store chunk N; X-Chunk-Offset and X-Chunk-SHA256 headers are checked when sent"""
+    offset = request.headers.get('X-Chunk-Offset', type=int)
+    received = chunked_upload.write_chunk(app.config['UPLOAD_FOLDER'], upload_id, index, offset,
+                                          request.get_data(cache=False),
+                                          request.headers.get('X-Chunk-SHA256'))
+    return jsonify({'chunk': index, 'received': received})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload(upload_id):
+    """
+    All chunks are in: start the compression job (job id = upload id). An optional
+    JSON body {bitrate, target_size, goal, renditions, output_filename} overrides the settings given
+    at init, e.g. after trying a few with /preview.
+    """
+    if job_store.get(upload_id) is not None:
+        return jsonify({'job_id': upload_id})  # finalize retried after success
+    
+    folder = app.config['UPLOAD_FOLDER']
+    meta = chunked_upload.load_upload(folder, upload_id)
+    params = dict(meta['params'])
+    overrides = request.get_json(silent=True) or {}
+    if overrides.get('bitrate'):
+        params['bitrate'] = overrides['bitrate']
+    if 'target_size' in overrides:
+        try:
+            params['target_bytes'] = parse_target_size(overrides['target_size'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if overrides.get('goal'):
+        params['goal'] = parse_goal(overrides['goal'], app.config['ENCODE_GOAL'])
+    if 'renditions' in overrides or 'target_size' in overrides:
+        try:
+            params['renditions'] = parse_rendition_request(
+                overrides.get('renditions', params.get('renditions')), params.get('target_bytes'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if overrides.get('output_filename'):
+        output_filename = overrides['output_filename']
+        if not output_filename.endswith('.mp4'):
+            output_filename += '.mp4'
+        params['output_filename'] = secure_filename(output_filename)
+    
+    input_path = os.path.join(folder, f"{upload_id}_{meta['filename']}")
+    uploaded_at = time.time()
+    with tracer.span(upload_id, 'assemble'):
+        chunked_upload.finalize_upload(folder, upload_id, input_path)
+    tracer.record_since(upload_id, 'upload', meta['created'], uploaded_at, mode='chunked')
+    
+    digest = chunked_upload.content_digest(folder, upload_id)
+    try:
+        position = start_job(upload_id, input_path, meta['filename'], params['output_filename'],
+                             params['bitrate'], parse_priority(params.get('priority')), digest,
+                             params.get('target_bytes'), params.get('goal'), params.get('renditions'))
+    except QueueFullError as e:
+        # Keep the chunks so the client can retry finalize without re-uploading
+        chunked_upload.restore_upload(folder, upload_id, input_path)
+        return queue_full_response(upload_id, input_path, e)
+    chunked_upload.discard_upload(folder, upload_id)
+    
+    print(f"Job created from chunked upload: {upload_id} (queue position {position})")
+    return jsonify({'job_id': upload_id, 'queue_position': position, 'cached': position == 0})
+
+@app.route('/preview', methods=['POST'])
+def preview_settings():
+    """
+    Encode a few sampled clips with the chosen settings and project the full job:
+    size, encode time and (with quality=1) SSIM/PSNR. Send the video as multipart
+    'video', or the 'upload_id' of a chunked upload whose chunks are all in (then
+    finalize it with the settings you settled on).
+    """
+    params = request.form if (request.form or request.files) else (request.get_json(silent=True) or {})
+    bitrate = params.get('bitrate', '2M')
+    goal = parse_goal(params.get('goal'), app.config['ENCODE_GOAL'])
+    quality = str(params.get('quality', '')).lower() in ('1', 'true', 'yes')
+    try:
+        target_bytes = parse_target_size(params.get('target_size'))
+        parse_bitrate(bitrate)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Previews run outside the encode queue, so cap how many run at once
+    if not preview_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many previews running, please try again shortly'})
+        response.headers['Retry-After'] = '10'
+        return response, 429
+    
+    temp_path = None
+    digest = None
+    try:
+        if 'video' in request.files:
+            file = request.files['video']
+            temp_path = os.path.join(app.config['UPLOAD_FOLDER'],
+                                     f"preview_{uuid.uuid4()}_{secure_filename(file.filename)}")
+            file.save(temp_path)
+            input_path = temp_path
+        elif params.get('upload_id'):
+            upload_id = params['upload_id']
+            if chunked_upload.upload_state(app.config['UPLOAD_FOLDER'], upload_id)['missing']:
+                return jsonify({'error': 'Upload is not complete yet'}), 409
+            input_path = chunked_upload.load_upload(app.config['UPLOAD_FOLDER'], upload_id)['path']
+            digest = chunked_upload.content_digest(app.config['UPLOAD_FOLDER'], upload_id)
+        else:
+            return jsonify({'error': 'No video file or upload_id given'}), 400
+        
+        return jsonify(run_preview(input_path, bitrate, target_bytes, quality, goal, digest))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 422
+    finally:
+        preview_slots.release()
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def run_preview(input_path, bitrate, target_bytes=None, quality=False, goal=None, content_digest=None):
+    """Sampled preview of the encode a job with these settings would run"""
+    from mp4_compressor import find_ffmpeg
+    from video_probe import probe_video
+    
+    try:
+        info = probe_video(input_path, content_digest)
+    except Exception as e:
+        raise ValueError(f"Could not read video: {e}")
+    duration = info['duration']
+    
+    # Same path and settings decisions as compress_with_realtime_progress
+    if target_bytes:
+        video_bitrate = solve_video_bitrate(target_bytes, duration, audio_budget(info))
+        bitrate = format_bitrate(video_bitrate)
+    profile, choice = pick_encoder(job_profile(info, bitrate, goal), switch_codec=not target_bytes)
+    if app.config['PASSTHROUGH_ENABLED']:
+        plan = choose_encode_path(info, bitrate, profile)
+    else:
+        plan = {'path': PATH_TRANSCODE, 'video': 'transcode', 'audio': 'transcode'}
+    if target_bytes and plan['path'] == PATH_TRANSCODE:
+        filter_args = ['-vf', profile['filters']] if profile['filters'] else []
+        encode_args = (filter_args + abr_video_args(video_bitrate, preset=profile['preset'])
+                       + audio_args(plan))
+    else:
+        encode_args = profile_video_args(plan, profile) + audio_args(plan)
+    
+    samples = app.config['PREVIEW_SAMPLES']
+    threads = app.config['ENCODE_THREADS_PER_JOB']
+    result = preview_encode(find_ffmpeg(), input_path, duration, encode_args, fps=info.get('fps'),
+                            samples=samples, sample_seconds=app.config['PREVIEW_SAMPLE_SECONDS'],
+                            threads=max(1, threads // samples), quality=quality,
+                            workdir=app.config['UPLOAD_FOLDER'])
+    
+    projected = result['projected_size']
+    seconds = result['projected_encode_seconds'] or 0
+    result.update({
+        'encode_path': plan['path'],
+        'bitrate': bitrate,
+        'output_profile': describe(profile),
+        'projected_size_display': format_size(projected),
+        'projected_reduction': f"{(1 - projected / info['size']) * 100:.1f}%",
+        'projected_encode_time': f'{int(seconds//60)}m {int(seconds%60)}s' if seconds >= 60 else f'{int(seconds)}s',
+    })
+    if target_bytes:
+        result.update(target_fields(target_bytes))
+    return result
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    Raw-body upload (?filename=&bitrate=&output_filename=). Files with the moov
+    atom at the front start encoding while the body is still arriving.
+    """
+    filename = request.args.get('filename', '')
+    allowed_extensions = ['.mp4', '.mov']
+    if not any(filename.lower().endswith(ext) for ext in allowed_extensions):
+        return jsonify({'error': 'Only MP4 and MOV files are supported'}), 400
+    if not request.content_length:
+        return jsonify({'error': 'Content-Length required'}), 411
+    
+    job_id = str(uuid.uuid4())
+    filename = secure_filename(filename)
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_{filename}")
+    
+    output_filename = request.args.get('output_filename', 'compressed_video.mp4')
+    if not output_filename.endswith('.mp4'):
+        output_filename += '.mp4'
+    output_filename = secure_filename(output_filename)
+    bitrate = request.args.get('bitrate', '2M')
+    goal = parse_goal(request.args.get('goal'), app.config['ENCODE_GOAL'])
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}_{output_filename}")
+    priority = parse_priority(request.args.get('priority'))
+    try:
+        target_bytes = parse_target_size(request.args.get('target_size'))
+        rendition_names = parse_rendition_request(request.args.get('renditions'), target_bytes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job_store.create(job_id, {
+        'status': 'uploading',
+        'progress': 0,
+        'message': 'Uploading...',
+        'input_file': filename,
+        'output_file': output_filename,
+        'file_size': f'{request.content_length / (1024 * 1024):.1f} MB',
+        'start_time': time.time(),
+        'goal': goal,
+        'owner': job_control.process_owner(),
+        'owner_seen': time.time(),
+        **target_fields(target_bytes),
+        **rendition_fields(rendition_names)
+    })
+    
+    state = ingest.IngestState(input_path, request.content_length)
+    ingest.register(job_id, state)
+    queued = []
+    
+    def on_layout(state):
+        # moov first: ffmpeg can start reading the upload as it arrives
+        # (not with the shared queue: the encode runs in another process)
+        if state.layout == 'front' and job_queue is None:
+            queued.append(enqueue_job(job_id, input_path, output_path, bitrate, priority))
+            job_store.update(job_id, streaming=True)
+    
+    try:
+        with tracer.span(job_id, 'upload', mode='stream', bytes=request.content_length) as span:
+            ingest.stream_to_disk(request.stream, state, on_layout)
+            span['layout'] = state.layout
+        metric_input_bytes.inc(request.content_length)
+        if queued:
+            job_store.update(job_id, upload_complete=True)  # a restart can now encode from disk
+    except QueueFullError as e:
+        ingest.remove(job_id)
+        return queue_full_response(job_id, input_path, e)
+    except Exception as e:
+        print(f"Streaming upload failed for job {job_id}: {e}")
+        if not queued:
+            ingest.remove(job_id)
+            job_store.delete(job_id)
+            if os.path.exists(input_path):
+                os.remove(input_path)
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 400
+    
+    if queued:
+        position = queued[0]
+    else:
+        # moov at the end (or not ISO media): store-then-encode
+        ingest.remove(job_id)
+        try:
+            position = enqueue_job(job_id, input_path, output_path, bitrate, priority,
+                                   state.content_digest)
+        except QueueFullError as e:
+            return queue_full_response(job_id, input_path, e)
+    
+    print(f"Job created: {job_id} (layout {state.layout}, streamed: {bool(queued)})")
+    return jsonify({'job_id': job_id, 'queue_position': position, 'streamed': bool(queued),
+                    'cached': position == 0})
+
+REQUEUE_MESSAGES = {
+    PREEMPTED: 'Paused for a more urgent job, waiting in queue...',
+    RELEASED: 'Worker stopped, waiting for another worker...',
+}
+
+def compress_video_background(job_id, input_path, output_path, bitrate, threads=0):
+    """Scheduler entry point: encode one job (returns REQUEUE if it was preempted)"""
+    try:
+        with job_control.bind(job_id):
+            return run_job(job_id, input_path, output_path, bitrate, threads)
+    finally:
+        job_control.clear(job_id)
+
+def run_queued_job(job_id, payload, attempts, threads=0):
+    """
+    Encode a job leased from the shared queue (run_worker.py). Returns True
+    once the job is finished with in any outcome, False to hand it back.
+    attempts > 0 means an earlier worker lost its lease mid-encode.
+    """
+    job = job_store.get(job_id)
+    if job is None or job.get('status') not in ACTIVE_STATUSES:
+        return True  # deleted or finished while it waited
+    input_path, output_path = payload['input_path'], payload['output_path']
+    if attempts:
+        stopped = job_control.stop_orphans(job_id, grace=app.config['KILL_GRACE'])
+        print(f"Taking over job {job_id} from a lost worker "
+              f"(attempt {attempts}, {stopped} leftover ffmpeg process(es) stopped)")
+        if job.get('owner_seen'):
+            tracer.record_since(job_id, 'interrupted', job['owner_seen'], attempt=attempts)
+        job_store.update(job_id, recoveries=attempts)
+    
+    if job.get('cancel_requested'):
+        finish_cancelled(job_id, job['cancel_requested'], input_path, output_path)
+        return True
+    if is_abandoned(job_id):
+        finish_cancelled(job_id, ABANDONED, input_path, output_path)
+        return True
+    if attempts > app.config['JOB_RECOVERY_MAX_ATTEMPTS']:
+        fail_job(job_id, f'Interrupted by {attempts} worker failures, giving up',
+                 input_path, output_path)
+        return True
+    
+    job_store.update(job_id, owner=job_control.process_owner(), owner_seen=time.time())
+    return compress_video_background(job_id, input_path, output_path,
+                                     payload['bitrate'], threads) != REQUEUE
+
+def run_job(job_id, input_path, output_path, bitrate, threads=0):
+    queued_at = (job_store.get(job_id) or {}).get('queued_at')
+    if queued_at:
+        tracer.record_since(job_id, 'queue', queued_at)
+    try:
+        job_control.check(job_id)  # cancelled between the queue and this worker
+        job_store.update(job_id, status='processing', queue_position=None, threads=threads,
+                         message='Preparing video...', progress=8)
         
         # Get video info first
-        import ffmpeg
         from mp4_compressor import find_ffmpeg
         
         ffmpeg_path = find_ffmpeg()
         if not ffmpeg_path:
             raise Exception("FFmpeg not found")
         
-        # Fast estimation - skip slow video probing
+        # Streaming upload: the header has to be on disk before it can be probed
+        source = ingest.get(job_id)
+        if source is not None and not source.done:
+            job_store.update(job_id, message='Reading video header...')
+            source.wait_for(source.moov_end)
+        
+        # Read duration and stream info from the container header (no decoding)
+        from video_probe import probe_video
         try:
+            with tracer.span(job_id, 'probe'):
+                info = probe_video(input_path, job_store.get(job_id).get('content_digest'))
+            if source is not None and info['size'] < source.expected_size:
+                # Probed mid-upload: the overall bitrate has to come from the final size
+                info['size'] = source.expected_size
+                if info['duration']:
+                    info['bit_rate'] = int(source.expected_size * 8 / info['duration'])
+            job_store.update(job_id, duration=info['duration'], probe=info, video_info={
+                'width': info.get('width', 0),
+                'height': info.get('height', 0),
+                'fps': info.get('fps', 0)
+            })
+        except Exception as e:
+            # Fall back to a rough size-based estimate: 2MB per second
+            print(f"Probe failed for job {job_id}, estimating duration: {e}")
             file_size_mb = os.path.getsize(input_path) / (1024 * 1024)
-            estimated_duration = file_size_mb / 2  # Rough estimate: 2MB per second
-            
-            compression_status[job_id]['duration'] = estimated_duration
-            compression_status[job_id]['video_info'] = {
-                'width': 1920, 'height': 1080, 'fps': 30  # Use defaults
-            }
-        except:
-            compression_status[job_id]['duration'] = 0
-            compression_status[job_id]['video_info'] = {'width': 1920, 'height': 1080, 'fps': 30}
+            job_store.update(job_id, duration=file_size_mb / 2,
+                             video_info={'width': 1920, 'height': 1080, 'fps': 30})
         
-        compression_status[job_id]['progress'] = 15
-        compression_status[job_id]['message'] = 'Starting compression...'
+        job_store.update(job_id, progress=15, message='Starting compression...')
         
         # Start compression with real-time progress
-        compress_with_realtime_progress(job_id, input_path, output_path, bitrate)
+        encode_started = time.monotonic()
+        try:
+            with tracer.span(job_id, 'encode', threads=threads) as span:
+                compress_with_realtime_progress(job_id, input_path, output_path, bitrate, threads)
+                job = job_store.get(job_id)
+                span.update(path=job.get('encode_path'), mode=job.get('encode_mode', 'single'),
+                            encoder=job.get('encoder'), profile=job.get('output_profile'))
+        finally:
+            clear_encode_rate(job_id)
+        encode_seconds = time.monotonic() - encode_started
         
         print(f"Compression completed for job {job_id}")
-        compression_status[job_id]['status'] = 'completed'
-        compression_status[job_id]['progress'] = 100
-        compression_status[job_id]['message'] = 'Compression completed!'
-        compression_status[job_id]['download_path'] = output_path
+        # Streamed jobs learn their digest when the upload ends, after the encode started
+        job = job_store.get(job_id)
+        content_digest = job.get('content_digest') or (
+            source.content_digest if source is not None else None)
+        target_bytes = job.get('target_bytes')
+        if not job.get('renditions'):
+            store_result(job_id, output_path, bitrate, content_digest, target_bytes, job.get('goal'))
+        
+        # Record final sizes once so status requests don't stat files
+        original_size = os.path.getsize(input_path)
+        compressed_size = os.path.getsize(output_path)
+        report = size_report(original_size, compressed_size, target_bytes)
+        record_job_metrics(job_id, job, original_size, compressed_size, encode_seconds)
+        message = 'Compression completed!'
+        if target_bytes:
+            message += f" {report['compressed_size']} ({report['target_deviation']} vs {job['target_size']} target)"
+        job_store.update(job_id, status='completed', progress=100,
+                         message=message, download_path=output_path, **report)
         print(f"Job {job_id} marked as completed, file at: {output_path}")
         
     except Exception as e:
-        print(f"Compression error for job {job_id}: {str(e)}")
-        compression_status[job_id]['status'] = 'error'
-        compression_status[job_id]['message'] = f'Error: {str(e)}'
-        
-        # Cleanup files on error
-        try:
-            if os.path.exists(input_path):
-                os.remove(input_path)
+        # A killed ffmpeg looks like any other failure: ask whether it was a cancel
+        reason = job_control.cancel_reason(job_id)
+        if reason == LOST:
+            print(f"Job {job_id} stopped: the queue gave it to another worker")
+            return  # its status and files are the new worker's now
+        if reason in REQUEUE_REASONS:
+            print(f"Job {job_id} {reason}, back in the queue")
             if os.path.exists(output_path):
                 os.remove(output_path)
-        except Exception as cleanup_error:
-            print(f"Cleanup error for failed job {job_id}: {cleanup_error}")
+            job_store.update(job_id, status='queued', progress=0, queued_at=time.time(),
+                             message=REQUEUE_MESSAGES[reason])
+            return REQUEUE
+        if reason:
+            finish_cancelled(job_id, reason, input_path, output_path)
+            return
+        
+        print(f"Compression error for job {job_id}: {str(e)}")
+        fail_job(job_id, e, input_path, output_path)
+
+def record_job_metrics(job_id, job, original_size, compressed_size, encode_seconds):
+    """Sizes, ratio, speed and end-to-end time of a completed encode"""
+    metric_jobs.inc(outcome='completed')
+    metric_encode_paths.inc(path=job.get('encode_mode') or job.get('encode_path') or PATH_TRANSCODE)
+    extra = sum(os.path.getsize(entry['path']) for name, entry in job.get('renditions', {}).items()
+                if entry.get('path') and entry['path'] != job.get('download_path')
+                and os.path.exists(entry['path']))
+    metric_output_bytes.inc(compressed_size + extra)
+    if original_size:
+        metric_ratio.observe(compressed_size / original_size)
+    if job.get('duration') and encode_seconds > 0:
+        metric_realtime.observe(job['duration'] / encode_seconds)
+    if job.get('start_time'):
+        tracer.record_since(job_id, 'total', job['start_time'], outcome='completed')
 
-def compress_with_realtime_progress(job_id, input_path, output_path, bitrate):
+def compress_with_realtime_progress(job_id, input_path, output_path, bitrate, threads=0):
     import subprocess
-    import re
     from mp4_compressor import find_ffmpeg
     
     ffmpeg_path = find_ffmpeg()
-    duration = compression_status[job_id].get('duration', 0)
+    job = job_store.get(job_id)
+    duration = job.get('duration', 0)
+    
+    # Host running hot: start this job with a faster preset / fewer threads
+    preset_shift = 0
+    if app.config['GOVERNOR_ENABLED']:
+        decision = governor.decide(threads)
+        threads, preset_shift = decision['threads'], decision['preset_shift']
+        job_store.update(job_id, governor=decision, threads=threads)
+        if decision['level'] != LEVEL_NORMAL:
+            print(f"Job {job_id} governor: {decision['level']} load, preset {preset_shift:+d}, "
+                  f"{threads} threads")
+    
+    # Upload still arriving: feed ffmpeg from the growing file through a pipe
+    source = ingest.get(job_id)
+    streaming = source is not None and not source.done
+    if source is not None and not streaming:
+        ingest.remove(job_id)  # upload finished before a worker got to it
+    
+    # Several sizes from one decode: a separate path with its own profiles
+    if job.get('renditions'):
+        if streaming:
+            job_store.update(job_id, message='Waiting for upload to finish...')
+            source.wait_for(source.expected_size)
+            if source.error:
+                raise Exception(f"Upload interrupted: {source.error}")
+        ingest.remove(job_id)
+        compress_renditions(job_id, input_path, output_path, bitrate, job, threads, preset_shift)
+        return
+    
+    # Target-size mode: the bitrate comes from the size budget, not the request
+    target_bytes = job.get('target_bytes')
+    if target_bytes:
+        if not job.get('probe'):
+            raise Exception("Target size mode needs the video duration, but the input couldn't be probed")
+        bitrate = format_bitrate(solve_video_bitrate(target_bytes, duration, audio_budget(job['probe'])))
+    
+    # Output size, fps cap, preset and CRF for this source and goal; encoder from the load
+    # (two-pass target-size encodes stay on x264)
+    profile, choice = pick_encoder(job_profile(job.get('probe'), bitrate, job.get('goal')),
+                                   switch_codec=not target_bytes, extra_shift=preset_shift)
+    if target_bytes:
+        # Load shifts stop at veryfast here: faster presets write no .mbtree pass-1 stats
+        profile['preset'] = two_pass_preset(profile['preset'])
+    job_store.update(job_id, output_profile=profile['name'], encode_preset=profile['preset'],
+                     encoder=profile['encoder'], encoder_load=choice['load'],
+                     output_resolution=f"{profile['width']}x{profile['height']}" if profile['width'] else None)
+    print(f"Job {job_id} output profile: {describe(profile)}")
+    
+    # Skip work the input doesn't need (stream copy / remux / audio-only)
+    if app.config['PASSTHROUGH_ENABLED']:
+        plan = choose_encode_path(job.get('probe'), bitrate, profile)
+    else:
+        plan = {'path': PATH_TRANSCODE, 'video': 'transcode', 'audio': 'transcode',
+                'reason': 'passthrough disabled'}
+    job_store.update(job_id, encode_path=plan['path'], encode_reason=plan['reason'])
+    print(f"Job {job_id} encode path: {plan['path']} ({plan['reason']})")
+    
+    if target_bytes and plan['path'] == PATH_TRANSCODE:
+        if streaming:
+            # Two passes read the input twice: wait for the whole upload
+            job_store.update(job_id, message='Waiting for upload to finish...')
+            source.wait_for(source.expected_size)
+            if source.error:
+                raise Exception(f"Upload interrupted: {source.error}")
+        ingest.remove(job_id)
+        compress_to_target_size(job_id, input_path, output_path, target_bytes, duration, plan,
+                                job.get('content_digest') or (source.content_digest if source else None),
+                                profile, threads)
+        return
+    
+    # Long transcodes go through the segment-parallel encoder instead
+    processes, segment_threads = segment_budget(threads)
+    segmented = (app.config['SEGMENT_ENCODING'] and not streaming
+                 and duration >= app.config['SEGMENT_MIN_DURATION']
+                 and (processes > 1 or app.config['SEGMENT_SHARED_DIR']))
+    # A checkpoint left by a restart is resumed whatever the budget is now
+    if plan['path'] == PATH_TRANSCODE and (segmented or load_checkpoint(segment_workdir(job_id))):
+        compress_with_segments(job_id, input_path, output_path, profile, plan, duration,
+                               processes, segment_threads, job.get('probe', {}).get('has_audio', True))
+        return
     
     # Optimized FFmpeg command for faster processing
-    cmd = [
-        ffmpeg_path,
-        '-i', input_path,
-        '-c:v', 'libx264',
-        '-preset', 'veryfast',  # Even faster preset
-        '-crf', '23',
-        '-maxrate', bitrate,
-        '-bufsize', f"{int(bitrate[:-1]) * 2}M",
-        '-pix_fmt', 'yuv420p',
-        '-c:a', 'aac',
-        '-b:a', '128k',
-        '-ac', '2',
-        '-ar', '44100',
-        '-movflags', 'faststart',
-        '-threads', '0',  # Use all available CPU cores
-        '-progress', 'pipe:1',  # Output progress to stdout
+    cmd = [ffmpeg_path, '-hide_banner', '-i', 'pipe:0' if streaming else input_path]
+    cmd += stream_args(plan, profile['maxrate'], preset=profile['preset'], crf=profile['crf'],
+                       filters=profile['filters'], encoder=profile['encoder'])
+    cmd += [
+        '-threads', str(threads),  # Per-job budget from the scheduler (0 = all cores)
+        *PROGRESS_ARGS,  # Progress blocks on stderr, alongside any errors
         '-y',  # Overwrite output file
         output_path
     ]
     
-    compression_status[job_id]['message'] = 'Encoding video...'
+    job_store.update(job_id, message=PATH_MESSAGES[plan['path']])
     
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                              universal_newlines=True, bufsize=1)
+    process = job_control.spawn(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                stdin=subprocess.PIPE if streaming else subprocess.DEVNULL,
+                                universal_newlines=True, bufsize=1)
+    # One reader for progress and the error tail
+    reader = ProgressReader(process.stderr, duration)
+    if streaming:
+        feeder = threading.Thread(target=ingest.feed_pipe, args=(source, process.stdin.buffer))
+        feeder.daemon = True
+        feeder.start()
     
-    current_time = 0
-    for line in process.stdout:
-        try:
-            if line.startswith('out_time_ms='):
-                time_str = line.split('=')[1].strip()
-                if time_str and time_str != 'N/A':
-                    time_ms = int(time_str)
-                    current_time = time_ms / 1000000  # Convert to seconds
-                    
-                    if duration > 0:
-                        progress = min(int((current_time / duration) * 80) + 10, 95)  # 10-95%
-                        compression_status[job_id]['progress'] = progress
-                        compression_status[job_id]['message'] = f'Encoding... {current_time:.1f}s / {duration:.1f}s'
-            
-            elif line.startswith('speed='):
-                speed = line.split('=')[1].strip()
-                if 'x' in speed and speed != 'N/A':
-                    compression_status[job_id]['speed'] = speed
-        except (ValueError, IndexError):
-            continue  # Skip invalid lines
+    frames_done = None
+    verb = 'Encoding' if plan['path'] == PATH_TRANSCODE else 'Copying'
+    for update in reader:
+        fields = {'fps': update['fps'], 'output_size': update['total_size'],
+                  'projected_size': update['projected_size']}
+        if update['speed'] is not None:
+            fields['speed'] = f"{update['speed']:.2f}x"
+        if update['out_time'] is not None and duration > 0:
+            fields['progress'] = min(int(update['fraction'] * 80) + 10, 95)  # 10-95%
+            fields['message'] = f"{verb}... {update['out_time']:.1f}s / {duration:.1f}s"
+        job_store.update(job_id, **fields)
+        record_encode_rate(job_id, fps=update['fps'], speed=update['speed'])
+        if update['done']:
+            # Frames are done; what's left is the muxer (moov move for faststart)
+            frames_done = time.monotonic()
     
     process.wait()
+    tracer.stderr(job_id, 'encode', reader)
+    ingest.remove(job_id)
     
+    if streaming and source.error:
+        raise Exception(f"Upload interrupted: {source.error}")
     if process.returncode != 0:
-        try:
-            error = process.stderr.read()
-        except:
-            error = "Unknown FFmpeg error"
-        raise Exception(f"FFmpeg error: {error}")
+        raise Exception(f"FFmpeg error: {reader.text() or 'Unknown FFmpeg error'}")
+    if frames_done is not None:
+        tracer.record(job_id, 'faststart', frames_done, time.monotonic() - frames_done)
     
-    compression_status[job_id]['progress'] = 95
-    compression_status[job_id]['message'] = 'Finalizing...'
+    job_store.update(job_id, progress=95, message='Finalizing...')
 
-@app.route('/status/<job_id>')
-def get_status(job_id):
-    if job_id not in compression_status:
-        return jsonify({'error': 'Job not found'}), 404
+def compress_to_target_size(job_id, input_path, output_path, target_bytes, duration, plan,
+                            content_digest, profile, threads=0):
+    from mp4_compressor import find_ffmpeg
+    
+    ffmpeg_path = find_ffmpeg()
+    prefix = stats_prefix(app.config['PASSLOG_DIR'], content_digest or job_id, profile['preset'],
+                          profile['filters'])
+    job_store.update(job_id, encode_mode='two-pass')
+    
+    pass_started = {}
+    
+    def on_progress(pass_number, seconds):
+        elapsed = time.monotonic() - pass_started.setdefault(pass_number, time.monotonic())
+        if elapsed >= 1:
+            record_encode_rate(job_id, speed=seconds / elapsed)
+        # Pass 1 fills 10-40%, pass 2 40-95% (or all of 10-95% with reused stats)
+        low, high = (10, 40) if pass_number == 1 else ((40, 95) if pass_1_ran else (10, 95))
+        progress = min(int(low + (seconds / duration) * (high - low)), high)
+        label = 'Analyzing (pass 1)' if pass_number == 1 else 'Encoding (pass 2)'
+        job_store.update(job_id, progress=progress, message=f'{label}... {seconds:.1f}s / {duration:.1f}s')
+    
+    pass_1_ran = not has_stats(prefix)
+    metric_cache.inc(cache='passlog', result='miss' if pass_1_ran else 'hit')
+    try:
+        result = encode_to_size(ffmpeg_path, input_path, output_path, target_bytes, duration,
+                                audio_args(plan), prefix,
+                                audio_bitrate=audio_budget(job_store.get(job_id).get('probe')),
+                                preset=profile['preset'], threads=threads,
+                                video_filters=profile['filters'], on_progress=on_progress)
+    except ValueError as e:
+        raise Exception(str(e))
+    print(f"Job {job_id} two-pass result: {format_size(result['final_size'])} "
+          f"({result['deviation']:+.1f}% vs target, {result['attempts']} attempt(s), "
+          f"stats reused: {result['stats_reused']})")
+    job_store.update(job_id, progress=95, message='Finalizing...',
+                     target_video_bitrate=format_bitrate(result['video_bitrate']),
+                     target_attempts=result['attempts'], passlog_reused=result['stats_reused'])
+
+def compress_renditions(job_id, input_path, output_path, bitrate, job, threads=0, preset_shift=0):
+    """Encode every requested rendition from one decode; the largest goes to output_path"""
+    from mp4_compressor import find_ffmpeg
+    
+    duration = job.get('duration', 0)
+    info = job.get('probe')
+    try:
+        plans = renditions.plan_renditions(info, list(job['renditions']), bitrate, job.get('goal'))
+    except ValueError as e:
+        raise Exception(str(e))
+    for plan in plans:
+        plan['profile'], choice = pick_encoder(plan['profile'], extra_shift=preset_shift)
+    outputs = {plan['name']: renditions.output_path(output_path, plan['name']) for plan in plans}
+    outputs[plans[0]['name']] = output_path  # /download/<job_id> serves the largest
+    
+    states = {plan['name']: {
+        'status': 'encoding',
+        'progress': 0,
+        'profile': describe(plan['profile']),
+        'resolution': f"{plan['profile']['width']}x{plan['profile']['height']}",
+        'path': outputs[plan['name']],
+    } for plan in plans}
+    for name in job['renditions']:
+        states.setdefault(name, {'status': 'skipped', 'progress': 0,
+                                 'message': 'Source is smaller than this rendition'})
+    job_store.update(job_id, encode_mode='renditions', encode_path=PATH_TRANSCODE,
+                     encoder=plans[0]['profile']['encoder'], encoder_load=choice['load'],
+                     renditions=states, message=f'Encoding {len(plans)} renditions...')
+    print(f"Job {job_id} renditions: " + '; '.join(state['profile'] for state in states.values()
+                                                    if 'profile' in state))
+    
+    started = time.monotonic()
+    
+    def on_progress(seconds, sizes):
+        # One decode feeds every encoder, so they advance together; sizes differ
+        record_encode_rate(job_id, speed=seconds / max(time.monotonic() - started, 0.001))
+        fraction = min(seconds / duration, 1) if duration else 0
+        for name, size in sizes.items():
+            states[name].update(progress=min(int(fraction * 100), 99),
+                                size=f"{size / (1024 * 1024):.1f} MB")
+        job_store.update(job_id, renditions=states, progress=min(int(fraction * 80) + 10, 95),
+                         message=f'Encoding {len(plans)} renditions... {seconds:.1f}s / {duration:.1f}s')
+    
+    sizes = renditions.encode_renditions(find_ffmpeg(), input_path, plans, outputs,
+                                         has_audio=(info or {}).get('has_audio', True),
+                                         threads=threads, on_progress=on_progress)
+    original_size = os.path.getsize(input_path)
+    for name, size in sizes.items():
+        states[name].update(status='completed', progress=100,
+                            **size_report(original_size, size))
+        states[name].pop('size', None)
+    job_store.update(job_id, renditions=states, progress=95, message='Finalizing...')
+
+def segment_budget(threads):
+    """Split a job's thread budget into parallel segment encodes x threads each"""
+    threads = threads or os.cpu_count() or 1
+    processes = app.config['SEGMENT_PROCESSES'] or max(1, threads // 2)
+    return processes, max(1, threads // processes)
+
+def segment_workdir(job_id):
+    """Segment scratch directory; it outlives a crash so the job can resume there"""
+    return os.path.join(app.config['SEGMENT_SHARED_DIR'] or app.config['UPLOAD_FOLDER'],
+                        f"{job_id}_segments")
+
+def compress_with_segments(job_id, input_path, output_path, profile, plan, duration,
+                           processes, segment_threads, has_audio=True):
+    from mp4_compressor import find_ffmpeg
+    from segment_encoder import encode_segmented, EXECUTOR_PROCESS, EXECUTOR_SHARED
+    
+    ffmpeg_path = find_ffmpeg()
+    shared_dir = app.config['SEGMENT_SHARED_DIR']
+    workdir = segment_workdir(job_id)
+    started = time.time()
+    
+    checkpoint = load_checkpoint(workdir)
+    if checkpoint:
+        print(f"Job {job_id} resuming: {len(checkpoint['done'])} of "
+              f"{len(checkpoint['segments'])} segments already encoded")
+        job_store.update(job_id, segments_resumed=len(checkpoint['done']))
+    job_store.update(job_id, encode_mode='segmented',
+                     message='Resuming segments...' if checkpoint else 'Splitting video into segments...')
+    
+    def on_progress(encoded_seconds, segments_done, segments_total):
+        job_control.check(job_id)  # leave the wait loop once cancelled (shared-dir segments)
+        # Same 10-95% window and fields as the single-process encoder
+        progress = min(int((encoded_seconds / duration) * 80) + 10, 95)
+        elapsed = max(time.time() - started, 0.001)
+        record_encode_rate(job_id, speed=encoded_seconds / elapsed)
+        job_store.update(job_id, progress=progress,
+                         segments_done=segments_done, segments_total=segments_total,
+                         message=(f'Encoding {segments_total} segments... '
+                                  f'{encoded_seconds:.1f}s / {duration:.1f}s'),
+                         speed=f'{encoded_seconds / elapsed:.2f}x')
+    
+    segments = encode_segmented(
+        ffmpeg_path, input_path, output_path,
+        profile_video_args(plan, profile), audio_args(plan),
+        duration, workdir,
+        processes=processes, threads=segment_threads, on_progress=on_progress,
+        segment_seconds=app.config['SEGMENT_SECONDS'],
+        executor=EXECUTOR_SHARED if shared_dir else EXECUTOR_PROCESS,
+        shared_dir=shared_dir or None,
+        has_audio=has_audio,
+        resumable=True)
+    print(f"Job {job_id} encoded as {segments} segments ({processes} x {segment_threads} threads)")
+    
+    job_store.update(job_id, progress=95, message='Finalizing...')
+
+def build_status(job_id):
+    """Job status as served to clients, or None if the job doesn't exist"""
+    status = job_store.get(job_id)
+    if status is None:
+        return None
     
-    status = compression_status[job_id].copy()
+    # Live queue position while waiting for a worker
+    if status['status'] == 'queued':
+        position = (job_queue or scheduler).position(job_id)
+        if position is not None:
+            status['queue_position'] = position
+            status['message'] = f'Waiting in queue (position {position})...'
+    
+    # Change token for long-poll clients (before the time-derived fields below)
+    status['version'] = hashlib.md5(json.dumps(status, sort_keys=True).encode()).hexdigest()[:12]
     
     # Add elapsed time
     if 'start_time' in status:
@@ -259,78 +1583,200 @@ def get_status(job_id):
             remaining = max(0, total_estimated - elapsed)
             status['eta'] = f'{int(remaining//60)}m {int(remaining%60)}s' if remaining >= 60 else f'{int(remaining)}s'
     
-    # Add current output file size during processing
-    if status['status'] == 'processing' and 'download_path' in compression_status[job_id]:
-        output_path = compression_status[job_id]['download_path']
-        if os.path.exists(output_path):
-            current_size = os.path.getsize(output_path) / (1024 * 1024)
-            status['current_size'] = f'{current_size:.1f} MB'
-    
-    # Add file size info if completed
-    if status['status'] == 'completed' and 'download_path' in status:
+    return status
+
+def wait_for_status_change(job_id, since_version, timeout):
+    """Block until the job's status version differs from since_version (or timeout)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        local_version = job_events.version(job_id)
+        status = build_status(job_id)
+        remaining = deadline - time.monotonic()
+        if status is None or status['version'] != since_version or remaining <= 0:
+            return status
+        # Wake on local updates; re-check periodically for other workers' updates
+        job_events.wait(job_id, local_version,
+                        min(remaining, app.config['STATUS_RECHECK_INTERVAL']))
+
+def too_many_held_requests():
+    """503 for a long-poll or stream that would hold one thread too many"""
+    response = jsonify({'error': 'Too many clients waiting for updates, poll /status instead'})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+@app.route('/status/<job_id>')
+def get_status(job_id):
+    # Long-poll: ?wait=<seconds>&since=<version> holds the request until something changes
+    wait = min(request.args.get('wait', 0, type=float), app.config['LONG_POLL_MAX_WAIT'])
+    since = request.args.get('since')
+    if wait > 0 and since:
+        if not held_request_slots.acquire(blocking=False):
+            return too_many_held_requests()
         try:
-            # Find original file path
-            original_path = status['download_path'].replace('outputs', 'uploads')
-            original_path = original_path.replace(status['output_file'], status['input_file'])
-            
-            if os.path.exists(original_path) and os.path.exists(status['download_path']):
-                original_size = os.path.getsize(original_path)
-                compressed_size = os.path.getsize(status['download_path'])
-                status['original_size'] = f"{original_size / (1024*1024):.1f} MB"
-                status['compressed_size'] = f"{compressed_size / (1024*1024):.1f} MB"
-                status['reduction'] = f"{(1 - compressed_size/original_size) * 100:.1f}%"
-        except Exception as e:
-            print(f"Error calculating file sizes: {e}")
+            status = wait_for_status_change(job_id, since, wait)
+        finally:
+            held_request_slots.release()
+    else:
+        status = build_status(job_id)
     
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if status['status'] in ACTIVE_STATUSES:
+        touch_heartbeat(job_id)
     return jsonify(status)
 
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Cancel a queued or running job (its ffmpeg is stopped and its files removed)"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] not in ACTIVE_STATUSES:
+        return jsonify({'error': f"Job already {job['status']}", 'status': job['status']}), 409
+    # The worker that owns the job may be another process: it acts on the flag
+    job_store.update(job_id, cancel_requested=CANCELLED)
+    state = cancel_job(job_id, CANCELLED)
+    print(f"Cancel requested for job {job_id} ({state or 'owned by another worker'})")
+    return jsonify(build_status(job_id)), 202
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """Phase spans and the encode's stderr tail (?format=jsonl for the raw trace lines)"""
+    records = tracer.read(job_id)
+    if records is None:
+        return jsonify({'error': 'No trace for this job'}), 404
+    if request.args.get('format') == 'jsonl':
+        body = ''.join(json.dumps(record) + '\n' for record in records)
+        return Response(body, mimetype='application/x-ndjson')
+    
+    spans = sorted((r for r in records if r.get('type') == 'span'), key=lambda r: r['start'])
+    phases = {}
+    for span in spans:
+        if span['name'] != 'total':
+            phases[span['name']] = round(phases.get(span['name'], 0) + span['duration'], 6)
+    stderr = {r['name']: {'lines': r['lines'], 'total_lines': r['total_lines']}
+              for r in records if r.get('type') == 'stderr'}
+    return jsonify({'job_id': job_id, 'phases': phases, 'spans': spans, 'stderr': stderr})
+
+@app.route('/events/<job_id>')
+def job_events_stream(job_id):
+    """Server-Sent Events stream of status updates, coalesced to STATUS_PUSH_INTERVAL"""
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    push_interval = app.config['STATUS_PUSH_INTERVAL']
+    max_seconds = app.config['SSE_MAX_STREAM_SECONDS']
+    if not held_request_slots.acquire(blocking=False):
+        return too_many_held_requests()
+    
+    def generate():
+        # Browsers reconnect automatically when the stream ends
+        yield 'retry: 1000\n\n'
+        started = time.monotonic()
+        version = None
+        while time.monotonic() - started < max_seconds:
+            status = wait_for_status_change(job_id, version, 15)
+            if status is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            if status['status'] in ACTIVE_STATUSES:
+                touch_heartbeat(job_id)  # an open stream counts as a watching client
+            if status['version'] == version:
+                yield ': keepalive\n\n'
+                continue
+            version = status['version']
+            yield f'data: {json.dumps(status)}\n\n'
+            if status['status'] in ('completed', 'error', 'cancelled'):
+                return
+            # Coalesce bursts of progress updates
+            time.sleep(push_interval)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    response.call_on_close(held_request_slots.release)
+    return response
+
 @app.route('/download/<job_id>')
-def download_file(job_id):
-    print(f"Download request for job_id: {job_id}")
+@app.route('/download/<job_id>/<rendition>')
+def download_file(job_id, rendition=None):
+    started = time.monotonic()
+    print(f"Download request for job_id: {job_id}" + (f" ({rendition})" if rendition else ''))
     
-    if job_id not in compression_status:
-        print(f"Job {job_id} not found in compression_status")
+    job = job_store.get(job_id)
+    if job is None:
+        print(f"Job {job_id} not found in job store")
         return jsonify({'error': 'Job not found'}), 404
     
-    job_status = compression_status[job_id]['status']
+    job_status = job['status']
     print(f"Job {job_id} status: {job_status}")
     
     if job_status != 'completed':
         print(f"Job {job_id} not completed, current status: {job_status}")
         return jsonify({'error': f'File not ready - Status: {job_status}'}), 404
     
-    file_path = compression_status[job_id]['download_path']
+    file_path = job['download_path']
+    download_name = job['output_file']
+    if rendition:
+        entry = job.get('renditions', {}).get(rendition)
+        if not entry or entry.get('status') != 'completed':
+            return jsonify({'error': f'No {rendition} rendition for this job'}), 404
+        file_path = entry['path']
+        download_name = renditions.output_path(job['output_file'], rendition)
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
     
     # Get input file path for cleanup
-    input_file = compression_status[job_id]['input_file']
-    input_path = file_path.replace('outputs', 'uploads').replace(compression_status[job_id]['output_file'], input_file)
+    input_file = job['input_file']
+    input_path = job['download_path'].replace('outputs', 'uploads').replace(job['output_file'], input_file)
     
     try:
-        # Send file to user
-        response = send_file(file_path, as_attachment=True, 
-                           download_name=compression_status[job_id]['output_file'])
+        response = send_download(request, file_path, download_name,
+                                 offload=app.config['DOWNLOAD_OFFLOAD'],
+                                 accel_prefix=app.config['DOWNLOAD_ACCEL_PREFIX'])
         
-        # Schedule cleanup after response is sent
-        @response.call_on_close
-        def cleanup_files():
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(input_path):
-                    os.remove(input_path)
-                # Remove job from status tracking
-                if job_id in compression_status:
-                    del compression_status[job_id]
-            except Exception as e:
-                print(f"Cleanup error for job {job_id}: {e}")
+        # Keep the files for a grace period so a dropped download can resume
+        if request.method == 'GET' and response.status_code in (200, 206):
+            @response.call_on_close
+            def retain_files():
+                tracer.record(job_id, 'download', started, time.monotonic() - started,
+                              status_code=response.status_code, bytes=response.content_length,
+                              rendition=rendition)
+                metric_download_bytes.inc(response.content_length or 0)
+                schedule_download_expiry(job_id, file_path, input_path)
         
         return response
         
     except Exception as e:
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
+def schedule_download_expiry(job_id, file_path, input_path):
+    """Delete a downloaded job's files once DOWNLOAD_RETENTION passes without another download"""
+    retention = app.config['DOWNLOAD_RETENTION']
+    job_store.update(job_id, expires_at=time.time() + retention)
+    timer = threading.Timer(retention, expire_download, args=(job_id, file_path, input_path))
+    timer.daemon = True
+    timer.start()
+
+def expire_download(job_id, file_path, input_path):
+    job = job_store.get(job_id)
+    if job is not None and job.get('expires_at', 0) > time.time() + 1:
+        return  # downloaded again since; a later timer handles it
+    try:
+        # Every rendition shares the job's retention window
+        paths = [file_path] + [entry['path'] for entry in (job or {}).get('renditions', {}).values()
+                               if entry.get('path')]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(input_path):
+            os.remove(input_path)
+        # Remove job from status tracking
+        job_store.delete(job_id)
+        print(f"Download retention expired for job {job_id}")
+    except Exception as e:
+        print(f"Cleanup error for job {job_id}: {e}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Batch mode for the CLI: many files, several encodes at a time.
+
+Inputs come from directories (*.mp4 / *.mov, optionally recursive), glob
+patterns, or a manifest:
+
+    CSV with an 'input' column, and optionally output, bitrate, goal,
+    target_size, max_height, encoder
+    JSON, either a list of objects or one object per line, with the same keys
+
+Outputs mirror the input layout under the output directory. ffmpeg lookup,
+the encoder list and the thread budget are resolved once per batch, not
+once per file. Encodes run in a thread pool (the work happens in ffmpeg), and
+each gets --threads ffmpeg threads, by default the cores divided by the
+concurrency.
+
+A file is skipped when its output is up to date. The batch state file
+(.videoshrink-batch.json in the output directory) records each input's size,
+mtime, content hash and the settings used. A file is up to date when its
+settings match and its size and mtime are unchanged. With check_hash, a
+changed mtime with unchanged content (a copied tree) also counts as up to
+date. Outputs with no state entry, e.g. from earlier one-file runs, count as
+up to date when they are newer than their input.
+"""
+
+import csv
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from encode_plan import choose_encode_path, audio_args, format_bitrate, PATH_TRANSCODE
+from encode_profile import choose_profile, profile_video_args, describe, parse_goal, GOAL_BALANCED
+from encoders import available_backends, resolve_backend, DEFAULT_BACKEND
+from job_scheduler import threads_per_job
+from result_cache import hash_file
+from ffmpeg_progress import ProgressReader, PROGRESS_ARGS
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+STATE_FILE = '.videoshrink-batch.json'
+SUMMARY_FIELDS = ['input', 'output', 'status', 'reason', 'encode_path', 'profile', 'threads',
+                  'input_bytes', 'output_bytes', 'reduction_percent', 'duration',
+                  'encode_seconds', 'realtime_factor']
+
+STATUS_COMPLETED = 'completed'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def _is_video(path):
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def _output_for(input_path, root, output_dir):
+    # Keep the layout below the source root; outputs are always .mp4
+    relative = os.path.relpath(input_path, root) if root else os.path.basename(input_path)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + '.mp4')
+
+
+def collect_jobs(sources, output_dir, recursive=False, defaults=None):
+    """
+    Expand directories, globs and file paths into job dicts (input, output and
+    settings). Files are de-duplicated; the first source listing one wins.
+    """
+    jobs, seen = [], set()
+
+    def add(path, root):
+        path = os.path.abspath(path)
+        if path in seen or not _is_video(path):
+            return
+        seen.add(path)
+        jobs.append(dict(defaults or {}, input=path, output=_output_for(path, root, output_dir)))
+
+    for source in sources:
+        if os.path.isdir(source):
+            pattern = os.path.join(source, '**', '*') if recursive else os.path.join(source, '*')
+            for path in sorted(glob.glob(pattern, recursive=recursive)):
+                add(path, os.path.abspath(source))
+        elif glob.has_magic(source):
+            for path in sorted(glob.glob(source, recursive=True)):
+                add(path, None)
+        elif os.path.exists(source):
+            add(source, None)
+        else:
+            print(f"Skipping {source}: not found")
+    return jobs
+
+
+def load_manifest(path, output_dir, defaults=None):
+    """Jobs from a CSV or JSON manifest; relative inputs are relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            text = f.read().strip()
+            rows = json.loads(text) if text.startswith('[') else [
+                json.loads(line) for line in text.splitlines() if line.strip()]
+
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        row = {key.strip(): value for key, value in row.items() if value not in (None, '')}
+        if 'input' not in row:
+            raise ValueError(f"Manifest {path} entry {number} has no 'input'")
+        job = dict(defaults or {})
+        job.update(row)
+        job['input'] = os.path.join(base, row['input'])
+        job['output'] = (os.path.join(base, row['output']) if row.get('output')
+                         else _output_for(job['input'], None, output_dir))
+        jobs.append(job)
+    return jobs
+
+
+def settings_key(job):
+    """The settings that decide what an output looks like (for up-to-date checks)"""
+    return {key: job.get(key) for key in ('bitrate', 'goal', 'target_size', 'max_height', 'encoder')}
+
+
+class BatchState:
+    """Per-output record of the input and settings each output was made from"""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_FILE)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, job, check_hash=False):
+        """(True, reason) if job['output'] needn't be encoded again"""
+        output = job['output']
+        if not os.path.exists(output):
+            return False, None
+        stat = os.stat(job['input'])
+        entry = self.entries.get(os.path.abspath(output))
+        if entry is None:
+            if os.path.getmtime(output) >= stat.st_mtime:
+                return True, 'output newer than input'
+            return False, None
+        if entry['settings'] != settings_key(job):
+            return False, None
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return True, 'input unchanged'
+        if check_hash and entry['size'] == stat.st_size and entry['hash'] == hash_file(job['input']):
+            return True, 'input content unchanged'
+        return False, None
+
+    def record(self, job):
+        # Always hashed, so a later check_hash run can compare against it
+        stat = os.stat(job['input'])
+        entry = {'input': job['input'], 'size': stat.st_size, 'mtime': stat.st_mtime,
+                 'settings': settings_key(job), 'hash': hash_file(job['input'])}
+        with self._lock:
+            self.entries[os.path.abspath(job['output'])] = entry
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def _run_ffmpeg(cmd, duration):
+    """Run an ffmpeg command; returns its last -progress update"""
+    process = subprocess.Popen(cmd[:1] + PROGRESS_ARGS + cmd[1:], stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    reader = ProgressReader(process.stderr, duration)
+    last = reader.drain()
+    process.wait()
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg error: {reader.text()}")
+    return last
+
+
+def encode_job(ffmpeg_path, job, backends, threads):
+    """
+    Encode one batch job with the web app's rules (passthrough when the input
+    already fits, profile ladder otherwise). Returns a result dict.
+    """
+    from video_probe import probe_video
+    from target_size import (parse_size, solve_video_bitrate, audio_budget, encode_to_size,
+                             stats_prefix)
+
+    info = probe_video(job['input'])
+    if not info['has_video']:
+        raise Exception("no video stream")
+    bitrate = job.get('bitrate') or '2M'
+    goal = parse_goal(job.get('goal'), GOAL_BALANCED)
+    max_height = int(job.get('max_height') or 1080)
+    target_bytes = parse_size(job['target_size']) if job.get('target_size') else None
+    if target_bytes:
+        bitrate = format_bitrate(solve_video_bitrate(target_bytes, info['duration'], audio_budget(info)))
+
+    profile = choose_profile(info, bitrate, goal, max_height)
+    if not target_bytes:
+        profile['encoder'] = resolve_backend(job.get('encoder') or DEFAULT_BACKEND, backends)
+    plan = choose_encode_path(info, bitrate, profile)
+    os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+    partial = job['output'] + '.part.mp4'  # a killed batch never leaves a plausible-looking output
+
+    if target_bytes and plan['path'] == PATH_TRANSCODE:
+        import tempfile
+        prefix = stats_prefix(os.path.join(tempfile.gettempdir(), 'videoshrink-passlogs'),
+                              info['content_hash'], profile['preset'], profile['filters'])
+        encode_to_size(ffmpeg_path, job['input'], partial, target_bytes, info['duration'],
+                       audio_args(plan), prefix, audio_bitrate=audio_budget(info),
+                       preset=profile['preset'], threads=threads, video_filters=profile['filters'])
+    else:
+        cmd = [ffmpeg_path, '-v', 'error', '-nostdin', '-i', job['input']]
+        cmd += profile_video_args(plan, profile) + audio_args(plan)
+        cmd += ['-movflags', 'faststart', '-threads', str(threads), '-y', partial]
+        _run_ffmpeg(cmd, info['duration'])
+    os.replace(partial, job['output'])
+    return {'info': info, 'profile': profile, 'plan': plan, 'bitrate': bitrate}
+
+
+def write_summary(path, rows):
+    """Batch results as CSV, or JSON when the path ends in .json"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_batch(jobs, output_dir, concurrency=2, threads=0, check_hash=False, force=False,
+              summary_path=None, ffmpeg_path=None, on_complete=None):
+    """
+    Encode every job, concurrency at a time. Returns the summary rows.
+
+    on_complete(job, result, seconds) is called for each finished encode
+    (the CLI prints its usual compression summary from it).
+    """
+    from mp4_compressor import find_ffmpeg
+
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg not found. Please install FFmpeg and add to PATH")
+    backends = available_backends(ffmpeg_path)
+    concurrency = max(1, concurrency)
+    threads = threads or threads_per_job(concurrency)
+    state = BatchState(output_dir)
+
+    rows = []
+    rows_lock = threading.Lock()
+    pending = []
+    for job in jobs:
+        if not os.path.isfile(job['input']):
+            rows.append({'input': job['input'], 'output': job['output'], 'status': STATUS_FAILED,
+                         'reason': 'input not found'})
+            continue
+        current, reason = (False, None) if force else state.is_current(job, check_hash)
+        if current:
+            rows.append({'input': job['input'], 'output': job['output'], 'status': STATUS_SKIPPED,
+                         'reason': reason, 'input_bytes': os.path.getsize(job['input'])})
+        else:
+            pending.append(job)
+
+    print(f"Batch: {len(jobs)} file(s), {len(pending)} to encode, {len(rows)} skipped "
+          f"({concurrency} at a time x {threads} threads)")
+    pbar = tqdm(total=len(pending), desc="Batch", unit="file", ncols=70)
+
+    def work(job):
+        start = time.time()
+        row = {'input': job['input'], 'output': job['output'], 'threads': threads,
+               'input_bytes': os.path.getsize(job['input'])}
+        try:
+            result = encode_job(ffmpeg_path, job, backends, threads)
+            elapsed = time.time() - start
+            duration = result['info']['duration']
+            output_bytes = os.path.getsize(job['output'])
+            row.update(status=STATUS_COMPLETED, encode_path=result['plan']['path'],
+                       profile=describe(result['profile']), output_bytes=output_bytes,
+                       reduction_percent=round((1 - output_bytes / row['input_bytes']) * 100, 1),
+                       duration=round(duration, 2), encode_seconds=round(elapsed, 2),
+                       realtime_factor=round(duration / elapsed, 2) if elapsed else None)
+            state.record(job)
+            if on_complete is not None:
+                with tqdm.external_write_mode():
+                    on_complete(job, result, elapsed)
+        except Exception as e:
+            row.update(status=STATUS_FAILED, reason=str(e)[-500:])
+            if os.path.exists(job['output'] + '.part.mp4'):
+                os.remove(job['output'] + '.part.mp4')
+            with tqdm.external_write_mode():
+                print(f"Failed: {job['input']}: {str(e)[-300:]}")
+        with rows_lock:
+            rows.append(row)
+        pbar.update(1)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(work, pending))
+    finally:
+        pbar.close()
+
+    summary_path = summary_path or os.path.join(output_dir, 'batch_summary.csv')
+    write_summary(summary_path, rows)
+    counts = {status: sum(1 for row in rows if row['status'] == status)
+              for status in (STATUS_COMPLETED, STATUS_SKIPPED, STATUS_FAILED)}
+    print(f"Batch done: {counts[STATUS_COMPLETED]} encoded, {counts[STATUS_SKIPPED]} skipped, "
+          f"{counts[STATUS_FAILED]} failed. Summary: {summary_path}")
+    return rows
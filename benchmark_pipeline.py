@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the compression pipeline on generated media
+
+Usage:
+    python benchmark_pipeline.py [--matrix quick|full] [--modes cli,web,stream]
+                                 [--repeat 3] [--output benchmark_results.json]
+                                 [--baseline previous_results.json] [--tolerance 10]
+
+Sources come from ffmpeg's lavfi test generators. Each one is a combination
+of resolution, duration, audio layout (none / mono / stereo / 5.1) and moov
+placement (front = faststart, end = as cameras write it), generated once into
+benchmark_media/. Every source then runs through each mode:
+
+    cli     - mp4_compressor.py as a user would run it
+    web     - POST /upload through Flask's test client, poll, download
+    stream  - POST /upload/stream (faststart sources start encoding mid-upload)
+
+Each run is a separate process. os.wait4 reports its peak RSS, which is the
+largest single process of the run, Python or ffmpeg. Per case the results
+record the median wall time, the throughput (input MB/s), the realtime factor
+(seconds of video per second), the peak RSS and the output size. Web runs
+also record their phase timings from /jobs/<id>/trace.
+
+With --baseline, each case is compared to the same case and mode in an
+earlier results file. Any wall time, peak RSS or output size that got worse
+by more than --tolerance percent is listed, and the exit status is 1.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mp4_compressor import find_ffmpeg
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_DIR = 'benchmark_media'
+
+RESOLUTIONS = {'480p': (854, 480), '720p': (1280, 720), '1080p': (1920, 1080), '2160p': (3840, 2160)}
+# Source bitrates in the range phones and cameras record at
+SOURCE_BITRATES = {'480p': '4M', '720p': '8M', '1080p': '16M', '2160p': '45M'}
+AUDIO_CHANNELS = {'none': 0, 'mono': 1, 'stereo': 2, '5.1': 6}
+MOOV_PLACEMENTS = ('front', 'end')
+
+MATRICES = {
+    'quick': {'resolutions': ['720p'], 'durations': [10], 'audio': ['none', 'stereo'],
+              'moov': list(MOOV_PLACEMENTS)},
+    'full': {'resolutions': list(RESOLUTIONS), 'durations': [10, 60], 'audio': list(AUDIO_CHANNELS),
+             'moov': list(MOOV_PLACEMENTS)},
+}
+MODES = ('cli', 'web', 'stream')
+
+# Compared against the baseline; all of them are better when lower
+COMPARED_METRICS = ('wall_seconds', 'peak_rss_mb', 'output_bytes')
+WEB_TIMEOUT = 3600  # seconds
+
+
+def case_name(resolution, duration, audio, moov):
+    return f"{resolution}_{duration}s_{audio}_{moov}"
+
+
+def generate_source(resolution, duration, audio, moov, media_dir=MEDIA_DIR):
+    """Create (once) a synthetic clip for one matrix cell and return its path"""
+    path = os.path.join(media_dir, case_name(resolution, duration, audio, moov) + '.mp4')
+    if os.path.exists(path):
+        return path
+    os.makedirs(media_dir, exist_ok=True)
+    width, height = RESOLUTIONS[resolution]
+    channels = AUDIO_CHANNELS[audio]
+
+    cmd = [find_ffmpeg() or 'ffmpeg', '-v', 'error', '-nostdin',
+           '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate=30:duration={duration}"]
+    if channels:
+        cmd += ['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}"]
+    cmd += ['-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', SOURCE_BITRATES[resolution],
+            '-pix_fmt', 'yuv420p']
+    if channels:
+        cmd += ['-c:a', 'aac', '-b:a', f"{64 * channels}k", '-ac', str(channels)]
+    if moov == 'front':
+        cmd += ['-movflags', 'faststart']
+    cmd += ['-y', path + '.part.mp4']
+
+    print(f"Generating {path}...")
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+    os.replace(path + '.part.mp4', path)
+    return path
+
+
+def measure(cmd, cwd):
+    """Run cmd to completion. Returns (exit code, output, wall seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, text=True)
+    output = process.stdout.read()
+    # wait4 instead of wait: the rusage covers the child and every process it waited for
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peak_kb = usage.ru_maxrss if sys.platform != 'darwin' else usage.ru_maxrss / 1024
+    return process.returncode, output, wall, peak_kb / 1024
+
+
+def run_once(mode, source, options):
+    """One end-to-end run in a scratch directory. Returns a result dict."""
+    workdir = tempfile.mkdtemp(prefix='videoshrink-bench-')
+    output = os.path.join(workdir, 'output.mp4')
+    try:
+        if mode == 'cli':
+            cmd = [sys.executable, os.path.join(REPO_DIR, 'mp4_compressor.py'), source, output,
+                   '--goal', options['goal']]
+        else:
+            cmd = [sys.executable, os.path.abspath(__file__), '--web-case', source, output,
+                   '--web-mode', mode, '--goal', options['goal']]
+        code, text, wall, peak_rss = measure(cmd, workdir)
+
+        result = {'wall_seconds': round(wall, 3), 'peak_rss_mb': round(peak_rss, 1)}
+        report = next((line[len('RESULT '):] for line in text.splitlines()
+                       if line.startswith('RESULT ')), None)
+        if report:
+            result.update(json.loads(report))
+        if code != 0 or not os.path.exists(output) or not os.path.getsize(output):
+            result['status'] = 'error'
+            result.setdefault('error', text.strip()[-500:] or f"exit code {code}")
+            return result
+        result['status'] = 'ok'
+        result['output_bytes'] = os.path.getsize(output)
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_case(mode, source, info, options):
+    """Repeated runs of one case, summarised by the median wall time"""
+    runs = [run_once(mode, source, options) for _ in range(options['repeat'])]
+    ok = [run for run in runs if run['status'] == 'ok']
+    summary = {'case': info['case'], 'mode': mode, 'source': info,
+               'runs': [run['wall_seconds'] for run in runs]}
+    if not ok:
+        summary.update(status='error', error=runs[-1].get('error'))
+        return summary
+
+    median = sorted(ok, key=lambda run: run['wall_seconds'])[len(ok) // 2]
+    wall = statistics.median(run['wall_seconds'] for run in ok)
+    summary.update(
+        status='ok',
+        wall_seconds=round(wall, 3),
+        throughput_mbps=round(info['input_bytes'] / (1024 * 1024) / wall, 2),
+        realtime_factor=round(info['duration'] / wall, 2),
+        peak_rss_mb=max(run['peak_rss_mb'] for run in ok),
+        output_bytes=median['output_bytes'],
+        ratio=round(median['output_bytes'] / info['input_bytes'], 4),
+    )
+    if median.get('phases'):
+        summary['phases'] = median['phases']
+    return summary
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run([find_ffmpeg() or 'ffmpeg', '-version'], capture_output=True,
+                                text=True, stdin=subprocess.DEVNULL)
+        return result.stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return 'unknown'
+
+
+def run_matrix(matrix, modes, options):
+    results = []
+    cells = itertools.product(matrix['resolutions'], matrix['durations'], matrix['audio'],
+                              matrix['moov'])
+    for resolution, duration, audio, moov in cells:
+        source = generate_source(resolution, duration, audio, moov, options['media_dir'])
+        info = {'case': case_name(resolution, duration, audio, moov), 'resolution': resolution,
+                'duration': duration, 'audio': audio, 'moov': moov,
+                'input_bytes': os.path.getsize(source)}
+        for mode in modes:
+            result = run_case(mode, os.path.abspath(source), info, options)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result):
+    label = f"{result['case']:<28s} {result['mode']:<7s}"
+    if result['status'] != 'ok':
+        print(f"{label} ERROR {result.get('error', '')[:200]}")
+        return
+    print(f"{label} {result['wall_seconds']:7.2f}s  {result['realtime_factor']:6.2f}x realtime  "
+          f"{result['throughput_mbps']:7.2f} MB/s  RSS {result['peak_rss_mb']:7.1f} MB  "
+          f"out {result['output_bytes'] / (1024 * 1024):6.1f} MB ({result['ratio'] * 100:.1f}%)")
+
+
+def compare(results, baseline, tolerance):
+    """Per-metric changes against a baseline results list. Returns the regressions."""
+    previous = {(r['case'], r['mode']): r for r in baseline if r.get('status') == 'ok'}
+    regressions = []
+    print("-" * 60)
+    print(f"Compared with baseline (tolerance {tolerance:g}%)")
+    for result in results:
+        before = previous.get((result['case'], result['mode']))
+        if before is None or result['status'] != 'ok':
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            if not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            changes.append(f"{metric} {change:+.1f}%")
+            if change > tolerance:
+                regressions.append({'case': result['case'], 'mode': result['mode'],
+                                    'metric': metric, 'baseline': before[metric],
+                                    'current': result[metric], 'change_percent': round(change, 1)})
+        print(f"{result['case']:<28s} {result['mode']:<7s} " + ', '.join(changes))
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']} {regression['mode']}: {regression['metric']} "
+              f"{regression['baseline']} -> {regression['current']} ({regression['change_percent']:+.1f}%)")
+    if not regressions:
+        print("No regressions")
+    return regressions
+
+
+def run_web_case(input_path, output_path, mode, goal):
+    """
+    Child process for one web run: drive the Flask app in-process through the
+    test client and write the download to output_path. Prints 'RESULT {json}'.
+    """
+    # Fresh, isolated app state in the scratch directory this runs in
+    os.environ.update(JOB_STORE='memory', RESULT_CACHE_ENABLED='0', GOVERNOR_ENABLED='0',
+                      METRICS_DIR='', TRACE_DIR='traces', ENCODE_GOAL=goal)
+    sys.path.insert(0, REPO_DIR)
+    import app as web
+
+    client = web.app.test_client()
+    name = os.path.basename(input_path)
+    with open(input_path, 'rb') as f:
+        if mode == 'stream':
+            response = client.post(f"/upload/stream?filename={name}", input_stream=f,
+                                   content_length=os.path.getsize(input_path),
+                                   content_type='application/octet-stream')
+        else:
+            response = client.post('/upload', data={'video': (f, name)})
+    if response.status_code != 200:
+        raise Exception(f"Upload failed ({response.status_code}): {response.get_data(as_text=True)}")
+    job_id = response.json['job_id']
+
+    deadline = time.monotonic() + WEB_TIMEOUT
+    status = client.get(f"/status/{job_id}").json
+    while status['status'] not in ('completed', 'error') and time.monotonic() < deadline:
+        status = client.get(f"/status/{job_id}?wait=25&since={status['version']}").json
+    if status['status'] != 'completed':
+        raise Exception(f"Job {job_id} ended as {status['status']}: {status.get('message')}")
+
+    download = client.get(f"/download/{job_id}", buffered=False)
+    with open(output_path, 'wb') as f:
+        for chunk in download.response:
+            f.write(chunk)
+    download.close()
+
+    trace = client.get(f"/jobs/{job_id}/trace")
+    phases = trace.json['phases'] if trace.status_code == 200 else {}
+    print('RESULT ' + json.dumps({'phases': phases, 'encode_path': status.get('encode_path')}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end compression pipeline benchmark")
+    parser.add_argument('--matrix', choices=list(MATRICES), default='quick')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help=f"comma-separated subset of {', '.join(MODES)}")
+    parser.add_argument('--goal', default='balanced', help="encode goal for every run")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case (median is kept)")
+    parser.add_argument('--media-dir', default=MEDIA_DIR)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help="percent a metric may worsen before it counts as a regression")
+    parser.add_argument('--web-case', nargs=2, metavar=('INPUT', 'OUTPUT'), help=argparse.SUPPRESS)
+    parser.add_argument('--web-mode', default='web', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.web_case:
+        try:
+            run_web_case(args.web_case[0], args.web_case[1], args.web_mode, args.goal)
+            code = 0
+        except Exception as e:
+            print(f"Web run failed: {e}")
+            code = 1
+        sys.stdout.flush()
+        os._exit(code)  # the app's cleanup timer would keep the process alive
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+
+    options = {'goal': args.goal, 'repeat': max(1, args.repeat), 'media_dir': args.media_dir}
+    print(f"Benchmark matrix '{args.matrix}', modes {', '.join(modes)}, {options['repeat']} run(s) each")
+    print("-" * 60)
+    results = run_matrix(MATRICES[args.matrix], modes, options)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                 'cpu_count': os.cpu_count(), 'ffmpeg': ffmpeg_version()},
+        'matrix': args.matrix,
+        'goal': args.goal,
+        'repeat': options['repeat'],
+        'results': results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        report['baseline'] = args.baseline
+        report['regressions'] = regressions
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = [r for r in results if r['status'] != 'ok']
+    sys.exit(1 if regressions or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
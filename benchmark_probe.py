@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark container-header probing latency on large files
+
+Usage:
+    python benchmark_probe.py [file1.mp4 file2.mov ...]
+
+With no arguments a long synthetic clip is generated first (needs FFmpeg).
+Each file is probed cold (content hash + ffprobe) and warm (cache hit), and
+for comparison the time to decode the whole file is reported with --decode.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import video_probe
+from mp4_compressor import find_ffmpeg
+
+RUNS = 5
+
+
+def create_large_video(output_file, duration=600):
+    """Generate a long 1080p clip quickly (ultrafast preset, high bitrate)"""
+    ffmpeg_path = find_ffmpeg() or "ffmpeg"
+    cmd = [
+        ffmpeg_path,
+        "-f", "lavfi", "-i", f"testsrc2=duration={duration}:size=1920x1080:rate=30",
+        "-f", "lavfi", "-i", f"sine=frequency=1000:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "8M",
+        "-c:a", "aac", "-b:a", "128k",
+        "-pix_fmt", "yuv420p",
+        "-y", output_file
+    ]
+    print(f"Creating {duration}s benchmark clip: {output_file}")
+    subprocess.run(cmd, capture_output=True, check=True)
+
+
+def time_decode(path):
+    """Time a full decode of the file, which is what probing avoids"""
+    ffmpeg_path = find_ffmpeg() or "ffmpeg"
+    start = time.perf_counter()
+    subprocess.run([ffmpeg_path, "-v", "error", "-i", path, "-f", "null", "-"],
+                   capture_output=True)
+    return time.perf_counter() - start
+
+
+def benchmark_file(path, decode=False):
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+
+    cold = []
+    for _ in range(RUNS):
+        video_probe._cache.clear()
+        start = time.perf_counter()
+        info = video_probe.probe_video(path)
+        cold.append(time.perf_counter() - start)
+
+    warm = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        video_probe.probe_video(path)
+        warm.append(time.perf_counter() - start)
+
+    print("-" * 60)
+    print(f"File:      {path} ({size_mb:.1f} MB)")
+    print(f"Media:     {info.get('width')}x{info.get('height')} @ {info.get('fps')} fps, "
+          f"{info['duration']:.1f}s, {info.get('video_codec')}/{info.get('audio_codec')}")
+    print(f"Cold probe: median {sorted(cold)[RUNS // 2] * 1000:8.1f} ms  (min {min(cold) * 1000:.1f} ms)")
+    print(f"Warm probe: median {sorted(warm)[RUNS // 2] * 1000:8.3f} ms")
+    if decode:
+        print(f"Full decode:       {time_decode(path) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    decode = '--decode' in sys.argv
+
+    if not args:
+        args = ["benchmark_probe_input.mp4"]
+        if not os.path.exists(args[0]):
+            create_large_video(args[0])
+
+    for path in args:
+        if not os.path.exists(path):
+            print(f"File '{path}' not found")
+            continue
+        benchmark_file(path, decode=decode)
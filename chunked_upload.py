@@ -0,0 +1,207 @@
+"""
+Resumable chunked uploads.
+
+    init      - reserve an upload id and preallocate the destination file
+    PUT chunk - write chunk N at its offset with os.pwrite after checking its
+                length and SHA-256; a marker file acknowledges it
+    state     - list acknowledged chunks so a client can resume
+    finalize  - check every chunk arrived and hand the file over for encoding
+
+All state is on disk (a meta JSON plus one marker per chunk), so chunks of
+the same upload can be handled by different gunicorn workers and uploads
+survive a restart.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from result_cache import LEAF_SIZE, leaf_digests, combine_leaves
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+MIN_CHUNK_SIZE = LEAF_SIZE
+
+
+class UploadError(Exception):
+    """Chunked upload request that can't be honoured"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _state_dir(folder, upload_id):
+    return os.path.join(folder, f"{upload_id}.chunks")
+
+
+def load_upload(folder, upload_id):
+    """Meta dict for an upload (raises UploadError 404 if unknown)"""
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise UploadError('Upload not found', 404)
+    try:
+        with open(os.path.join(_state_dir(folder, upload_id), 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError('Upload not found', 404)
+
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass  # filesystem without fallocate support
+        f.truncate(size)
+
+
+def init_upload(folder, filename, size, max_size, chunk_size=None, params=None):
+    """Reserve an upload and preallocate its file. Returns the upload's meta dict."""
+    if size <= 0:
+        raise UploadError('File size required')
+    if size > max_size:
+        raise UploadError(f'File too large (max {max_size // (1024 * 1024)} MB)', 413)
+
+    chunk_size = min(max(int(chunk_size or DEFAULT_CHUNK_SIZE), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    chunk_size -= chunk_size % LEAF_SIZE  # whole cache-hash leaves per chunk
+    upload_id = str(uuid.uuid4())
+    meta = {
+        'upload_id': upload_id,
+        'filename': filename,
+        'size': size,
+        'chunk_size': chunk_size,
+        'total_chunks': (size + chunk_size - 1) // chunk_size,
+        'path': os.path.join(folder, f"{upload_id}_{filename}.part"),
+        'params': params or {},
+        'created': time.time(),
+    }
+
+    state_dir = _state_dir(folder, upload_id)
+    os.makedirs(state_dir)
+    _preallocate(meta['path'], size)
+    with open(os.path.join(state_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+def write_chunk(folder, upload_id, index, offset, data, checksum=None):
+    """Write one chunk in place. Returns the number of acknowledged chunks."""
+    meta = load_upload(folder, upload_id)
+    if not 0 <= index < meta['total_chunks']:
+        raise UploadError(f'Chunk {index} out of range')
+    expected_offset = index * meta['chunk_size']
+    if offset is not None and offset != expected_offset:
+        raise UploadError(f'Chunk {index} must start at offset {expected_offset}')
+    expected_length = min(meta['chunk_size'], meta['size'] - expected_offset)
+    if len(data) != expected_length:
+        raise UploadError(f'Chunk {index} should be {expected_length} bytes, got {len(data)}')
+
+    digest = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise UploadError(f'Checksum mismatch for chunk {index}', 422)
+
+    fd = os.open(meta['path'], os.O_WRONLY)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], expected_offset + written)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    # The marker is the acknowledgement; only written once the data is on disk.
+    # It holds the chunk's leaf digests for the result cache's content hash.
+    marker = os.path.join(_state_dir(folder, upload_id), f"{index}.ok")
+    with open(marker + '.tmp', 'w') as f:
+        f.write('\n'.join(leaf.hex() for leaf in leaf_digests(data)))
+    os.replace(marker + '.tmp', marker)
+    return len(_received(folder, upload_id))
+
+
+def _received(folder, upload_id):
+    return sorted(int(name[:-3]) for name in os.listdir(_state_dir(folder, upload_id))
+                  if name.endswith('.ok'))
+
+
+def upload_state(folder, upload_id):
+    """What the server has acknowledged, for resuming"""
+    meta = load_upload(folder, upload_id)
+    received = _received(folder, upload_id)
+    received_set = set(received)
+    contiguous = 0
+    while contiguous in received_set:
+        contiguous += 1
+    return {
+        'upload_id': upload_id,
+        'size': meta['size'],
+        'chunk_size': meta['chunk_size'],
+        'total_chunks': meta['total_chunks'],
+        'received': received,
+        'missing': [i for i in range(meta['total_chunks']) if i not in received_set],
+        'acknowledged_offset': min(contiguous * meta['chunk_size'], meta['size']),
+    }
+
+
+def finalize_upload(folder, upload_id, final_path):
+    """
+    Check every chunk arrived and move the file to final_path. The chunk
+    state is kept until discard_upload() so a rejected finalize can be retried
+    after restore_upload(). Returns the upload's meta dict.
+    """
+    meta = load_upload(folder, upload_id)
+    state = upload_state(folder, upload_id)
+    if state['missing']:
+        raise UploadError(f"{len(state['missing'])} chunks missing", 409)
+    os.replace(meta['path'], final_path)
+    return meta
+
+
+def content_digest(folder, upload_id):
+    """Result-cache content digest of a complete upload, from its chunk markers"""
+    meta = load_upload(folder, upload_id)
+    state_dir = _state_dir(folder, upload_id)
+    leaves = []
+    for index in range(meta['total_chunks']):
+        with open(os.path.join(state_dir, f"{index}.ok")) as f:
+            leaves += [bytes.fromhex(line) for line in f.read().split()]
+    return combine_leaves(leaves, meta['size'])
+
+
+def restore_upload(folder, upload_id, final_path):
+    """Undo finalize_upload (e.g. when the encode queue is full)"""
+    meta = load_upload(folder, upload_id)
+    os.replace(final_path, meta['path'])
+
+
+def discard_upload(folder, upload_id):
+    """Drop an upload's chunk state once its job has been created"""
+    shutil.rmtree(_state_dir(folder, upload_id), ignore_errors=True)
+
+
+def cleanup_stale_uploads(folder, max_age):
+    """Remove chunk state (and partial files) for uploads idle longer than max_age"""
+    now = time.time()
+    for name in os.listdir(folder):
+        if not name.endswith('.chunks'):
+            continue
+        state_dir = os.path.join(folder, name)
+        try:
+            newest = max([os.path.getmtime(state_dir)] +
+                         [os.path.getmtime(os.path.join(state_dir, f)) for f in os.listdir(state_dir)])
+            if now - newest <= max_age:
+                continue
+            with open(os.path.join(state_dir, 'meta.json')) as f:
+                part_path = json.load(f)['path']
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        except (OSError, ValueError, KeyError):
+            pass
+        shutil.rmtree(state_dir, ignore_errors=True)
+        print(f"Cleaned up stale upload: {state_dir}")
@@ -10,10 +10,9 @@ import sys
 def create_test_video():
     """Create a test MP4 file using FFmpeg"""
     
-    # Find FFmpeg path
-    ffmpeg_path = r"C:\Users\rongg\Code\ffmpeg\bin\ffmpeg.exe"
-    if not os.path.exists(ffmpeg_path):
-        ffmpeg_path = "ffmpeg"  # Try system PATH
+    # Find FFmpeg path (same lookup as the compressor)
+    from mp4_compressor import find_ffmpeg
+    ffmpeg_path = find_ffmpeg() or "ffmpeg"
     
     # Output filename
     output_file = "test_video.mp4"
@@ -0,0 +1,122 @@
+"""
+Download responses for finished outputs.
+
+Supports single-range requests (Range / If-Range) and ETag revalidation so an
+interrupted download can resume where it stopped. The body is a file wrapper
+positioned at the range start. Under gunicorn it goes out through os.sendfile
+(zero-copy), and under other servers it is read in bounded blocks. With a
+front proxy configured, the transfer can be handed off entirely:
+
+    x-accel     - nginx: X-Accel-Redirect to an internal location that maps to
+                  the outputs folder (nginx does ranges itself)
+    x-sendfile  - Apache mod_xsendfile / lighttpd: X-Sendfile with the path
+"""
+
+import mimetypes
+import os
+
+from flask import Response
+from werkzeug.http import http_date
+from werkzeug.wsgi import FileWrapper
+
+OFFLOAD_ACCEL = 'x-accel'
+OFFLOAD_SENDFILE = 'x-sendfile'
+BLOCK_SIZE = 256 * 1024
+
+
+class _FileRange:
+    """A file object limited to [start, start + length) that keeps its real fileno"""
+
+    def __init__(self, f, start, length, on_close=None):
+        self._f = f
+        self._remaining = length
+        self._on_close = on_close
+        f.seek(start)
+
+    def read(self, size=BLOCK_SIZE):
+        if self._remaining <= 0:
+            return b''
+        data = self._f.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # gunicorn sends Content-Length bytes from the current position with sendfile
+        return self._f.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._f.close()
+        # Direct passthrough bodies bypass Response.close, so run its callbacks here
+        if self._on_close is not None:
+            self._on_close()
+
+
+def file_etag(stat):
+    """Strong validator: changes whenever the file is replaced or rewritten"""
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(mtime) <= if_range.date.timestamp()
+    return True  # no If-Range header
+
+
+def send_download(request, path, download_name, offload=None, accel_prefix='/protected-outputs/'):
+    """Response for a GET/HEAD of path as an attachment (200, 206, 304 or 416)"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+    }
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    response = Response(mimetype=mimetype, headers=headers)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+
+    # The proxy reads the file, handles ranges and keeps the worker free
+    if offload == OFFLOAD_ACCEL:
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + os.path.basename(path)
+        return response
+    if offload == OFFLOAD_SENDFILE:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    start, length = 0, size
+    byte_range = request.range
+    # Multi-range requests get the whole file (allowed by RFC 9110)
+    if (byte_range is not None and len(byte_range.ranges) == 1
+            and _if_range_matches(request, etag, stat.st_mtime)):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            response = Response(status=416, headers=headers)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        start, stop = bounds
+        length = stop - start
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    f = open(path, 'rb')
+    body = _FileRange(f, start, length, on_close=response.close)
+    wrapper = request.environ.get('wsgi.file_wrapper', FileWrapper)
+    response.response = wrapper(body, BLOCK_SIZE)
+    response.direct_passthrough = True
+    response.headers['Content-Length'] = str(length)
+    return response
@@ -0,0 +1,150 @@
+"""
+Decide how much work an upload actually needs.
+
+Looks at the probed codec, pixel format, bitrate and audio layout and picks
+the cheapest path that still produces a YouTube-ready MP4:
+
+    copy       - every stream already fits and the moov is at the front; stream copy
+    remux      - every stream fits but the moov is at the end; stream copy
+    audio      - video fits, audio does not; copy video, re-encode audio only
+    transcode  - full video (libx264 or another backend from encoders.py) + AAC encode
+"""
+
+import re
+
+from encoders import codec_args, DEFAULT_BACKEND
+
+PATH_COPY = 'copy'
+PATH_REMUX = 'remux'
+PATH_AUDIO = 'audio'
+PATH_TRANSCODE = 'transcode'
+
+PATH_MESSAGES = {
+    PATH_COPY: 'Already optimized - copying streams...',
+    PATH_REMUX: 'Already optimized - moving index to front...',
+    PATH_AUDIO: 'Video already optimized - re-encoding audio only...',
+    PATH_TRANSCODE: 'Encoding video...',
+}
+
+AUDIO_BITRATE = '128k'
+# Audio up to this bitrate is kept as-is rather than re-encoded to 128k
+MAX_COPY_AUDIO_BITRATE = 192000
+COPY_SAMPLE_RATES = (44100, 48000)
+
+# Brands ffprobe reports for MOV files; they need a remux to become MP4
+QUICKTIME_BRANDS = ('qt',)
+
+
+def parse_bitrate(value):
+    """Convert an ffmpeg-style bitrate ('2M', '1.5M', '800k', '2000000') to bits/s"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([kKmMgG]?)\s*', str(value))
+    if not match:
+        raise ValueError(f"Invalid bitrate: {value}")
+    number, unit = float(match.group(1)), match.group(2).lower()
+    return int(number * {'': 1, 'k': 1000, 'm': 1000000, 'g': 1000000000}[unit])
+
+
+def format_bitrate(bits):
+    """Format bits/s the way ffmpeg options expect ('2M', '750k')"""
+    if bits >= 1000000 and bits % 100000 == 0:
+        return f"{bits / 1000000:g}M"
+    return f"{max(1, round(bits / 1000))}k"
+
+
+def _video_fits(info, max_video_bitrate):
+    if not info.get('has_video'):
+        return False, 'no video stream'
+    if info.get('video_codec') != 'h264':
+        return False, f"video codec {info.get('video_codec') or 'unknown'}"
+    if info.get('pix_fmt') != 'yuv420p':
+        return False, f"pixel format {info.get('pix_fmt') or 'unknown'}"
+
+    # Per-stream bitrate is missing for some muxers; fall back to the overall rate
+    video_bit_rate = info.get('video_bit_rate') or max(
+        0, info.get('bit_rate', 0) - info.get('audio_bit_rate', 0))
+    if not video_bit_rate:
+        return False, 'unknown video bitrate'
+    if video_bit_rate > max_video_bitrate:
+        return False, f"video bitrate {video_bit_rate // 1000}k above target"
+    return True, 'video fits target'
+
+
+def _audio_fits(info):
+    if not info.get('has_audio'):
+        return True, 'no audio stream'
+    if info.get('audio_codec') != 'aac':
+        return False, f"audio codec {info.get('audio_codec') or 'unknown'}"
+    if info.get('audio_channels', 0) > 2:
+        return False, f"{info['audio_channels']} audio channels"
+    if info.get('audio_sample_rate') not in COPY_SAMPLE_RATES:
+        return False, f"audio sample rate {info.get('audio_sample_rate')}"
+    if info.get('audio_bit_rate', 0) > MAX_COPY_AUDIO_BITRATE:
+        return False, 'audio bitrate above target'
+    return True, 'audio fits target'
+
+
+def choose_encode_path(info, bitrate, profile=None):
+    """
+    Pick the cheapest encode path for a probed input.
+
+    Args:
+        info: Summary dict from video_probe.probe_video (None forces transcode)
+        bitrate: Requested maximum video bitrate ('2M')
+        profile: Output profile from encode_profile.choose_profile; a resize or
+                 fps cap rules out copying the video
+
+    Returns a dict with 'path', per-stream 'video'/'audio' actions and a
+    human readable 'reason'.
+    """
+    if not info:
+        return {'path': PATH_TRANSCODE, 'video': 'transcode', 'audio': 'transcode',
+                'reason': 'input not probed'}
+
+    if profile and (profile['scale'] or profile['fps']):
+        return {'path': PATH_TRANSCODE, 'video': 'transcode', 'audio': 'transcode',
+                'reason': f"resizing to {profile['name']}"}
+
+    video_ok, video_reason = _video_fits(info, parse_bitrate(bitrate))
+    audio_ok, audio_reason = _audio_fits(info)
+
+    if not video_ok:
+        return {'path': PATH_TRANSCODE, 'video': 'transcode', 'audio': 'transcode',
+                'reason': video_reason}
+
+    audio_action = 'none' if not info.get('has_audio') else ('copy' if audio_ok else 'transcode')
+    if not audio_ok:
+        return {'path': PATH_AUDIO, 'video': 'copy', 'audio': audio_action,
+                'reason': audio_reason}
+
+    is_mov = info.get('major_brand', '').lower() in QUICKTIME_BRANDS
+    if info.get('faststart') and not is_mov:
+        return {'path': PATH_COPY, 'video': 'copy', 'audio': audio_action,
+                'reason': 'all streams fit target'}
+    return {'path': PATH_REMUX, 'video': 'copy', 'audio': audio_action,
+            'reason': 'all streams fit target, index needs moving to front'}
+
+
+def video_args(plan, bitrate, preset='veryfast', crf=23, filters=None, encoder=DEFAULT_BACKEND):
+    """ffmpeg video codec arguments for a plan from choose_encode_path (x264 preset/CRF scale)"""
+    if plan['video'] == 'copy':
+        return ['-c:v', 'copy']
+    maxrate = parse_bitrate(bitrate)
+    args = ['-vf', filters] if filters else []
+    return args + codec_args(encoder, preset, crf, format_bitrate(maxrate), format_bitrate(maxrate * 2))
+
+
+def audio_args(plan):
+    """ffmpeg audio codec arguments for a plan from choose_encode_path"""
+    if plan['audio'] == 'copy':
+        return ['-c:a', 'copy']
+    if plan['audio'] == 'transcode':
+        return ['-c:a', 'aac', '-b:a', AUDIO_BITRATE, '-ac', '2', '-ar', '44100']
+    return []
+
+
+def stream_args(plan, bitrate, preset='veryfast', crf=23, filters=None, encoder=DEFAULT_BACKEND):
+    """ffmpeg codec and muxer arguments for a plan from choose_encode_path"""
+    # Every path rewrites the container, and the mp4 muxer puts the moov at
+    # the end unless asked not to (copy and remux differ only in the message)
+    return (video_args(plan, bitrate, preset=preset, crf=crf, filters=filters, encoder=encoder)
+            + audio_args(plan) + ['-movflags', 'faststart'])
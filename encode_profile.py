@@ -0,0 +1,141 @@
+"""
+Encoding profiles shared by the web app and the CLI.
+
+From the probed source, the requested bitrate and a speed/size goal, this
+picks:
+
+    resolution  - the source size, or the highest ladder rung the bitrate
+                  supports (4K phone footage becomes 1080p by default)
+    fps cap     - high-frame-rate sources (slow-motion phone clips) are
+                  capped at 60 fps, or 30 when the goal favours size
+    preset/CRF  - x264 preset from the goal, CRF from the output rung
+
+Sizes are compared on the short side so portrait video gets the same
+treatment as landscape. Downscaling uses the scale filter with -2 on the
+long side to keep the aspect ratio and even dimensions; setsar=1 keeps the
+rounding from showing up as a non-square pixel aspect ratio.
+"""
+
+from encode_plan import parse_bitrate, format_bitrate, video_args
+from encoders import DEFAULT_BACKEND
+
+GOAL_SPEED = 'speed'
+GOAL_BALANCED = 'balanced'
+GOAL_SIZE = 'size'
+GOALS = (GOAL_SPEED, GOAL_BALANCED, GOAL_SIZE)
+
+# Output rungs, largest first: short side, lowest bitrate that can carry it,
+# bitrate cap at that size (None = the requested bitrate) and CRF
+LADDER = [
+    {'name': '2160p', 'height': 2160, 'min_bitrate': 8000000, 'max_bitrate': None, 'crf': 22},
+    {'name': '1440p', 'height': 1440, 'min_bitrate': 5000000, 'max_bitrate': None, 'crf': 22},
+    {'name': '1080p', 'height': 1080, 'min_bitrate': 2000000, 'max_bitrate': None, 'crf': 23},
+    {'name': '720p', 'height': 720, 'min_bitrate': 1500000, 'max_bitrate': 1500000, 'crf': 24},
+    {'name': '480p', 'height': 480, 'min_bitrate': 0, 'max_bitrate': 1000000, 'crf': 25},
+]
+
+GOAL_SETTINGS = {
+    GOAL_SPEED: {'preset': 'veryfast', 'crf_offset': 0, 'max_fps': 60},
+    GOAL_BALANCED: {'preset': 'medium', 'crf_offset': 0, 'max_fps': 60},
+    GOAL_SIZE: {'preset': 'slow', 'crf_offset': 2, 'max_fps': 30},
+}
+
+DEFAULT_MAX_HEIGHT = 1080
+
+
+def parse_goal(value, default=GOAL_SPEED):
+    """Accept 'speed' / 'balanced' / 'size'; anything else gets the default"""
+    value = (value or '').strip().lower()
+    return value if value in GOALS else default
+
+
+def display_size(info):
+    """(width, height) after rotation metadata is applied, or (0, 0) if unknown"""
+    width, height = info.get('width') or 0, info.get('height') or 0
+    if abs(info.get('rotation') or 0) in (90, 270):
+        width, height = height, width
+    return width, height
+
+
+def _rung_for(short_side):
+    # CRF and bitrate cap come from the highest rung at or below the output size
+    return next((rung for rung in LADDER if rung['height'] <= short_side), LADDER[-1])
+
+
+def choose_profile(info, bitrate='2M', goal=GOAL_SPEED, max_height=DEFAULT_MAX_HEIGHT):
+    """
+    Pick output size, fps cap, preset, CRF and bitrate cap for a source.
+
+    Args:
+        info: Summary dict from video_probe.probe_video (None = unknown source;
+              no scaling or fps cap, 1080p rung settings)
+        bitrate: Requested maximum video bitrate ('2M')
+        goal: GOAL_SPEED / GOAL_BALANCED / GOAL_SIZE
+        max_height: Largest output short side (0 = no limit beyond the ladder)
+
+    Returns a dict with 'name', 'width'/'height' (0 if unknown), 'scale',
+    'fps' (cap applied, or None), 'preset', 'crf', 'maxrate', 'bufsize' and
+    'filters' (a -vf string, or None) and 'encoder' (x264; see encoders.apply_encoder).
+    """
+    settings = GOAL_SETTINGS[parse_goal(goal)]
+    requested = parse_bitrate(bitrate)
+    width, height = display_size(info or {})
+    short_side = min(width, height)
+
+    if short_side:
+        # Never upscale; shrink to max_height and to what the bitrate can carry
+        bitrate_cap = next(r['height'] for r in LADDER if r['min_bitrate'] <= requested)
+        out_short = min(short_side, max_height or short_side, bitrate_cap)
+        rung = _rung_for(out_short)
+    else:
+        rung = _rung_for(1080)
+        out_short = 0
+
+    filters = []
+    scale = bool(short_side) and out_short < short_side
+    out_width, out_height = width, height
+    if scale:
+        ratio = out_short / short_side
+        if height <= width:
+            out_width, out_height = int(round(width * ratio / 2)) * 2, out_short
+            filters.append(f"scale=-2:{out_short},setsar=1")
+        else:
+            out_width, out_height = out_short, int(round(height * ratio / 2)) * 2
+            filters.append(f"scale={out_short}:-2,setsar=1")
+
+    source_fps = (info or {}).get('fps') or 0
+    fps = None
+    if source_fps > settings['max_fps'] + 0.5:
+        fps = settings['max_fps']
+        filters.append(f"fps={fps}")
+
+    maxrate = min(requested, rung['max_bitrate'] or requested)
+    name = f"{out_short}p" if out_short else rung['name']
+    if fps:
+        name += str(fps)
+    return {
+        'name': name,
+        'width': out_width,
+        'height': out_height,
+        'scale': scale,
+        'fps': fps,
+        'preset': settings['preset'],
+        'crf': rung['crf'] + settings['crf_offset'],
+        'maxrate': format_bitrate(maxrate),
+        'bufsize': format_bitrate(maxrate * 2),
+        'filters': ','.join(filters) or None,
+        'encoder': DEFAULT_BACKEND,
+    }
+
+
+def profile_video_args(plan, profile):
+    """ffmpeg video arguments for a plan (encode_plan.choose_encode_path) and profile"""
+    return video_args(plan, profile['maxrate'], preset=profile['preset'], crf=profile['crf'],
+                      filters=profile['filters'], encoder=profile['encoder'])
+
+
+def describe(profile):
+    """One-line summary for logs and status messages"""
+    size = f"{profile['width']}x{profile['height']}" if profile['width'] else 'source size'
+    return (f"{profile['name']} ({size}), {profile['encoder']} {profile['preset']}, "
+            f"CRF {profile['crf']}, max {profile['maxrate']}")
@@ -0,0 +1,153 @@
+"""
+Video encoder backends and the load-based encoder policy.
+
+Profiles (encode_profile.py) speak x264: a preset name from SPEED_TIERS and
+an x264-scale CRF. Each backend translates those into its own arguments, so
+one profile can drive any of:
+
+    x264    - libx264 (always the fallback)
+    x265    - libx265, HEVC tagged hvc1 for MP4 players
+    svtav1  - libsvtav1, AV1
+    vp9     - libvpx-vp9, constrained quality
+
+Which of these the ffmpeg build has comes from `ffmpeg -encoders`, parsed
+once per binary and cached. choose_encoder moves to faster presets (and
+x264) when jobs are waiting and to slower presets (and the idle encoder, if
+one is configured) when the pool is quiet.
+"""
+
+import subprocess
+import threading
+
+SPEED_TIERS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower']
+DEFAULT_BACKEND = 'x264'
+
+BACKENDS = {
+    'x264': {'encoder': 'libx264', 'codec': 'h264', 'crf_offset': 0, 'max_crf': 51},
+    'x265': {'encoder': 'libx265', 'codec': 'hevc', 'crf_offset': 5, 'max_crf': 51},
+    'svtav1': {'encoder': 'libsvtav1', 'codec': 'av1', 'crf_offset': 12, 'max_crf': 63},
+    'vp9': {'encoder': 'libvpx-vp9', 'codec': 'vp9', 'crf_offset': 10, 'max_crf': 63},
+}
+
+# Native speed setting per tier: SVT-AV1 -preset (13 = fastest), libvpx -cpu-used (8 = fastest)
+SVTAV1_PRESETS = dict(zip(SPEED_TIERS, [12, 11, 10, 9, 8, 7, 5, 4]))
+VP9_CPU_USED = dict(zip(SPEED_TIERS, [8, 7, 6, 5, 4, 3, 2, 1]))
+
+LOAD_IDLE = 'idle'
+LOAD_NORMAL = 'normal'
+LOAD_BUSY = 'busy'
+# Preset steps per load level (positive = slower, better compression)
+LOAD_SHIFT = {LOAD_IDLE: 1, LOAD_NORMAL: 0, LOAD_BUSY: -1}
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def _list_encoders(ffmpeg_path):
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'], capture_output=True,
+                                text=True, stdin=subprocess.DEVNULL, timeout=15)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Could not list ffmpeg encoders: {e}")
+        return frozenset()
+    names = set()
+    for line in result.stdout.splitlines():
+        # " V....D libx264   libx264 H.264 / AVC ...": capability flags, then the name
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in 'VAS' and parts[1] != '=':
+            names.add(parts[1])
+    return frozenset(names)
+
+
+def ffmpeg_encoders(ffmpeg_path):
+    """Encoder names an ffmpeg binary supports (empty if it can't be run)"""
+    with _encoders_lock:
+        if ffmpeg_path not in _encoders:
+            _encoders[ffmpeg_path] = _list_encoders(ffmpeg_path)
+        return _encoders[ffmpeg_path]
+
+
+def available_backends(ffmpeg_path):
+    """Backend names usable with this ffmpeg, x264 first"""
+    encoders = ffmpeg_encoders(ffmpeg_path) if ffmpeg_path else frozenset()
+    available = [name for name, backend in BACKENDS.items() if backend['encoder'] in encoders]
+    # Unknown build (listing failed): assume the x264 every supported build has
+    return available or [DEFAULT_BACKEND]
+
+
+def resolve_backend(name, available):
+    """name if this ffmpeg has it, else the x264 fallback"""
+    if name in available:
+        return name
+    if name and name != DEFAULT_BACKEND:
+        print(f"Encoder {name} not available in this ffmpeg, using {DEFAULT_BACKEND}")
+    return DEFAULT_BACKEND
+
+
+def shift_preset(preset, steps):
+    """Move an x264 preset name steps tiers slower (negative = faster), clamped"""
+    index = SPEED_TIERS.index(preset) if preset in SPEED_TIERS else SPEED_TIERS.index('medium')
+    return SPEED_TIERS[max(0, min(len(SPEED_TIERS) - 1, index + steps))]
+
+
+def load_level(stats):
+    """Pool load from JobScheduler.stats(): idle, normal or busy"""
+    if stats['queued'] >= stats['workers']:
+        return LOAD_BUSY
+    if stats['queued'] == 0 and stats['running'] <= max(1, stats['workers'] // 2):
+        return LOAD_IDLE
+    return LOAD_NORMAL
+
+
+def choose_encoder(stats, available, preferred=DEFAULT_BACKEND, idle=None, switch_codec=True):
+    """
+    Backend and preset shift for a job starting now.
+
+    Busy pools fall back to x264 one tier faster (two when the queue is twice
+    the pool); idle pools use the idle backend, if configured, one tier slower.
+    With switch_codec=False only the preset moves (e.g. for two-pass x264).
+
+    Returns {'encoder', 'preset_shift', 'load'}.
+    """
+    level = load_level(stats)
+    shift = LOAD_SHIFT[level]
+    encoder = preferred
+    if level == LOAD_BUSY:
+        encoder = DEFAULT_BACKEND
+        if stats['queued'] >= 2 * stats['workers']:
+            shift -= 1
+    elif level == LOAD_IDLE and idle:
+        encoder = idle
+    if not switch_codec:
+        encoder = DEFAULT_BACKEND
+    return {'encoder': resolve_backend(encoder, available), 'preset_shift': shift, 'load': level}
+
+
+def apply_encoder(profile, choice):
+    """Copy of an encode_profile profile set up for a choose_encoder decision"""
+    return dict(profile, encoder=choice['encoder'],
+                preset=shift_preset(profile['preset'], choice['preset_shift']))
+
+
+def codec_args(backend, preset, crf, maxrate, bufsize):
+    """
+    ffmpeg video encoder arguments (flag/value pairs) for a backend.
+
+    preset and crf are on the x264 scale; maxrate/bufsize are ffmpeg rate strings.
+    """
+    spec = BACKENDS[backend]
+    crf = min(crf + spec['crf_offset'], spec['max_crf'])
+    args = ['-c:v', spec['encoder']]
+    if backend == 'x264':
+        args += ['-preset', preset, '-crf', str(crf), '-maxrate', maxrate, '-bufsize', bufsize]
+    elif backend == 'x265':
+        args += ['-preset', preset, '-crf', str(crf), '-maxrate', maxrate, '-bufsize', bufsize,
+                 '-tag:v', 'hvc1', '-x265-params', 'log-level=error']
+    elif backend == 'svtav1':
+        args += ['-preset', str(SVTAV1_PRESETS.get(preset, 7)), '-crf', str(crf),
+                 '-maxrate', maxrate]
+    elif backend == 'vp9':
+        # Constrained quality: CRF, but never above -b:v
+        args += ['-deadline', 'good', '-cpu-used', str(VP9_CPU_USED.get(preset, 3)),
+                 '-row-mt', '1', '-crf', str(crf), '-b:v', maxrate]
+    return args + ['-pix_fmt', 'yuv420p']
@@ -0,0 +1,145 @@
+"""
+Parser for ffmpeg's -progress output, shared by the CLI and the web app.
+
+Pass '-progress pipe:2 -nostats' and ffmpeg writes key=value blocks to
+stderr, each ending in progress=continue (or progress=end on the last one):
+
+    frame=240
+    fps=59.82
+    total_size=524336
+    out_time_us=4000000
+    speed=1.99x
+    progress=continue
+
+ProgressReader iterates that stream in the caller's thread and yields one
+update per block. The update has out_time (seconds), fps, speed,
+total_size (bytes written so far), fraction (of the duration) and
+projected_size. Anything else on stderr, such as ffmpeg's warnings and
+errors, goes to a bounded tail. So one reader handles everything: no second
+pipe, no drain thread, and no polling of the output file.
+
+projected_size extrapolates the bytes written so far to the whole duration.
+Muxers write in chunks: MP4 holds up to about a megabyte before it flushes,
+so total_size moves in steps. The projection uses the output time at which
+total_size last grew, not the current one, and waits for the first growth
+past the header and for PROJECTION_MIN_SECONDS of output. Small outputs
+therefore get a projection late or not at all, while large runs, the ones
+worth stopping, get one early.
+"""
+
+import collections
+import re
+
+from tracing import STDERR_LINES
+
+PROGRESS_ARGS = ['-progress', 'pipe:2', '-nostats']
+PROJECTION_MIN_SECONDS = 1.0
+
+_KEY_VALUE = re.compile(r'^([a-z0-9_]+)=(\S*)$')
+
+
+def _number(value):
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return None  # 'N/A' and friends
+
+
+def project_size(size, at_time, duration):
+    """Final size if size bytes cover at_time seconds of a duration-second output"""
+    if not size or not duration or not at_time or at_time < min(PROJECTION_MIN_SECONDS, duration):
+        return None
+    return int(size * max(duration / at_time, 1))
+
+
+def parse_block(fields, duration=0):
+    """
+    Update dict for one -progress block (fields: {key: raw string value}).
+    projected_size is None here; ProgressReader fills it in.
+    """
+    micros = _number(fields.get('out_time_us', fields.get('out_time_ms')))
+    out_time = max(micros / 1000000, 0) if micros is not None else None
+    total_size = _number(fields.get('total_size'))
+    total_size = int(total_size) if total_size is not None else None
+    fraction = min(out_time / duration, 1) if duration and out_time is not None else None
+    return {
+        'out_time': out_time,
+        'fps': _number(fields.get('fps')),
+        'speed': _number(fields.get('speed')),
+        'frame': int(_number(fields.get('frame')) or 0),
+        'total_size': total_size,
+        'fraction': fraction,
+        'projected_size': None,
+        'done': fields.get('progress') == 'end',
+    }
+
+
+class ProgressReader:
+    """
+    Iterate a -progress stream (stderr with PROGRESS_ARGS) for per-block
+    updates. The last max_lines non-progress lines are kept for errors and
+    traces (lines(), text(), total_lines).
+    """
+
+    def __init__(self, stream, duration=0, max_lines=STDERR_LINES):
+        self.stream = stream
+        self.duration = duration or 0
+        self.last = None
+        self.total_lines = 0
+        self._size_step = (None, None, False)  # (total_size, out_time when reached, grew past header)
+        self._lines = collections.deque(maxlen=max_lines)
+
+    def __iter__(self):
+        # Values carry over between blocks: ffmpeg reports N/A for a field now and then
+        fields = {}
+        for line in self.stream:
+            match = _KEY_VALUE.match(line.strip())
+            if not match:
+                if line.strip():
+                    self._lines.append(line)
+                    self.total_lines += 1
+                continue
+            key, value = match.groups()
+            if value != 'N/A':
+                fields[key] = value
+            if key == 'progress':
+                update = parse_block(fields, self.duration)
+                size, at_time, grown = self._size_step
+                if update['total_size'] != size:
+                    grown = grown or size is not None
+                    size, at_time = update['total_size'], update['out_time']
+                    self._size_step = (size, at_time, grown)
+                if update['done']:
+                    update['projected_size'] = update['total_size']
+                elif grown:
+                    update['projected_size'] = project_size(size, at_time, self.duration)
+                self.last = update
+                yield update
+
+    def drain(self):
+        """Read to the end, discarding updates (returns the last one)"""
+        for _ in self:
+            pass
+        return self.last
+
+    def lines(self):
+        return [line.rstrip('\n') for line in self._lines]
+
+    def text(self, limit=2000):
+        """Tail of the non-progress output as one string (for error messages)"""
+        return '\n'.join(self.lines())[-limit:]
+
+
+def format_update(update):
+    """Short '58 fps 1.93x 3.1MB -> ~9.0MB' text for progress bars and status messages"""
+    parts = []
+    if update.get('fps') is not None:
+        parts.append(f"{update['fps']:.0f} fps")
+    if update.get('speed') is not None:
+        parts.append(f"{update['speed']:.2f}x")
+    if update.get('total_size') is not None:
+        size = f"{update['total_size'] / (1024 * 1024):.1f}MB"
+        if update.get('projected_size'):
+            size += f" -> ~{update['projected_size'] / (1024 * 1024):.1f}MB"
+        parts.append(size)
+    return ' '.join(parts)
@@ -0,0 +1,218 @@
+"""
+Host load governor for the encode pool.
+
+A background thread samples CPU and memory with psutil and classifies the
+host (smoothed, with hysteresis so it doesn't flap):
+
+    normal    - new jobs start with their profile's preset and thread budget
+    high      - CPU above cpu_high: new jobs one preset tier faster
+    critical  - CPU above cpu_critical or memory above memory_high: two tiers
+                faster and half the threads
+
+While the level is above normal, ffmpeg processes that have been running for
+more than renice_after seconds are reniced. Newly started (and interactive)
+jobs then get the CPU first, so their latency stays bounded during a spike.
+Lowering niceness again needs privileges, so a renice is one-way for that
+process. With a cgroup v2 directory configured, ffmpeg children are moved
+into it, and its cpu.max is capped at (cores - reserve_cores) while loaded,
+which leaves room for the web workers.
+
+Only this process's own ffmpeg children are touched. Under gunicorn each
+worker governs its own encodes.
+"""
+
+import os
+import threading
+import time
+
+import psutil
+
+LEVEL_NORMAL = 'normal'
+LEVEL_HIGH = 'high'
+LEVEL_CRITICAL = 'critical'
+LEVELS = (LEVEL_NORMAL, LEVEL_HIGH, LEVEL_CRITICAL)
+
+# Preset tiers (encoders.SPEED_TIERS) new jobs move per level; negative = faster
+PRESET_SHIFT = {LEVEL_NORMAL: 0, LEVEL_HIGH: -1, LEVEL_CRITICAL: -2}
+# Step down a level only once load is this many percent below the threshold
+HYSTERESIS = 10
+# Weight of the newest CPU sample in the moving average
+SMOOTHING = 0.5
+CGROUP_PERIOD = 100000  # microseconds
+
+
+def _is_ffmpeg(process):
+    try:
+        return process.name().startswith('ffmpeg')
+    except psutil.Error:
+        return False
+
+
+class Governor:
+    """Samples host load, adjusts new jobs and throttles long-running ffmpeg processes"""
+
+    def __init__(self, interval=2.0, cpu_high=85, cpu_critical=95, memory_high=90,
+                 renice=10, renice_after=60, cgroup_path='', reserve_cores=1):
+        self.interval = interval
+        self.cpu_high = cpu_high
+        self.cpu_critical = cpu_critical
+        self.memory_high = memory_high
+        self.renice = renice  # niceness for long-running encodes (0 = don't renice)
+        self.renice_after = renice_after
+        self.cgroup_path = cgroup_path
+        self.reserve_cores = reserve_cores
+
+        self._lock = threading.Lock()
+        self.cpu = 0.0
+        self.memory = 0.0
+        self.level = LEVEL_NORMAL
+        self.decisions = {level: 0 for level in LEVELS}
+        self.level_changes = 0
+        self.reniced = 0
+        self._reniced_pids = set()
+        self._adopted_pids = set()
+        self._cgroup_limited = False
+        self._started_pid = None  # per process: threads don't survive a fork
+
+    def start(self):
+        """Start the sampling thread (idempotent, once per process)"""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        psutil.cpu_percent(interval=None)  # first call only sets the baseline
+        self.memory = psutil.virtual_memory().percent
+        thread = threading.Thread(target=self._loop, name='load-governor')
+        thread.daemon = True
+        thread.start()
+        print(f"Load governor started (CPU high {self.cpu_high}%, critical {self.cpu_critical}%, "
+              f"memory {self.memory_high}%)")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Load governor sample failed: {e}")
+
+    def _level_for(self, cpu, memory):
+        if cpu >= self.cpu_critical or memory >= self.memory_high:
+            return LEVEL_CRITICAL
+        if cpu >= self.cpu_high:
+            return LEVEL_HIGH
+        return LEVEL_NORMAL
+
+    def _classify(self, current):
+        level = self._level_for(self.cpu, self.memory)
+        if LEVELS.index(level) >= LEVELS.index(current):
+            return level
+        # Going down: only as far as the load is clearly below each threshold
+        held = self._level_for(self.cpu + HYSTERESIS, self.memory + HYSTERESIS)
+        return max(level, held, key=LEVELS.index)
+
+    def sample(self):
+        """Take one CPU/memory sample, update the level and throttle. Returns the level."""
+        cpu = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory().percent
+        with self._lock:
+            self.cpu = SMOOTHING * cpu + (1 - SMOOTHING) * self.cpu
+            self.memory = memory
+            previous = self.level
+            self.level = self._classify(previous)
+            level = self.level
+            if level != previous:
+                self.level_changes += 1
+        if level != previous:
+            print(f"Load governor: {previous} -> {level} "
+                  f"(CPU {self.cpu:.0f}%, memory {self.memory:.0f}%)")
+            self._apply_cgroup_limit(level)
+
+        children = self._ffmpeg_children()
+        if self.cgroup_path:
+            self._adopt(children)
+        if level != LEVEL_NORMAL and self.renice:
+            self._renice_long_running(children)
+        live = {process.pid for process in children}
+        self._reniced_pids &= live
+        self._adopted_pids &= live
+        return level
+
+    def decide(self, threads):
+        """
+        Settings for a job starting now, given its scheduler thread budget
+        (0 = all cores). Returns a dict with 'level', 'preset_shift', 'threads',
+        and the 'cpu'/'memory' percentages the decision was based on.
+        """
+        with self._lock:
+            level = self.level
+            self.decisions[level] += 1
+            cpu, memory = self.cpu, self.memory
+        if level == LEVEL_CRITICAL:
+            threads = max(1, (threads or os.cpu_count() or 2) // 2)
+        return {'level': level, 'preset_shift': PRESET_SHIFT[level], 'threads': threads,
+                'cpu': round(cpu, 1), 'memory': round(memory, 1)}
+
+    def snapshot(self):
+        """Current level, load and decision counters (for status / metrics)"""
+        with self._lock:
+            return {
+                'level': self.level,
+                'cpu': round(self.cpu, 1),
+                'memory': round(self.memory, 1),
+                'decisions': dict(self.decisions),
+                'level_changes': self.level_changes,
+                'reniced': self.reniced,
+                'cgroup_limited': self._cgroup_limited,
+            }
+
+    def _ffmpeg_children(self):
+        try:
+            children = psutil.Process().children(recursive=True)
+        except psutil.Error:
+            return []
+        return [process for process in children if _is_ffmpeg(process)]
+
+    def _renice_long_running(self, children):
+        now = time.time()
+        for process in children:
+            if process.pid in self._reniced_pids:
+                continue
+            try:
+                if now - process.create_time() < self.renice_after:
+                    continue
+                process.nice(self.renice)
+            except psutil.Error:
+                continue
+            self._reniced_pids.add(process.pid)
+            with self._lock:
+                self.reniced += 1
+
+    def _adopt(self, children):
+        for process in children:
+            if process.pid in self._adopted_pids:
+                continue
+            try:
+                with open(os.path.join(self.cgroup_path, 'cgroup.procs'), 'w') as f:
+                    f.write(str(process.pid))
+            except OSError as e:
+                print(f"Load governor could not move ffmpeg {process.pid} into cgroup: {e}")
+            self._adopted_pids.add(process.pid)  # don't retry every sample
+
+    def _apply_cgroup_limit(self, level):
+        if not self.cgroup_path:
+            return
+        limited = level != LEVEL_NORMAL
+        if limited:
+            cores = max(1, (os.cpu_count() or 1) - self.reserve_cores)
+            value = f"{cores * CGROUP_PERIOD} {CGROUP_PERIOD}"
+        else:
+            value = f"max {CGROUP_PERIOD}"
+        try:
+            with open(os.path.join(self.cgroup_path, 'cpu.max'), 'w') as f:
+                f.write(value)
+        except OSError as e:
+            print(f"Load governor could not set cpu.max: {e}")
+            return
+        with self._lock:
+            self._cgroup_limited = limited
@@ -0,0 +1,146 @@
+"""
+Streaming upload ingestion.
+
+The request body is written to disk in chunks. Once the first atoms are in,
+the layout decides what happens next:
+
+    moov at the front  - the job is queued straight away and ffmpeg reads the
+                         file through a pipe while the upload is still arriving
+    moov at the end    - nothing can be decoded until the upload finishes, so
+                         the job is queued afterwards (store-then-encode)
+
+Ingest state lives in this process; the encode worker that picks up a
+streaming job must run in the same process as the upload request.
+"""
+
+import threading
+import time
+
+from result_cache import ContentHasher
+from video_probe import moov_layout
+
+CHUNK_SIZE = 1024 * 1024
+# Give up on layout detection after this much data (no moov/mdat found)
+MAX_LAYOUT_SCAN = 64 * 1024 * 1024
+
+_active = {}
+_active_lock = threading.Lock()
+
+
+class UploadInterrupted(Exception):
+    """The client went away before the upload finished"""
+
+
+class IngestState:
+    """Progress of one upload that an encoder may be reading concurrently"""
+
+    def __init__(self, path, expected_size=0):
+        self.path = path
+        self.expected_size = expected_size
+        self.bytes_written = 0
+        self.layout = None
+        self.moov_end = None
+        self.done = False
+        self.error = None
+        self.content_digest = None  # set once the whole upload is on disk
+        self._cond = threading.Condition()
+
+    def advance(self, n):
+        with self._cond:
+            self.bytes_written += n
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait_for(self, n_bytes, timeout=None):
+        """Wait until n_bytes are on disk or the upload ends. Returns bytes written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.bytes_written < n_bytes and not self.done:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self.bytes_written
+
+
+def register(job_id, state):
+    with _active_lock:
+        _active[job_id] = state
+
+
+def get(job_id):
+    with _active_lock:
+        return _active.get(job_id)
+
+
+def remove(job_id):
+    with _active_lock:
+        _active.pop(job_id, None)
+
+
+def stream_to_disk(stream, state, on_layout=None):
+    """
+    Copy a request body to state.path in chunks.
+
+    on_layout(state) is called once, as soon as the moov/mdat order is known
+    (or known to be undetectable). The content is hashed for the result cache
+    as it is written. Raises UploadInterrupted if the body ends short of the
+    expected size.
+    """
+    hasher = ContentHasher()
+    try:
+        with open(state.path, 'wb', buffering=0) as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                state.advance(len(chunk))
+
+                if state.layout is None:
+                    layout, moov_end = moov_layout(state.path, state.bytes_written)
+                    if layout or state.bytes_written >= MAX_LAYOUT_SCAN:
+                        state.layout = layout or 'unknown'
+                        state.moov_end = moov_end
+                        if on_layout:
+                            on_layout(state)
+
+        if state.expected_size and state.bytes_written < state.expected_size:
+            raise UploadInterrupted(
+                f"Upload ended after {state.bytes_written} of {state.expected_size} bytes")
+    except Exception as e:
+        state.finish(error=e)
+        raise
+    state.content_digest = hasher.hexdigest()
+    state.finish()
+
+
+def feed_pipe(state, pipe):
+    """Copy a growing upload into an ffmpeg stdin pipe until the upload ends"""
+    offset = 0
+    try:
+        with open(state.path, 'rb') as f:
+            while True:
+                available = state.wait_for(offset + 1, timeout=1)
+                if state.error:
+                    break
+                if available > offset:
+                    f.seek(offset)
+                    data = f.read(min(available - offset, CHUNK_SIZE))
+                    pipe.write(data)
+                    offset += len(data)
+                elif state.done:
+                    break
+    except (BrokenPipeError, OSError):
+        pass  # ffmpeg exited; its return code reports why
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
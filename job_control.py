@@ -0,0 +1,249 @@
+"""
+Cancellation of running encodes.
+
+A worker thread binds itself to its job (bind(job_id)). Every ffmpeg it
+starts through spawn() then runs in its own session, and so in its own
+process group, and is registered under the job. cancel(job_id) marks the
+job, sends SIGTERM to each registered process group, and sends SIGKILL to
+whatever is still alive after the grace period. That covers any helpers
+ffmpeg forked.
+
+Once a job is marked, spawn() refuses to start anything else for it (e.g.
+the second pass of a two-pass encode). The worker sees the failed ffmpeg,
+and cancel_reason() tells it the failure was a cancel, not an error.
+
+Outside a bound thread (the CLI, batch mode), spawn() is a plain Popen.
+Ctrl-C in a terminal still reaches ffmpeg that way.
+
+Because each ffmpeg has its own session, it outlives a worker process that
+dies (e.g. gunicorn recycling it). Jobs record their process_owner(), so
+whoever picks up an orphaned job can tell its owner is gone (owner_alive)
+and stop what it left running (stop_orphans).
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+KILL_GRACE = 5.0  # seconds between SIGTERM and SIGKILL
+
+CANCELLED = 'cancelled'
+ABANDONED = 'abandoned'
+PREEMPTED = 'preempted'
+RELEASED = 'released'  # handed back to the shared queue (worker shutting down)
+LOST = 'lost'  # the shared queue gave the job to another worker
+# Stops that put the job back in a queue; a real cancel overrides them
+REQUEUE_REASONS = (PREEMPTED, RELEASED)
+
+_local = threading.local()
+_lock = threading.Lock()
+_processes = {}  # job_id -> set of Popen
+_cancelled = {}  # job_id -> reason
+_owner = {}  # pid -> owner string (recomputed after a fork)
+
+
+class JobCancelled(Exception):
+    """Raised when a cancelled job tries to start another process"""
+
+    def __init__(self, job_id, reason):
+        super().__init__(f"Job {job_id} {reason}")
+        self.job_id = job_id
+        self.reason = reason
+
+
+@contextmanager
+def bind(job_id, helper=False):
+    """
+    Attribute processes spawned by this thread to job_id. A helper thread of
+    a job (e.g. its audio encode) leaves the job's registrations in place
+    when it is done; the job's own thread forgets them.
+    """
+    previous = getattr(_local, 'job_id', None)
+    _local.job_id = job_id
+    try:
+        yield
+    finally:
+        _local.job_id = previous
+        if not helper:
+            with _lock:
+                _processes.pop(job_id, None)
+
+
+def current_job():
+    return getattr(_local, 'job_id', None)
+
+
+def spawn(cmd, **kwargs):
+    """subprocess.Popen, registered under the bound job in its own process group"""
+    job_id = current_job()
+    if job_id is None:
+        return subprocess.Popen(cmd, **kwargs)
+    check(job_id)
+    process = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    with _lock:
+        _processes.setdefault(job_id, set()).add(process)
+        cancelled = job_id in _cancelled
+    if cancelled:
+        _terminate([process])  # cancel() ran between the check and the Popen
+    return process
+
+
+def run(cmd, **kwargs):
+    """subprocess.run equivalent on top of spawn (input= is not supported)"""
+    capture = kwargs.pop('capture_output', False)
+    if capture:
+        kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = spawn(cmd, **kwargs)
+    stdout, stderr = process.communicate()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def adopt(job_id, pid):
+    """Track a process started elsewhere (e.g. a pool worker's ffmpeg) as one of job_id's groups"""
+    with _lock:
+        _processes.setdefault(job_id, set()).add(pid)
+        cancelled = job_id in _cancelled
+    if cancelled:
+        _terminate([pid])
+
+
+def check(job_id):
+    """Raise JobCancelled if job_id has been cancelled"""
+    reason = cancel_reason(job_id)
+    if reason:
+        raise JobCancelled(job_id, reason)
+
+
+def cancel_reason(job_id):
+    """'cancelled', 'abandoned', 'preempted', 'released', 'lost' or None if the job is live"""
+    with _lock:
+        return _cancelled.get(job_id)
+
+
+def clear(job_id):
+    """Forget a cancel once the worker has dealt with it (e.g. a preempted job runs again)"""
+    with _lock:
+        _cancelled.pop(job_id, None)
+
+
+def cancel(job_id, reason=CANCELLED, grace=KILL_GRACE, wait=False):
+    """
+    Mark job_id cancelled and stop its processes: SIGTERM, then SIGKILL
+    after grace seconds. Returns the number of process groups signalled.
+    The kill runs on a daemon thread unless wait is set.
+    """
+    with _lock:
+        # A real cancel overrides a requeue (the job must not run again), and
+        # nothing overrides a lost job (it belongs to someone else now)
+        current = _cancelled.get(job_id)
+        if current is None or current in REQUEUE_REASONS or reason == LOST:
+            _cancelled[job_id] = reason
+        targets = [target for target in _processes.get(job_id, ()) if _alive(target)]
+    if not targets:
+        return 0
+    if wait:
+        _terminate(targets, grace)
+    else:
+        thread = threading.Thread(target=_terminate, args=(targets, grace), name=f"cancel-{job_id}")
+        thread.daemon = True
+        thread.start()
+    return len(targets)
+
+
+def _pid(target):
+    return target if isinstance(target, int) else target.pid
+
+
+def _alive(target):
+    if isinstance(target, int):
+        try:
+            os.kill(target, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+    return target.poll() is None
+
+
+def _signal_group(target, sig):
+    try:
+        os.killpg(_pid(target), sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _terminate(targets, grace=KILL_GRACE):
+    for target in targets:
+        _signal_group(target, signal.SIGTERM)
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline and any(_alive(target) for target in targets):
+        time.sleep(0.1)
+    for target in targets:
+        if _alive(target):
+            _signal_group(target, signal.SIGKILL)
+
+
+def process_owner():
+    """'host:pid:start time' identifying this process as the owner of a job"""
+    pid = os.getpid()
+    if pid not in _owner:
+        _owner[pid] = f"{socket.gethostname()}:{pid}:{psutil.Process(pid).create_time():.2f}"
+    return _owner[pid]
+
+
+def owner_alive(owner):
+    """
+    True if the process named by a process_owner() string is still running,
+    False if it is gone (or the pid now belongs to another process), None if
+    it ran on another host and can't be checked from here.
+    """
+    try:
+        host, pid, started = owner.rsplit(':', 2)
+        pid, started = int(pid), float(started)
+    except (AttributeError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return None
+    try:
+        return abs(psutil.Process(pid).create_time() - started) < 1
+    except psutil.Error:
+        return False
+
+
+def stop_orphans(marker, grace=KILL_GRACE):
+    """
+    Stop ffmpeg processes left behind by a dead worker: those whose command
+    line mentions marker (e.g. a job id in the input or output path) and that
+    either lead their own process group (as spawn() starts them) or have been
+    orphaned. Waits for them. Returns how many were found.
+    """
+    groups, loose = [], []
+    for process in psutil.process_iter(['pid', 'ppid', 'name', 'cmdline']):
+        try:
+            if ('ffmpeg' not in (process.info['name'] or '')
+                    or not any(marker in arg for arg in process.info['cmdline'] or ())):
+                continue
+            if os.getpgid(process.pid) == process.pid:
+                groups.append(process.pid)
+            elif process.info['ppid'] == 1:
+                loose.append(process)
+        except (psutil.Error, OSError):
+            continue
+    if groups:
+        _terminate(groups, grace)
+    for process in loose:
+        try:
+            process.terminate()
+            process.wait(grace)
+        except psutil.TimeoutExpired:
+            process.kill()
+        except psutil.Error:
+            pass
+    return len(groups) + len(loose)
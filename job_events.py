@@ -0,0 +1,67 @@
+"""
+In-process change notifications for jobs.
+
+The job store calls notify() on every update, so /events and long-poll
+requests wake as soon as the ffmpeg progress parser writes something instead
+of re-reading the store on a timer. Updates written by another process are
+not seen here; callers wait with a timeout and re-read the store when it
+expires.
+"""
+
+import threading
+
+# Drop counters for idle jobs once this many are tracked
+MAX_TRACKED_JOBS = 10000
+
+
+class JobEvents:
+    """Per-job change counters with condition variables to wait on"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conditions = {}
+        self._waiters = {}
+
+    def notify(self, job_id):
+        """Record a change to a job and wake anyone waiting on it"""
+        with self._lock:
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            condition = self._conditions.get(job_id)
+            if condition is not None:
+                condition.notify_all()
+            if len(self._versions) > MAX_TRACKED_JOBS:
+                self._prune()
+
+    def version(self, job_id):
+        with self._lock:
+            return self._versions.get(job_id, 0)
+
+    def wait(self, job_id, since, timeout):
+        """
+        Block until the job's version differs from `since` or `timeout`
+        seconds pass. Returns the current version.
+        """
+        with self._lock:
+            condition = self._conditions.get(job_id)
+            if condition is None:
+                condition = self._conditions[job_id] = threading.Condition(self._lock)
+            self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+            try:
+                condition.wait_for(lambda: self._versions.get(job_id, 0) != since, timeout)
+                return self._versions.get(job_id, 0)
+            finally:
+                self._waiters[job_id] -= 1
+                if not self._waiters[job_id]:
+                    del self._waiters[job_id]
+                    del self._conditions[job_id]
+
+    def watchers(self, job_id):
+        """Number of requests currently waiting on a job"""
+        with self._lock:
+            return self._waiters.get(job_id, 0)
+
+    def _prune(self):
+        for job_id in list(self._versions):
+            if job_id not in self._waiters:
+                del self._versions[job_id]
@@ -0,0 +1,177 @@
+"""
+Shared job queue with leases, for encode workers in separate processes.
+
+With ENCODE_MODE=queue the web tier only puts jobs here, and run_worker.py
+processes take them out, on this host or any other that can reach the
+database and uploads/:
+
+    put()        web: queue a job (priority, then FIFO)
+    lease()      worker: take the next job for lease_seconds
+    heartbeat()  worker: extend the lease while encoding (False = lost it)
+    complete()   worker: done (finished, failed or cancelled), drop the entry
+    release()    worker: hand the job back, e.g. when shutting down
+    cancel()     web: drop a waiting job; a leased one is stopped by its worker
+
+A worker that dies stops heartbeating. Its lease runs out and the next
+lease() hands the job to another worker, with attempts counting the takeovers.
+Job status and progress stay in the job store; this table only says who
+runs what.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from job_scheduler import QueueFullError
+
+QUEUED = 'queued'
+LEASED = 'leased'
+
+
+class JobQueue:
+    """Priority queue of job ids in SQLite (WAL), leased to workers"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS job_queue (
+                            job_id TEXT PRIMARY KEY,
+                            priority INTEGER NOT NULL,
+                            seq INTEGER NOT NULL,
+                            state TEXT NOT NULL,
+                            worker TEXT,
+                            lease_expires REAL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            payload TEXT NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS job_queue_order ON job_queue (priority, seq)')
+
+    def _conn(self):
+        # One connection per thread, reopened after a fork (gunicorn --preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def put(self, job_id, payload, priority=0, max_queued=None):
+        """
+        Queue a job (payload: JSON-serialisable arguments for the worker).
+        Returns the 1-based queue position. Raises QueueFullError when
+        max_queued jobs are already waiting.
+        """
+        def work(conn):
+            waiting = conn.execute('SELECT COUNT(*) FROM job_queue WHERE state = ?',
+                                   (QUEUED,)).fetchone()[0]
+            if max_queued is not None and waiting >= max_queued:
+                raise QueueFullError(waiting, max_queued)
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM job_queue').fetchone()[0]
+            conn.execute('INSERT OR REPLACE INTO job_queue (job_id, priority, seq, state, payload) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (job_id, priority, seq, QUEUED, json.dumps(payload)))
+        self._transaction(work)
+        return self.position(job_id)
+
+    def lease(self, worker, lease_seconds):
+        """
+        Take the most urgent waiting job, or one whose lease has run out.
+        Returns (job_id, payload, attempts) or None. attempts counts earlier
+        leases of this job (0 on the first run).
+        """
+        def work(conn):
+            now = time.time()
+            row = conn.execute(
+                'SELECT job_id, payload, attempts, state FROM job_queue '
+                'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                'ORDER BY priority, seq LIMIT 1', (QUEUED, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts, state = row
+            if state == LEASED:
+                attempts += 1  # the previous holder stopped heartbeating
+            conn.execute('UPDATE job_queue SET state = ?, worker = ?, lease_expires = ?, attempts = ? '
+                         'WHERE job_id = ?', (LEASED, worker, now + lease_seconds, attempts, job_id))
+            return job_id, json.loads(payload), attempts
+        return self._transaction(work)
+
+    def heartbeat(self, job_id, worker, lease_seconds):
+        """Extend worker's lease on job_id. False if the lease is no longer its own."""
+        cursor = self._conn().execute(
+            'UPDATE job_queue SET lease_expires = ? WHERE job_id = ? AND worker = ? AND state = ?',
+            (time.time() + lease_seconds, job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker):
+        """Drop a job the worker has finished with (in any outcome)"""
+        self._conn().execute('DELETE FROM job_queue WHERE job_id = ? AND worker = ?',
+                             (job_id, worker))
+
+    def release(self, job_id, worker):
+        """Put a leased job back at its old place in the queue"""
+        self._conn().execute(
+            'UPDATE job_queue SET state = ?, worker = NULL, lease_expires = NULL '
+            'WHERE job_id = ? AND worker = ?', (QUEUED, job_id, worker))
+
+    def cancel(self, job_id):
+        """
+        Drop a waiting job. Returns 'queued' if it was waiting, 'leased' if a
+        worker holds it (the worker has to stop it), else None.
+        """
+        def work(conn):
+            row = conn.execute('SELECT state FROM job_queue WHERE job_id = ?',
+                               (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == QUEUED:
+                conn.execute('DELETE FROM job_queue WHERE job_id = ?', (job_id,))
+            return row[0]
+        return self._transaction(work)
+
+    def position(self, job_id):
+        """1-based position of a waiting job, or None if it is not waiting"""
+        conn = self._conn()
+        row = conn.execute('SELECT priority, seq FROM job_queue WHERE job_id = ? AND state = ?',
+                           (job_id, QUEUED)).fetchone()
+        if row is None:
+            return None
+        return 1 + conn.execute(
+            'SELECT COUNT(*) FROM job_queue WHERE state = ? AND (priority < ? OR (priority = ? AND seq < ?))',
+            (QUEUED, row[0], row[0], row[1])).fetchone()[0]
+
+    def stats(self):
+        """Waiting and leased job counts, and the number of workers holding leases"""
+        rows = self._conn().execute(
+            'SELECT state, COUNT(*), COUNT(DISTINCT worker) FROM job_queue GROUP BY state').fetchall()
+        counts = {state: (count, workers) for state, count, workers in rows}
+        return {
+            'queued': counts.get(QUEUED, (0, 0))[0],
+            'leased': counts.get(LEASED, (0, 0))[0],
+            'active_workers': counts.get(LEASED, (0, 0))[1],
+        }
+
+
+def create_job_queue(spec):
+    """Build a queue from a spec: 'sqlite:///path/to/jobs.db'"""
+    if spec and spec.startswith('sqlite:///'):
+        return JobQueue(spec[len('sqlite:///'):])
+    raise ValueError(f"Unknown job queue: {spec}")
@@ -0,0 +1,199 @@
+"""
+Bounded encode worker pool with a priority job queue.
+
+Each worker runs one ffmpeg job at a time and hands it a thread budget so
+that workers x threads-per-job roughly matches the number of CPU cores.
+
+Queued jobs can be cancelled, which frees their queue slot at once. A running
+job can be chosen for preemption, i.e. stopped to make room for a more urgent
+one. The caller stops it. If its function then returns REQUEUE, it goes back
+into the queue at its old position.
+"""
+
+import itertools
+import os
+import queue
+import threading
+
+# Lower number runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BATCH = 10
+
+# Returned by a job function to be queued again (e.g. after preemption)
+REQUEUE = 'requeue'
+
+PRIORITY_NAMES = {
+    'interactive': PRIORITY_INTERACTIVE,
+    'normal': PRIORITY_NORMAL,
+    'batch': PRIORITY_BATCH,
+}
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler refuses a job because the queue is full"""
+
+    def __init__(self, queued, max_queued):
+        super().__init__(f"Encode queue is full ({queued}/{max_queued} jobs waiting)")
+        self.queued = queued
+        self.max_queued = max_queued
+
+
+def default_worker_count():
+    """Pick a worker count from the number of cores (roughly one job per 4 cores)"""
+    cores = os.cpu_count() or 1
+    return max(1, cores // 4)
+
+
+def threads_per_job(workers, cores=None):
+    """Split the machine's cores evenly across the encode workers"""
+    cores = cores or os.cpu_count() or 1
+    return max(1, cores // max(1, workers))
+
+
+def parse_priority(value, default=PRIORITY_INTERACTIVE):
+    """Turn a form/env priority ('batch', '10', ...) into a queue priority"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().lower()
+    if value in PRIORITY_NAMES:
+        return PRIORITY_NAMES[value]
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+class JobScheduler:
+    """Fixed-size worker pool fed from a FIFO-within-priority queue"""
+
+    def __init__(self, workers=None, max_queued=20, threads=None):
+        self.workers = workers or default_worker_count()
+        self.max_queued = max_queued
+        self.threads = threads or threads_per_job(self.workers)
+
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()  # FIFO order within a priority
+        self._lock = threading.Lock()
+        self._waiting = {}  # job_id -> (priority, seq)
+        self._running = {}  # job_id -> queue entry
+        self._preempting = set()  # running jobs picked by preempt_candidate
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop,
+                                          name=f"encode-worker-{i}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        print(f"Encode scheduler started: {self.workers} workers x {self.threads} threads")
+
+    def submit(self, job_id, func, args=(), kwargs=None, priority=PRIORITY_INTERACTIVE,
+               force=False):
+        """
+        Queue a job. `func` is called as func(*args, threads=N, **kwargs).
+
+        Returns the 1-based queue position. Raises QueueFullError when the
+        number of waiting jobs has reached `max_queued`, unless force is set
+        (jobs that were already accepted, e.g. recovered after a restart).
+        """
+        self.start()
+        with self._lock:
+            if len(self._waiting) >= self.max_queued and not force:
+                raise QueueFullError(len(self._waiting), self.max_queued)
+            seq = next(self._counter)
+            self._waiting[job_id] = (priority, seq)
+            self._queue.put((priority, seq, job_id, func, args, kwargs or {}))
+            return self._position_locked(job_id)
+
+    def position(self, job_id):
+        """1-based position of a waiting job, or None if it is not queued"""
+        with self._lock:
+            return self._position_locked(job_id)
+
+    def _position_locked(self, job_id):
+        key = self._waiting.get(job_id)
+        if key is None:
+            return None
+        return 1 + sum(1 for other in self._waiting.values() if other < key)
+
+    def cancel(self, job_id):
+        """
+        Drop a waiting job from the queue. Returns 'queued' if it was waiting,
+        'running' if a worker has it (the caller has to stop it), else None.
+        """
+        with self._lock:
+            if self._waiting.pop(job_id, None) is not None:
+                return 'queued'  # its queue entry is skipped when a worker reaches it
+            if job_id in self._running:
+                return 'running'
+            return None
+
+    def preempt_candidate(self, priority, min_priority=PRIORITY_BATCH):
+        """
+        Running job to stop so a job of `priority` can start now: the
+        least urgent, most recently started one at min_priority or below.
+        None if a worker is free or nothing qualifies. Each job is offered once.
+        """
+        with self._lock:
+            if len(self._running) < self.workers:
+                return None
+            candidates = [entry for entry in self._running.values()
+                          if entry[0] >= min_priority and entry[0] > priority
+                          and entry[2] not in self._preempting]
+            if not candidates:
+                return None
+            job_id = max(candidates, key=lambda entry: entry[:2])[2]
+            self._preempting.add(job_id)
+            return job_id
+
+    def job_ids(self):
+        """Ids of the jobs waiting in or running from this scheduler"""
+        with self._lock:
+            return list(self._waiting) + list(self._running)
+
+    def stats(self):
+        """Snapshot of queue depth and active jobs"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'threads_per_job': self.threads,
+                'queued': len(self._waiting),
+                'running': len(self._running),
+                'preempting': len(self._preempting),
+                'max_queued': self.max_queued,
+            }
+
+    def _worker_loop(self):
+        while True:
+            entry = self._queue.get()
+            priority, seq, job_id, func, args, kwargs = entry
+            with self._lock:
+                if self._waiting.get(job_id) != (priority, seq):
+                    self._queue.task_done()
+                    continue  # cancelled while waiting
+                del self._waiting[job_id]
+                self._running[job_id] = entry
+            result = None
+            try:
+                result = func(*args, threads=self.threads, **kwargs)
+            except Exception as e:
+                print(f"Scheduler job {job_id} raised: {e}")
+            finally:
+                with self._lock:
+                    del self._running[job_id]
+                    self._preempting.discard(job_id)
+                    if result == REQUEUE:
+                        # Back to its old place in the queue
+                        self._waiting[job_id] = (priority, seq)
+                        self._queue.put(entry)
+                self._queue.task_done()
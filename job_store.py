@@ -0,0 +1,263 @@
+"""
+Pluggable job-state backends.
+
+    memory             - a dict in this process (single worker, lost on restart)
+    sqlite:///jobs.db  - SQLite in WAL mode, shared by every gunicorn worker on
+                         the host and kept across restarts
+
+Both stores expose the same small API: create / get / update / delete, plus
+update_if (compare-and-set on one field, e.g. to claim a job) and
+with_status (jobs in given states, e.g. unfinished work after a restart).
+Setting a field to None in update() removes it. An optional on_update(job_id)
+callback fires after every change made through this process. SQLite progress
+updates are buffered and written in batches; any update that changes 'status'
+is written immediately together with everything buffered for that job.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+FLUSH_INTERVAL = 0.5  # seconds between batched progress writes
+
+
+def _merge(data, fields):
+    for key, value in fields.items():
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+    return data
+
+
+class MemoryJobStore:
+    """Job state in a process-local dict"""
+
+    def __init__(self, on_update=None):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._on_update = on_update
+
+    def _changed(self, job_id):
+        if self._on_update:
+            self._on_update(job_id)
+
+    def create(self, job_id, fields):
+        with self._lock:
+            self._jobs[job_id] = _merge({}, fields)
+        self._changed(job_id)
+
+    def get(self, job_id):
+        """Copy of the job's fields, or None if it doesn't exist"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                _merge(self._jobs[job_id], fields)
+        self._changed(job_id)
+
+    def update_if(self, job_id, field, expected, **fields):
+        """update() only if job[field] == expected. Returns True if it was applied."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.get(field) != expected:
+                return False
+            _merge(job, fields)
+        self._changed(job_id)
+        return True
+
+    def with_status(self, statuses):
+        """(job_id, fields) for every job whose status is in statuses"""
+        with self._lock:
+            return [(job_id, dict(job)) for job_id, job in self._jobs.items()
+                    if job.get('status') in statuses]
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        self._changed(job_id)
+
+    def __contains__(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+
+class SQLiteJobStore:
+    """Job state in a SQLite database (WAL mode) with batched progress writes"""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, on_update=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._on_update = on_update
+        self._local = threading.local()
+        self._pending = {}  # job_id -> fields not yet written
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, so batches commit in order
+        self._flusher_pid = None
+
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                            job_id TEXT PRIMARY KEY,
+                            status TEXT,
+                            data TEXT NOT NULL,
+                            updated_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread, reopened after a fork (gunicorn --preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _changed(self, job_id):
+        if self._on_update:
+            self._on_update(job_id)
+
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        flusher = threading.Thread(target=self._flush_loop, name='job-store-flush')
+        flusher.daemon = True
+        flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Job store flush failed: {e}")
+
+    def _write(self, conn, job_id, fields):
+        row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return
+        data = _merge(json.loads(row[0]), fields)
+        conn.execute('UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE job_id = ?',
+                     (data.get('status'), json.dumps(data), time.time(), job_id))
+
+    def flush(self, job_id=None):
+        """
+        Write buffered updates (for one job, or all of them). Fields stay in
+        the buffer, where get() sees them, until their batch has committed.
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                if job_id is None:
+                    batch = {pending_id: dict(fields) for pending_id, fields in self._pending.items()}
+                else:
+                    batch = {job_id: dict(self._pending[job_id])} if job_id in self._pending else {}
+            if not batch:
+                return
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for pending_id, fields in batch.items():
+                    self._write(conn, pending_id, fields)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            # Drop what was written, unless it was updated again in the meantime
+            with self._pending_lock:
+                for pending_id, fields in batch.items():
+                    pending = self._pending.get(pending_id)
+                    if pending is None:
+                        continue
+                    for key, value in fields.items():
+                        if key in pending and pending[key] == value:
+                            del pending[key]
+                    if not pending:
+                        del self._pending[pending_id]
+
+    def create(self, job_id, fields):
+        data = _merge({}, fields)
+        self._conn().execute(
+            'INSERT OR REPLACE INTO jobs (job_id, status, data, updated_at) VALUES (?, ?, ?, ?)',
+            (job_id, data.get('status'), json.dumps(data), time.time()))
+        self._changed(job_id)
+
+    def get(self, job_id):
+        """Copy of the job's fields, or None if it doesn't exist"""
+        # Row and buffer read together: flush() only drops fields from the
+        # buffer after committing them, and needs this lock to do so
+        with self._pending_lock:
+            row = self._conn().execute('SELECT data FROM jobs WHERE job_id = ?',
+                                       (job_id,)).fetchone()
+            pending = dict(self._pending.get(job_id, {}))
+        if row is None:
+            return None
+        return _merge(json.loads(row[0]), pending)
+
+    def update(self, job_id, **fields):
+        with self._pending_lock:
+            self._pending.setdefault(job_id, {}).update(fields)
+        if 'status' in fields:
+            self.flush(job_id)
+        else:
+            self._ensure_flusher()
+        self._changed(job_id)
+
+    def update_if(self, job_id, field, expected, **fields):
+        """
+        update() only if job[field] == expected, atomically across processes.
+        Returns True if it was applied.
+        """
+        self.flush(job_id)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            applied = row is not None and json.loads(row[0]).get(field) == expected
+            if applied:
+                self._write(conn, job_id, fields)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if applied:
+            self._changed(job_id)
+        return applied
+
+    def with_status(self, statuses):
+        """(job_id, fields) for every job whose status is in statuses"""
+        self.flush()
+        statuses = list(statuses)
+        rows = self._conn().execute(
+            f"SELECT job_id, data FROM jobs WHERE status IN ({', '.join('?' * len(statuses))})",
+            statuses).fetchall()
+        return [(job_id, json.loads(data)) for job_id, data in rows]
+
+    def delete(self, job_id):
+        with self._pending_lock:
+            self._pending.pop(job_id, None)
+        self._conn().execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        self._changed(job_id)
+
+    def __contains__(self, job_id):
+        return self._conn().execute('SELECT 1 FROM jobs WHERE job_id = ?',
+                                    (job_id,)).fetchone() is not None
+
+
+def create_job_store(spec, on_update=None):
+    """Build a store from a spec: 'memory' or 'sqlite:///path/to/jobs.db'"""
+    if not spec or spec == 'memory':
+        return MemoryJobStore(on_update=on_update)
+    if spec.startswith('sqlite:///'):
+        return SQLiteJobStore(spec[len('sqlite:///'):], on_update=on_update)
+    raise ValueError(f"Unknown job store: {spec}")
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Load generator for the web app: concurrent uploaders plus status pollers
+
+Usage:
+    python load_test.py --start gunicorn --workers 2 --threads 8 --rate 0.5 --duration 120
+    python load_test.py --url http://localhost:5000 --rate 2 --pollers 20 --sizes 5:0.7,50:0.3
+
+Upload sessions arrive as a Poisson process at --rate per second for
+--duration seconds. Each session uploads a file, polls /status/<id> until the
+job finishes (or long-polls with --long-poll), then downloads the result.
+--pollers extra clients hit /status for random live jobs every
+--poll-interval seconds, the way open browser tabs do.
+
+File sizes follow --sizes, a list of megabytes:weight pairs. The clips are
+720p at about 1 MB per second, generated once with benchmark_pipeline's
+lavfi sources. Every upload ends with a random MP4 'free' box, which players
+ignore, so the result cache can't answer repeats (--allow-cache-hits keeps
+the bytes identical).
+
+--start launches the server locally ('gunicorn' with --workers/--threads, as
+in the Procfile, or 'flask' for python app.py) on --port and stops it
+afterwards. Set server variables such as ENCODE_WORKERS or MAX_QUEUED_JOBS in
+the environment. Without --start, --url points at a server that is already
+running.
+
+The report lists latency percentiles, request counts and error rates per
+endpoint, job end-to-end times, 429 rejections and throughput. --output also
+saves it as JSON.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from benchmark_pipeline import generate_source
+
+CHUNK_SIZE = 1024 * 1024
+SOURCE_RESOLUTION = '720p'  # 8 Mbit/s sources: about 1 MB per second of video
+PERCENTILES = (50, 90, 95, 99)
+REQUEST_TIMEOUT = 600  # seconds
+JOB_TIMEOUT = 3600
+
+
+def parse_sizes(value):
+    """'5:0.7,50:0.3' -> [(5, 0.7), (50, 0.3)] (megabytes, weight)"""
+    sizes = []
+    for part in value.split(','):
+        size, _, weight = part.partition(':')
+        sizes.append((max(1, int(float(size))), float(weight or 1)))
+    if not sizes or sum(weight for _, weight in sizes) <= 0:
+        raise argparse.ArgumentTypeError("need at least one size with a positive weight")
+    return sizes
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    # Nearest rank
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Stats:
+    """Thread-safe request samples per endpoint and job outcomes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}  # endpoint -> list of (seconds, status code or 0 for a failure)
+        self.jobs = []  # dicts: outcome, seconds, size
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def request(self, endpoint, seconds, status):
+        with self._lock:
+            self.requests.setdefault(endpoint, []).append((seconds, status))
+
+    def job(self, outcome, seconds=None, size=0):
+        with self._lock:
+            self.jobs.append({'outcome': outcome, 'seconds': seconds, 'size': size})
+
+    def transfer(self, up=0, down=0):
+        with self._lock:
+            self.bytes_up += up
+            self.bytes_down += down
+
+    def report(self, elapsed):
+        with self._lock:
+            endpoints = {}
+            for endpoint, samples in sorted(self.requests.items()):
+                latencies = [seconds for seconds, _ in samples]
+                errors = sum(1 for _, status in samples if status == 0 or status >= 500)
+                rejected = sum(1 for _, status in samples if status == 429)
+                endpoints[endpoint] = {
+                    'requests': len(samples),
+                    'per_second': round(len(samples) / elapsed, 2),
+                    'errors': errors,
+                    'error_rate': round(errors / len(samples), 4),
+                    'rejected': rejected,
+                    **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 1) for p in PERCENTILES},
+                    'max_ms': round(max(latencies) * 1000, 1),
+                }
+            finished = [job['seconds'] for job in self.jobs if job['outcome'] == 'completed']
+            outcomes = {}
+            for job in self.jobs:
+                outcomes[job['outcome']] = outcomes.get(job['outcome'], 0) + 1
+            return {
+                'elapsed_seconds': round(elapsed, 1),
+                'endpoints': endpoints,
+                'jobs': {
+                    'outcomes': outcomes,
+                    'completed_per_minute': round(len(finished) / elapsed * 60, 2),
+                    **{f"p{p}_seconds": (round(percentile(finished, p), 2) if finished else None)
+                       for p in PERCENTILES},
+                },
+                'upload_mb_per_second': round(self.bytes_up / (1024 * 1024) / elapsed, 2),
+                'download_mb_per_second': round(self.bytes_down / (1024 * 1024) / elapsed, 2),
+            }
+
+
+class Client:
+    """Minimal HTTP client (one connection per request, like independent browsers)"""
+
+    def __init__(self, base_url, stats):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.stats = stats
+
+    def request(self, endpoint, method, path, body=None, headers=None, sink=False):
+        """Returns (status, parsed JSON or None); status 0 means the request failed"""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            if sink:
+                received = 0
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    received += len(chunk)
+                self.stats.transfer(down=received)
+                data = None
+            else:
+                raw = response.read()
+                data = json.loads(raw) if raw and 'json' in (response.getheader('Content-Type') or '') else None
+            status = response.status
+        except (OSError, http.client.HTTPException, ValueError):
+            status, data = 0, None
+        finally:
+            connection.close()
+        self.stats.request(endpoint, time.perf_counter() - start, status)
+        return status, data
+
+    def upload(self, path, fields, unique=True):
+        """Multipart POST /upload, streaming the file from disk"""
+        boundary = uuid.uuid4().hex
+        head = ''.join(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n"
+                       for name, value in fields.items())
+        head += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"video\"; "
+                 f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: video/mp4\r\n\r\n")
+        head, tail = head.encode(), f"\r\n--{boundary}--\r\n".encode()
+        if unique:
+            # Top-level 'free' box: a valid MP4 with a content hash of its own
+            tail = struct.pack('>I4s', 24, b'free') + os.urandom(16) + tail
+        size = os.path.getsize(path)
+
+        def body():
+            yield head
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    yield chunk
+            yield tail
+
+        headers = {'Content-Type': f"multipart/form-data; boundary={boundary}",
+                   'Content-Length': str(len(head) + size + len(tail))}
+        status, data = self.request('upload', 'POST', '/upload', body(), headers)
+        if status == 200:
+            self.stats.transfer(up=size)
+        return status, data
+
+
+class LoadTest:
+    def __init__(self, client, sources, args):
+        self.client = client
+        self.sources = sources  # [(path, weight)]
+        self.args = args
+        self.active = set()
+        self._lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def session(self):
+        """One user: upload, wait for the job, download"""
+        paths, weights = zip(*self.sources)
+        path = random.choices(paths, weights)[0]
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        status, data = self.client.upload(path, {'bitrate': self.args.bitrate, 'goal': self.args.goal},
+                                          unique=not self.args.allow_cache_hits)
+        if status == 429:
+            self.client.stats.job('rejected', size=size)
+            return
+        if status != 200 or not data:
+            self.client.stats.job('upload_failed', size=size)
+            return
+
+        job_id = data['job_id']
+        with self._lock:
+            self.active.add(job_id)
+        try:
+            outcome = self.wait_for_job(job_id)
+            if outcome == 'completed':
+                status, _ = self.client.request('download', 'GET', f"/download/{job_id}", sink=True)
+                if status != 200:
+                    outcome = 'download_failed'
+            self.client.stats.job(outcome, time.perf_counter() - start, size)
+        finally:
+            with self._lock:
+                self.active.discard(job_id)
+
+    def wait_for_job(self, job_id):
+        deadline = time.monotonic() + JOB_TIMEOUT
+        version = None
+        while time.monotonic() < deadline:
+            if self.args.long_poll and version:
+                status, data = self.client.request('status_long_poll', 'GET',
+                                                   f"/status/{job_id}?wait=25&since={version}")
+            else:
+                status, data = self.client.request('status', 'GET', f"/status/{job_id}")
+            if status == 200 and data:
+                if data['status'] in ('completed', 'error'):
+                    return data['status']
+                version = data.get('version')
+            if not self.args.long_poll or status != 200:
+                time.sleep(self.args.poll_interval)
+        return 'timeout'
+
+    def poller(self):
+        """A browser tab left open on some job's progress page"""
+        while not self.stop.is_set():
+            with self._lock:
+                job_id = random.choice(sorted(self.active)) if self.active else None
+            if job_id:
+                self.client.request('status', 'GET', f"/status/{job_id}")
+            self.stop.wait(self.args.poll_interval)
+
+    def run(self):
+        pollers = [threading.Thread(target=self.poller, daemon=True) for _ in range(self.args.pollers)]
+        for thread in pollers:
+            thread.start()
+
+        sessions = []
+        started = time.perf_counter()
+        while time.perf_counter() - started < self.args.duration:
+            thread = threading.Thread(target=self.session, daemon=True)
+            thread.start()
+            sessions.append(thread)
+            # Poisson arrivals: exponential gaps with mean 1 / rate
+            time.sleep(random.expovariate(self.args.rate))
+        print(f"Started {len(sessions)} upload sessions, waiting for them to finish...")
+        for thread in sessions:
+            thread.join(JOB_TIMEOUT)
+        self.stop.set()
+        return time.perf_counter() - started
+
+
+def start_server(kind, port, workers, threads):
+    """Launch the app locally and wait until it answers"""
+    if kind == 'gunicorn':
+        cmd = ['gunicorn', f"--workers={workers}", f"--threads={threads}", '--timeout=300',
+               f"--bind=127.0.0.1:{port}", 'app:app']
+    else:
+        cmd = [sys.executable, 'app.py']
+    env = dict(os.environ, PORT=str(port))
+    if kind == 'gunicorn':
+        env['WEB_CONCURRENCY'] = str(workers)  # the app splits ENCODE_WORKERS across them
+    process = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"Server exited during startup (code {process.returncode})")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/debug')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    stop_server(process)
+    raise Exception("Server did not start within 60 seconds")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def print_report(report):
+    print("-" * 78)
+    print(f"{'endpoint':<18s} {'requests':>8s} {'req/s':>7s} {'errors':>7s} {'429':>5s} "
+          f"{'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for endpoint, row in report['endpoints'].items():
+        print(f"{endpoint:<18s} {row['requests']:>8d} {row['per_second']:>7.2f} "
+              f"{row['error_rate'] * 100:>6.1f}% {row['rejected']:>5d} {row['p50_ms']:>8.1f} "
+              f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+    jobs = report['jobs']
+    print("-" * 78)
+    print(f"Jobs: {', '.join(f'{k} {v}' for k, v in sorted(jobs['outcomes'].items())) or 'none'}")
+    if jobs['p50_seconds'] is not None:
+        print(f"Job end-to-end: p50 {jobs['p50_seconds']}s, p95 {jobs['p95_seconds']}s, "
+              f"p99 {jobs['p99_seconds']}s ({jobs['completed_per_minute']} completed/min)")
+    print(f"Upload {report['upload_mb_per_second']} MB/s, download {report['download_mb_per_second']} MB/s "
+          f"over {report['elapsed_seconds']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent upload/poll/download load test")
+    parser.add_argument('--url', default=None, help="server to test (default: the one --start launches)")
+    parser.add_argument('--start', choices=['gunicorn', 'flask'], help="launch the app locally first")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers (with --start gunicorn)")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument('--rate', type=float, default=0.5, help="new upload sessions per second")
+    parser.add_argument('--duration', type=float, default=60, help="seconds to keep starting sessions")
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('5:0.6,20:0.3,60:0.1'),
+                        help="upload sizes in MB with weights, e.g. 5:0.6,20:0.3,60:0.1")
+    parser.add_argument('--pollers', type=int, default=10, help="extra clients polling /status")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between polls")
+    parser.add_argument('--long-poll', action='store_true', help="sessions long-poll /status?wait=")
+    parser.add_argument('--bitrate', default='2M')
+    parser.add_argument('--goal', default='speed')
+    parser.add_argument('--allow-cache-hits', action='store_true',
+                        help="upload identical bytes, so repeats can come from the result cache")
+    parser.add_argument('--media-dir', default='benchmark_media')
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    if not args.url and not args.start:
+        parser.error("give --url or --start")
+
+    sources = [(os.path.abspath(generate_source(SOURCE_RESOLUTION, size, 'stereo', 'end', args.media_dir)), weight)
+               for size, weight in args.sizes]
+
+    server = None
+    if args.start:
+        print(f"Starting {args.start} on port {args.port}...")
+        server = start_server(args.start, args.port, args.workers, args.threads)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    print(f"Load test against {url}: {args.rate}/s for {args.duration:g}s, {args.pollers} pollers")
+
+    stats = Stats()
+    try:
+        elapsed = LoadTest(Client(url, stats), sources, args).run()
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    report = stats.report(elapsed)
+    report['settings'] = {key: value for key, value in vars(args).items() if key != 'sizes'}
+    report['settings']['sizes'] = args.sizes
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
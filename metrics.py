@@ -0,0 +1,272 @@
+"""
+In-memory counters, gauges and histograms with Prometheus text output.
+
+Each metric has its own small lock, held only to add a number. Bucket
+lookups and label handling happen outside the lock. Gauges that mirror other
+state (queue depth, governor load) are refreshed by collect callbacks just
+before a snapshot, rather than on every change.
+
+gunicorn runs several worker processes, and a scrape only reaches one of
+them. With a shared directory configured, every process periodically writes
+its snapshot there as <pid>.json. The /metrics handler then merges all live
+snapshots: counters and histograms add up, and each gauge either adds up
+(queue depth, active encodes) or takes the maximum (host CPU).
+"""
+
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, help_text, aggregate='sum'):
+        self.name = name
+        self.help = help_text
+        self.aggregate = aggregate  # how gauges combine across processes
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {'type': self.type, 'help': self.help, 'aggregate': self.aggregate,
+                    'samples': [[list(map(list, key)), self._copy(value)]
+                                for key, value in self._values.items()]}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(_Metric):
+    type = COUNTER
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def mirror(self, total, **labels):
+        """Set the total from a monotonic count kept elsewhere (collect callbacks)"""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = total
+
+
+class Gauge(_Metric):
+    type = GAUGE
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace(self, values):
+        """Set every label combination at once: {(('label', 'value'), ...): number}"""
+        with self._lock:
+            self._values = dict(values)
+
+
+class Histogram(_Metric):
+    type = HISTOGRAM
+
+    def __init__(self, name, help_text, buckets):
+        super().__init__(name, help_text)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1),
+                                             'sum': 0.0, 'count': 0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = self.buckets
+        return data
+
+    def _copy(self, value):
+        return {'counts': list(value['counts']), 'sum': value['sum'], 'count': value['count']}
+
+
+class Registry:
+    """Named metrics plus collect callbacks, rendered in Prometheus text format"""
+
+    def __init__(self, shared_dir=''):
+        self.shared_dir = shared_dir
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._publisher_pid = None
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+            return self._metrics[metric.name]
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, aggregate='sum'):
+        return self._add(Gauge(name, help_text, aggregate))
+
+    def histogram(self, name, help_text, buckets):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def on_collect(self, callback):
+        """Call callback() before every snapshot (to refresh mirrored gauges)"""
+        self._collectors.append(callback)
+
+    def snapshot(self):
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    # Cross-process sharing
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.shared_dir, f"{pid}.json")
+
+    def write_snapshot(self):
+        """Publish this process's metrics for the others to merge"""
+        if not self.shared_dir:
+            return
+        os.makedirs(self.shared_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def start_publishing(self, interval=5.0):
+        """Write snapshots every interval seconds from a daemon thread (once per process)"""
+        if not self.shared_dir:
+            return
+        with self._lock:
+            if self._publisher_pid == os.getpid():
+                return
+            self._publisher_pid = os.getpid()
+
+        def publish():
+            while True:
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    print(f"Metrics snapshot failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=publish, name='metrics-publisher')
+        thread.daemon = True
+        thread.start()
+
+    def _other_snapshots(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.shared_dir, '*.json')):
+            try:
+                pid = int(os.path.basename(path)[:-5])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Worker gone (restarted by gunicorn): its counters go with it
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass  # alive, owned by someone else
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def merged_snapshot(self):
+        """This process's snapshot merged with every live process in shared_dir"""
+        merged = self.snapshot()
+        if not self.shared_dir:
+            return merged
+        for other in self._other_snapshots():
+            for name, data in other.items():
+                if name not in merged:
+                    merged[name] = data
+                    continue
+                target = merged[name]
+                samples = {tuple(map(tuple, key)): value for key, value in target['samples']}
+                for key, value in data['samples']:
+                    key = tuple(map(tuple, key))
+                    if key not in samples:
+                        samples[key] = value
+                    elif data['type'] == HISTOGRAM:
+                        current = samples[key]
+                        samples[key] = {
+                            'counts': [a + b for a, b in zip(current['counts'], value['counts'])],
+                            'sum': current['sum'] + value['sum'],
+                            'count': current['count'] + value['count'],
+                        }
+                    elif data['type'] == GAUGE and target.get('aggregate') == 'max':
+                        samples[key] = max(samples[key], value)
+                    else:
+                        samples[key] = samples[key] + value
+                target['samples'] = [[list(map(list, key)), value] for key, value in samples.items()]
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, data in sorted(self.merged_snapshot().items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['type']}")
+            for key, value in sorted(data['samples'], key=lambda sample: sample[0]):
+                pairs = [tuple(pair) for pair in key]
+                if data['type'] != HISTOGRAM:
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(data['buckets'] + [math.inf], value['counts']):
+                    cumulative += count
+                    le = _format_value(bound if bound == math.inf else float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(pairs, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(float(value['sum']))}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {value['count']}")
+        return '\n'.join(lines) + '\n'
@@ -2,9 +2,11 @@ import ffmpeg
 import os
 import sys
 import shutil
-import threading
+import subprocess
 import time
 from tqdm import tqdm
+from encode_profile import choose_profile, describe, GOALS, GOAL_BALANCED, DEFAULT_MAX_HEIGHT
+from encoders import BACKENDS, DEFAULT_BACKEND, available_backends, resolve_backend, codec_args
 
 def find_ffmpeg():
     """Find FFmpeg executable path"""
@@ -31,20 +33,21 @@ def find_ffmpeg():
     
     return None
 
-def monitor_output_file(output_file, original_size, stop_event):
-    """Monitor output file size during compression"""
-    while not os.path.exists(output_file) and not stop_event.is_set():
-        time.sleep(0.5)
+def find_ffprobe(ffmpeg_path=None):
+    """Find FFprobe executable path next to the FFmpeg we are using"""
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
     
-    while not stop_event.is_set():
-        try:
-            if os.path.exists(output_file):
-                current_size = os.path.getsize(output_file) / (1024 * 1024)
-                compression_ratio = (1 - current_size / original_size) * 100
-                print(f"\rCurrent: {current_size:.1f}MB | Reduction: {compression_ratio:.1f}%", end="", flush=True)
-            time.sleep(1)
-        except:
-            break
+    # Heroku buildpack ships ffprobe alongside ffmpeg
+    heroku_ffprobe = "/app/vendor/ffmpeg/ffprobe"
+    if ffmpeg_path == "/app/vendor/ffmpeg/ffmpeg" and os.path.exists(heroku_ffprobe):
+        return heroku_ffprobe
+    
+    if ffmpeg_path and ffmpeg_path not in ("ffmpeg", "/app/vendor/ffmpeg/ffmpeg"):
+        # Use custom ffprobe path for local development
+        folder, name = os.path.split(ffmpeg_path)
+        return os.path.join(folder, name.replace('ffmpeg', 'ffprobe'))
+    
+    return "ffprobe"
 
 def print_compression_summary(input_file, output_file, video_info, bitrate, crf, processing_time):
     """Print detailed compression summary with visual elements"""
@@ -77,7 +80,182 @@ def print_compression_summary(input_file, output_file, video_info, bitrate, crf,
     print(f"📊 Progress:   [{bar}] {compression_ratio:.1f}%")
     print("="*50)
 
-def compress_mp4_for_youtube(input_file, output_file, target_bitrate="2M"):
+def preview_mp4(input_file, target_bitrate="2M", target_size=None, quality=False,
+                goal=GOAL_BALANCED, max_height=DEFAULT_MAX_HEIGHT, encoder=DEFAULT_BACKEND):
+    """
+    Encode a few sampled clips with the settings a full run would use and print
+    the projected output size, encode time and (optionally) SSIM/PSNR.
+    """
+    from video_probe import probe_video
+    from encode_plan import audio_args, format_bitrate
+    from encode_profile import profile_video_args
+    from target_size import solve_video_bitrate, audio_budget, abr_video_args, format_size
+    from preview import preview_encode, DEFAULT_SAMPLES
+    
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg not found. Please install FFmpeg and add to PATH or place in C:\\ffmpeg\\bin\\")
+    video_info = probe_video(input_file)
+    duration = video_info['duration']
+    
+    plan = {'path': 'transcode', 'video': 'transcode',
+            'audio': 'transcode' if video_info['has_audio'] else 'none'}
+    if target_size:
+        video_bitrate = solve_video_bitrate(target_size, duration, audio_budget(video_info))
+        bitrate = format_bitrate(video_bitrate)
+        profile = choose_profile(video_info, bitrate, goal, max_height)
+        filter_args = ['-vf', profile['filters']] if profile['filters'] else []
+        encode_args = (filter_args + abr_video_args(video_bitrate, preset=profile['preset'])
+                       + audio_args(plan))
+        settings = f"Target size={format_size(target_size)} (~{bitrate}), {profile['name']}"
+    else:
+        profile = choose_profile(video_info, target_bitrate, goal, max_height)
+        profile['encoder'] = resolve_backend(encoder, available_backends(ffmpeg_path))
+        encode_args = profile_video_args(plan, profile) + audio_args(plan)
+        settings = describe(profile)
+    
+    print(f"\nPreviewing {input_file} ({DEFAULT_SAMPLES} samples)...")
+    threads = os.cpu_count() or 1
+    result = preview_encode(ffmpeg_path, input_file, duration, encode_args, fps=video_info['fps'],
+                            threads=max(1, threads // DEFAULT_SAMPLES), quality=quality)
+    
+    original_size = os.path.getsize(input_file)
+    seconds = result['projected_encode_seconds'] or 0
+    print("\n" + "="*50)
+    print("           PREVIEW")
+    print("="*50)
+    print(f"⚙️  Settings: {settings}")
+    print(f"📊 Original:        {original_size / (1024 * 1024):>8.2f} MB")
+    print(f"📊 Projected size:  {result['projected_size'] / (1024 * 1024):>8.2f} MB "
+          f"({(1 - result['projected_size'] / original_size) * 100:.1f}% smaller)")
+    print(f"⏱️  Projected time:  {int(seconds // 60)}m {int(seconds % 60)}s at {result['encode_fps']} fps")
+    if result['ssim'] is not None:
+        print(f"🔍 SSIM: {result['ssim']:.4f}   PSNR: {result['psnr'] or 0:.2f} dB")
+    print("="*50)
+    return result
+
+def compress_to_size(ffmpeg_path, input_file, output_file, video_info, target_size,
+                     goal=GOAL_BALANCED, max_height=DEFAULT_MAX_HEIGHT):
+    """Two-pass encode aimed at target_size bytes, with a tqdm bar across both passes"""
+    import tempfile
+    from encode_plan import audio_args, format_bitrate
+    from target_size import encode_to_size, stats_prefix, has_stats, audio_budget, solve_video_bitrate
+    
+    duration = video_info['duration']
+    video_bitrate = solve_video_bitrate(target_size, duration, audio_budget(video_info))
+    profile = choose_profile(video_info, format_bitrate(video_bitrate), goal, max_height)
+    print(f"Output: {describe(profile)}")
+    # Pass-1 stats survive between runs, so retrying at another size skips pass 1
+    prefix = stats_prefix(os.path.join(tempfile.gettempdir(), 'videoshrink-passlogs'),
+                          video_info['content_hash'], profile['preset'], profile['filters'])
+    passes = 1 if has_stats(prefix) else 2
+    plan = {'audio': 'transcode' if video_info['has_audio'] else 'none'}
+    
+    pbar = tqdm(total=100, desc="Progress", unit="%", ncols=70)
+    
+    def on_progress(pass_number, seconds):
+        done = (pass_number - 1 if passes == 2 else 0) + min(seconds / duration, 1)
+        pbar.n = int(done / passes * 100)
+        pbar.set_description("Pass 1" if pass_number == 1 else "Pass 2")
+        pbar.refresh()
+    
+    try:
+        result = encode_to_size(ffmpeg_path, input_file, output_file, target_size, duration,
+                                audio_args(plan), prefix, audio_bitrate=audio_budget(video_info),
+                                preset=profile['preset'], video_filters=profile['filters'],
+                                on_progress=on_progress)
+        pbar.n = 100
+        pbar.refresh()
+    finally:
+        pbar.close()
+    return result
+
+def compress_renditions(input_file, output_file, names, target_bitrate="2M", goal=GOAL_BALANCED,
+                        encoder=DEFAULT_BACKEND):
+    """
+    Encode several sizes (e.g. ['1080p', '720p']) from one decode of input_file.
+    Outputs are named after output_file: out.mp4 -> out_1080p.mp4, out_720p.mp4.
+    """
+    from video_probe import probe_video
+    from renditions import plan_renditions, encode_renditions, output_path
+    
+    ffmpeg_path = find_ffmpeg()
+    if not ffmpeg_path:
+        raise Exception("FFmpeg not found. Please install FFmpeg and add to PATH or place in C:\\ffmpeg\\bin\\")
+    start_time = time.time()
+    video_info = probe_video(input_file)
+    duration = video_info['duration']
+    plans = plan_renditions(video_info, names, target_bitrate, goal)
+    encoder = resolve_backend(encoder, available_backends(ffmpeg_path))
+    for plan in plans:
+        plan['profile']['encoder'] = encoder
+    outputs = {plan['name']: output_path(output_file, plan['name']) for plan in plans}
+    
+    print(f"\nCompressing {input_file} to {len(plans)} renditions (one decode)...")
+    for plan in plans:
+        print(f"  {outputs[plan['name']]}: {describe(plan['profile'])}")
+    
+    pbar = tqdm(total=100, desc="Progress", unit="%", ncols=70)
+    
+    def on_progress(seconds, sizes):
+        pbar.n = int(min(seconds / duration, 1) * 100) if duration else 0
+        pbar.set_postfix_str(' '.join(f"{name}={size / (1024 * 1024):.1f}MB"
+                                      for name, size in sizes.items()))
+        pbar.refresh()
+    
+    try:
+        sizes = encode_renditions(ffmpeg_path, input_file, plans, outputs,
+                                  has_audio=video_info['has_audio'], on_progress=on_progress)
+        pbar.n = 100
+        pbar.refresh()
+    finally:
+        pbar.close()
+    
+    original_size = os.path.getsize(input_file)
+    print("\n" + "="*50)
+    print("           RENDITIONS COMPLETE")
+    print("="*50)
+    for plan in plans:
+        size = sizes[plan['name']]
+        print(f"📁 {plan['name']:>6s}: {outputs[plan['name']]} {size / (1024 * 1024):>8.2f} MB "
+              f"({(1 - size / original_size) * 100:.1f}% smaller)")
+    print(f"⏱️  Time: {time.time() - start_time:.0f}s")
+    print("="*50)
+    return outputs
+
+def run_with_progress(cmd, duration, pbar, max_projected_size=None):
+    """
+    Run an ffmpeg command (without -progress) and drive pbar (total=100) from
+    its -progress stream. Stops ffmpeg if the projected output size goes over
+    max_projected_size bytes. Raises ffmpeg.Error on failure.
+    """
+    from ffmpeg_progress import ProgressReader, PROGRESS_ARGS, format_update
+    
+    process = subprocess.Popen(cmd[:1] + PROGRESS_ARGS + cmd[1:], stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    reader = ProgressReader(process.stderr, duration)
+    aborted = None
+    for update in reader:
+        if update['fraction'] is not None:
+            pbar.n = int(update['fraction'] * 100)
+        pbar.set_postfix_str(format_update(update))
+        pbar.refresh()
+        projected = update['projected_size']
+        if max_projected_size and projected and projected > max_projected_size and not update['done']:
+            aborted = (f"Stopped: projected output {projected / (1024 * 1024):.1f} MB is over "
+                       f"the {max_projected_size / (1024 * 1024):.1f} MB limit")
+            process.terminate()
+            break
+    process.wait()
+    if aborted:
+        raise ffmpeg.Error('ffmpeg', b'', aborted.encode())
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', reader.text().encode())
+    return reader.last
+
+def compress_mp4_for_youtube(input_file, output_file, target_bitrate="2M", target_size=None,
+                             goal=GOAL_BALANCED, max_height=DEFAULT_MAX_HEIGHT, encoder=DEFAULT_BACKEND,
+                             max_projected_size=None):
     """
     Compress MP4 file for YouTube upload while preserving audio quality.
     
@@ -85,6 +263,12 @@ def compress_mp4_for_youtube(input_file, output_file, target_bitrate="2M"):
         input_file: Path to input MP4 file
         output_file: Path to output compressed MP4 file
         target_bitrate: Video bitrate (default: 2M for 1080p)
+        target_size: Aim for this many bytes instead (two-pass; overrides the bitrate)
+        goal: 'speed', 'balanced' or 'size' (x264 preset, CRF and fps cap)
+        max_height: Largest output short side; bigger sources are downscaled (0 = no limit)
+        encoder: Backend from encoders.BACKENDS (x264 if this ffmpeg lacks it;
+                 target_size encodes always use x264)
+        max_projected_size: Stop early if the output is projected to exceed this many bytes
     """
     start_time = time.time()
     
@@ -98,98 +282,92 @@ def compress_mp4_for_youtube(input_file, output_file, target_bitrate="2M"):
         if not os.path.exists(input_file):
             raise Exception(f"Input file '{input_file}' not found")
         
-        # Get input file info
+        # Get input file info (container header only, cached by content hash)
+        from video_probe import probe_video
         try:
-            # Always use system PATH for ffprobe on Heroku
-            if ffmpeg_path == "/app/vendor/ffmpeg/ffmpeg":
-                # On Heroku, use system PATH for both ffmpeg and ffprobe
-                probe = ffmpeg.probe(input_file)
-            elif ffmpeg_path != "ffmpeg":
-                # Use custom ffprobe path for local development
-                if ffmpeg_path.endswith('.exe'):
-                    ffprobe_path = ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe')
-                else:
-                    ffprobe_path = ffmpeg_path.replace('ffmpeg', 'ffprobe')
-                probe = ffmpeg.probe(input_file, cmd=ffprobe_path)
-            else:
-                probe = ffmpeg.probe(input_file)
+            video_info = probe_video(input_file)
         except ffmpeg.Error as e:
             raise Exception(f"Invalid video file '{input_file}': {e.stderr.decode() if e.stderr else 'Unknown error'}")
-        video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-        width = int(video_info['width'])
-        height = int(video_info['height'])
-        
-        # Determine optimal settings based on resolution
-        if height >= 1080:
-            bitrate = target_bitrate
-            crf = 23
-        elif height >= 720:
-            bitrate = "1.5M"
-            crf = 24
-        else:
-            bitrate = "1M"
-            crf = 25
+        if not video_info['has_video']:
+            raise Exception(f"Invalid video file '{input_file}': no video stream")
+        width = video_info['width']
+        height = video_info['height']
+        
+        if target_size:
+            from target_size import format_size
+            from encode_plan import format_bitrate
+            print(f"\nCompressing {input_file} to {format_size(target_size)} (two-pass)...")
+            result = compress_to_size(ffmpeg_path, input_file, output_file, video_info, target_size,
+                                      goal, max_height)
+            print_compression_summary(input_file, output_file, video_info,
+                                      format_bitrate(result['video_bitrate']), 'n/a (two-pass)',
+                                      time.time() - start_time)
+            print(f"🎯 Target:     {format_size(target_size):>8s} "
+                  f"({result['deviation']:+.1f}%, {result['attempts']} attempt(s))")
+            return
+        
+        # Output size, fps cap, preset and CRF (same rules as the web app)
+        profile = choose_profile(video_info, target_bitrate, goal, max_height)
+        profile['encoder'] = resolve_backend(encoder, available_backends(ffmpeg_path))
+        bitrate, crf = profile['maxrate'], profile['crf']
         
         # Display compression info
         print(f"\nCompressing {input_file}...")
-        print(f"Settings: {width}x{height}, Bitrate: {bitrate}, CRF: {crf}")
-        
-        # Start file size monitoring
-        original_size_mb = os.path.getsize(input_file) / (1024 * 1024)
-        stop_event = threading.Event()
-        monitor_thread = threading.Thread(target=monitor_output_file, 
-                                        args=(output_file, original_size_mb, stop_event))
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        print(f"Source: {width}x{height} -> {describe(profile)}")
         
         # Compress video
         input_stream = ffmpeg.input(input_file)
         
         # Process video and audio streams separately then combine
-        video_stream = input_stream['v:0'].filter('scale', width, height)
-        audio_stream = input_stream['a:0']
+        streams = [input_stream['v:0']]
+        options = {}
+        if profile['filters']:
+            options['vf'] = profile['filters']  # downscale / fps cap
+        if video_info['has_audio']:
+            streams.append(input_stream['a:0'])
+            options.update(
+                acodec='aac',     # High quality audio codec
+                audio_bitrate='128k',  # Good audio quality without bloat
+                ac=2,             # Stereo audio
+                ar=44100,         # Standard sample rate
+            )
+        
+        # Encoder, preset (from the goal), CRF, bitrate cap and pix_fmt as flag/value pairs
+        video_codec = codec_args(profile['encoder'], profile['preset'], crf, bitrate, profile['bufsize'])
+        options.update(zip((flag.lstrip('-') for flag in video_codec[::2]), video_codec[1::2]))
         
         # Output with both video and audio
         output = ffmpeg.output(
-            video_stream, audio_stream,
+            *streams,
             output_file,
-            vcodec='libx264',
-            preset='medium',  # Balance between speed and compression
-            crf=crf,          # Constant Rate Factor for quality
-            maxrate=bitrate,  # Maximum bitrate
-            bufsize=f"{int(bitrate[:-1]) * 2}M",  # Buffer size
-            pix_fmt='yuv420p',  # YouTube compatible pixel format
-            acodec='aac',     # High quality audio codec
-            audio_bitrate='128k',  # Good audio quality without bloat
-            ac=2,             # Stereo audio
-            ar=44100,         # Standard sample rate
-            movflags='faststart'  # Optimize for web streaming
+            movflags='faststart',  # Optimize for web streaming
+            **options
         )
         
         # Create progress bar
         print("\nCompressing...")
-        pbar = tqdm(total=100, desc="Progress", unit="%", ncols=70)
+        pbar = tqdm(total=100, desc="Progress", unit="%", ncols=100)
         
         try:
-            # On Heroku, use system PATH; locally use custom path
-            if ffmpeg_path == "/app/vendor/ffmpeg/ffmpeg":
-                ffmpeg.run(output, overwrite_output=True, quiet=True)
-            elif ffmpeg_path != "ffmpeg":
-                ffmpeg.run(output, overwrite_output=True, quiet=True, cmd=ffmpeg_path)
-            else:
-                ffmpeg.run(output, overwrite_output=True, quiet=True)
-            pbar.update(100)
+            # Progress (time, fps, speed, size so far and projected) from ffmpeg's -progress stream
+            cmd = ffmpeg.compile(output.global_args('-hide_banner'), cmd=ffmpeg_path, overwrite_output=True)
+            run_with_progress(cmd, video_info['duration'], pbar, max_projected_size)
+            pbar.n = 100
+            pbar.refresh()
+        except ffmpeg.Error:
+            if os.path.exists(output_file):
+                os.remove(output_file)  # partial output
+            raise
         finally:
             pbar.close()
-            stop_event.set()
-            monitor_thread.join(timeout=1)
         
         # Calculate processing time
         end_time = time.time()
         processing_time = end_time - start_time
         
         # Show visual compression summary
-        print_compression_summary(input_file, output_file, video_info, bitrate, crf, processing_time)
+        output_info = {'width': profile['width'] or width, 'height': profile['height'] or height}
+        print_compression_summary(input_file, output_file, output_info, bitrate, crf, processing_time)
         
     except ffmpeg.Error as e:
         print(f"FFmpeg error: {e.stderr.decode() if e.stderr else 'Unknown FFmpeg error'}")
@@ -197,15 +375,97 @@ def compress_mp4_for_youtube(input_file, output_file, target_bitrate="2M"):
         print(f"Error compressing video: {e}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python mp4_compressor.py input_file.mp4 output_file.mp4")
-        sys.exit(1)
+    import argparse
+    from target_size import parse_size
+    from renditions import parse_renditions
+    
+    parser = argparse.ArgumentParser(description="Compress MP4 files for YouTube upload")
+    parser.add_argument('input_file', nargs='?')
+    parser.add_argument('output_file', nargs='?')
+    parser.add_argument('--target-size', type=parse_size, default=None,
+                        help="aim for this output size, e.g. 25M (two-pass encode)")
+    parser.add_argument('--preview', action='store_true',
+                        help="encode a few sampled clips and project size/time instead of a full run")
+    parser.add_argument('--quality', action='store_true',
+                        help="with --preview, also measure SSIM/PSNR against the source")
+    parser.add_argument('--goal', choices=GOALS, default=GOAL_BALANCED,
+                        help="favour encode speed or output size (default: balanced)")
+    parser.add_argument('--max-height', type=int, default=DEFAULT_MAX_HEIGHT,
+                        help="downscale larger sources to this short side, e.g. 720 (0 = keep size)")
+    parser.add_argument('--encoder', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help="video encoder backend (falls back to x264 if ffmpeg lacks it)")
+    parser.add_argument('--renditions', type=parse_renditions, default=[],
+                        help="encode several sizes from one decode, e.g. 1080p,720p,480p")
+    parser.add_argument('--abort-over', type=parse_size, default=None,
+                        help="stop once the output is projected to be larger than this, e.g. 50M")
+    batch_group = parser.add_argument_group('batch mode')
+    batch_group.add_argument('--batch', nargs='+', metavar='SOURCE', default=[],
+                             help="directories, globs or files to compress into --output-dir")
+    batch_group.add_argument('--manifest',
+                             help="CSV/JSON list of inputs (input, output, bitrate, goal, target_size, ...)")
+    batch_group.add_argument('--output-dir', help="where batch outputs go (mirrors the source layout)")
+    batch_group.add_argument('--recursive', action='store_true', help="include subdirectories")
+    batch_group.add_argument('--jobs', type=int, default=2, help="encodes to run at once (default: 2)")
+    batch_group.add_argument('--threads', type=int, default=0,
+                             help="ffmpeg threads per encode (default: cores / --jobs)")
+    batch_group.add_argument('--check-hash', action='store_true',
+                             help="treat inputs with a new mtime but the same content as up to date")
+    batch_group.add_argument('--force', action='store_true', help="re-encode outputs that are up to date")
+    batch_group.add_argument('--summary',
+                             help="summary file, .csv or .json (default: OUTPUT_DIR/batch_summary.csv)")
+    args = parser.parse_args()
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+    if args.batch or args.manifest:
+        import batch
+        if not args.output_dir:
+            parser.error("--output-dir is required in batch mode")
+        if args.renditions or args.preview:
+            parser.error("--renditions and --preview can't be combined with batch mode")
+        defaults = {'goal': args.goal, 'max_height': args.max_height, 'encoder': args.encoder,
+                    'target_size': args.target_size}
+        jobs = batch.collect_jobs(args.batch, args.output_dir, args.recursive, defaults)
+        if args.manifest:
+            jobs += batch.load_manifest(args.manifest, args.output_dir, defaults)
+        if not jobs:
+            print("No input files found")
+            sys.exit(1)
+        
+        def print_summary(job, result, seconds):
+            profile = result['profile']
+            info = result['info']
+            output_info = {'width': profile['width'] or info['width'], 'height': profile['height'] or info['height']}
+            crf = 'n/a (two-pass)' if job.get('target_size') else profile['crf']
+            print_compression_summary(job['input'], job['output'], output_info, result['bitrate'], crf, seconds)
+        
+        try:
+            rows = batch.run_batch(jobs, args.output_dir, args.jobs, args.threads, args.check_hash,
+                                   args.force, args.summary, on_complete=print_summary)
+        except Exception as e:
+            print(f"Error running batch: {e}")
+            sys.exit(1)
+        sys.exit(1 if any(row['status'] == batch.STATUS_FAILED for row in rows) else 0)
     
-    if not os.path.exists(input_file):
-        print(f"Input file '{input_file}' not found")
+    if not args.input_file:
+        parser.error("input_file is required (or --batch / --manifest)")
+    if not os.path.exists(args.input_file):
+        print(f"Input file '{args.input_file}' not found")
         sys.exit(1)
     
-    compress_mp4_for_youtube(input_file, output_file)
\ No newline at end of file
+    if args.preview:
+        preview_mp4(args.input_file, target_size=args.target_size, quality=args.quality,
+                    goal=args.goal, max_height=args.max_height, encoder=args.encoder)
+    elif not args.output_file:
+        parser.error("output_file is required unless --preview is given")
+    elif args.renditions:
+        if args.target_size:
+            parser.error("--target-size can't be combined with --renditions")
+        try:
+            compress_renditions(args.input_file, args.output_file, args.renditions, goal=args.goal,
+                                encoder=args.encoder)
+        except Exception as e:
+            print(f"Error compressing video: {e}")
+            sys.exit(1)
+    else:
+        compress_mp4_for_youtube(args.input_file, args.output_file, target_size=args.target_size,
+                                 goal=args.goal, max_height=args.max_height, encoder=args.encoder,
+                                 max_projected_size=args.abort_over)
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Quick preview of what a full encode would produce.
+
+A few short clips sampled evenly across the input are encoded in parallel
+with the chosen settings. Their bytes per second give the projected output
+size and their frames per second the projected encode time. Optionally each
+clip is also scored against the source with ffmpeg's SSIM and PSNR filters.
+
+The encode time is projected from the samples' combined throughput, so give
+the samples the same total thread budget the full job will get (threads per
+sample x samples). Samples skip the first and last few percent of the input,
+where intros and fades usually compress unusually well.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SAMPLES = 4
+DEFAULT_SAMPLE_SECONDS = 4
+# Keep samples away from the very start and end of the input
+EDGE_MARGIN = 0.05
+
+SSIM_PATTERN = re.compile(r'SSIM .*All:([\d.]+)')
+PSNR_PATTERN = re.compile(r'PSNR .*average:([\d.]+|inf)')
+
+
+def sample_points(duration, samples=DEFAULT_SAMPLES, sample_seconds=DEFAULT_SAMPLE_SECONDS):
+    """(start, length) pairs spread evenly across the input"""
+    if duration <= samples * sample_seconds:
+        return [(0.0, duration)]  # short input: the whole thing is the sample
+    usable = duration * (1 - 2 * EDGE_MARGIN) - sample_seconds
+    step = usable / max(samples - 1, 1)
+    first = duration * EDGE_MARGIN
+    return [(first + i * step, float(sample_seconds)) for i in range(samples)]
+
+
+def _run(cmd):
+    # Several run at once from request threads; none of them may read our stdin
+    result = subprocess.run(cmd, capture_output=True, text=True, stdin=subprocess.DEVNULL)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg error: {result.stderr[-2000:]}")
+    return result
+
+
+def _progress_value(output, key):
+    """Last value of key in ffmpeg -progress output"""
+    value = None
+    for line in output.splitlines():
+        if line.startswith(key + '='):
+            value = line.split('=', 1)[1].strip()
+    return value
+
+
+def measure_quality(ffmpeg_path, input_path, sample_path, start, length):
+    """(SSIM, PSNR) of an encoded sample against the same span of the source"""
+    graph = ('[0:v][1:v]scale2ref=flags=bicubic[dist][ref];'
+             '[dist]split[d1][d2];[ref]split[r1][r2];'
+             '[d1][r1]ssim;[d2][r2]psnr')
+    result = _run([ffmpeg_path, '-hide_banner', '-nostats', '-nostdin',
+                   '-i', sample_path,
+                   '-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', input_path,
+                   '-lavfi', graph, '-an', '-f', 'null', os.devnull])
+    ssim = SSIM_PATTERN.search(result.stderr)
+    psnr = PSNR_PATTERN.search(result.stderr)
+    return (float(ssim.group(1)) if ssim else None,
+            float(psnr.group(1)) if psnr and psnr.group(1) != 'inf' else None)
+
+
+def encode_sample(ffmpeg_path, input_path, start, length, encode_args, output_path,
+                  threads=0, quality=False):
+    """Encode one clip and measure it. Returns a dict describing the sample."""
+    started = time.monotonic()
+    result = _run([ffmpeg_path, '-v', 'error', '-nostdin', '-ss', f"{start:.3f}", '-t', f"{length:.3f}",
+                   '-i', input_path] + list(encode_args)
+                  + ['-threads', str(threads), '-progress', 'pipe:1', '-y', output_path])
+    elapsed = max(time.monotonic() - started, 0.001)
+
+    frames = int(_progress_value(result.stdout, 'frame') or 0)
+    sample = {
+        'start': round(start, 3),
+        'duration': length,
+        'size': os.path.getsize(output_path),
+        'encode_seconds': round(elapsed, 3),
+        'fps': round(frames / elapsed, 1),
+        'frames': frames,
+    }
+    if quality:
+        sample['ssim'], sample['psnr'] = measure_quality(ffmpeg_path, input_path, output_path,
+                                                         start, length)
+    return sample
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def preview_encode(ffmpeg_path, input_path, duration, encode_args, fps=None,
+                   samples=DEFAULT_SAMPLES, sample_seconds=DEFAULT_SAMPLE_SECONDS,
+                   processes=None, threads=0, quality=False, workdir=None):
+    """
+    Encode sampled clips in parallel and project the full encode.
+
+    Args:
+        encode_args: ffmpeg codec arguments (video + audio) the full job would use
+        fps: Input frame rate, for the projected encode time (falls back to the
+             frame count the samples report)
+        processes: Clips encoded at once (default: one per sample)
+        threads: ffmpeg -threads for each clip
+        quality: Also compute SSIM/PSNR against the source
+
+    Returns a dict with 'projected_size' (bytes), 'projected_encode_seconds',
+    average 'ssim'/'psnr' (None unless quality) and the per-sample results.
+    """
+    if not duration or duration <= 0:
+        raise ValueError("Preview needs the input duration")
+    points = sample_points(duration, samples, sample_seconds)
+    folder = tempfile.mkdtemp(prefix='preview_', dir=workdir)
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=processes or len(points)) as pool:
+            futures = [pool.submit(encode_sample, ffmpeg_path, input_path, start, length,
+                                   encode_args, os.path.join(folder, f"sample_{i}.mp4"),
+                                   threads, quality)
+                       for i, (start, length) in enumerate(points)]
+            results = [future.result() for future in futures]
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    # Combined throughput; the encode stage alone when quality scoring also ran
+    wall = time.monotonic() - started
+    if quality:
+        wall = max(s['encode_seconds'] for s in results)
+
+    sampled_seconds = sum(s['duration'] for s in results)
+    sampled_frames = sum(s['frames'] for s in results)
+    encode_fps = sampled_frames / max(wall, 0.001)
+    total_frames = duration * (fps or sampled_frames / sampled_seconds)
+    return {
+        'projected_size': int(sum(s['size'] for s in results) / sampled_seconds * duration),
+        'projected_encode_seconds': round(total_frames / encode_fps, 1) if encode_fps else None,
+        'encode_fps': round(encode_fps, 1),
+        'ssim': _mean(s.get('ssim') for s in results),
+        'psnr': _mean(s.get('psnr') for s in results),
+        'samples': results,
+        'preview_seconds': round(time.monotonic() - started, 2),
+    }
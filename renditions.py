@@ -0,0 +1,145 @@
+"""
+Several output sizes from a single decode.
+
+The input is decoded once, and ffmpeg's split filter fans the frames out to
+one scaled encoder per rendition, all inside one process:
+
+    [0:v]split=3[s0][s1][s2];
+    [s0]scale=-2:1080,setsar=1[v0];[s1]scale=-2:720,setsar=1[v1];[s2]...
+
+Renditions are ladder rungs from encode_profile ('1080p', '720p', ...). Each
+one gets that rung's profile (bitrate cap, CRF, fps cap), so a 720p
+rendition matches what a single 720p encode would produce. Rungs above the
+source size are dropped instead of upscaled. The job's thread budget is
+shared between the encoders in proportion to their pixel counts.
+"""
+
+import os
+import subprocess
+import time
+
+import job_control
+from encode_plan import (parse_bitrate, format_bitrate, video_args, audio_args,
+                         PATH_TRANSCODE)
+from encode_profile import LADDER, GOAL_SPEED, choose_profile, display_size
+from ffmpeg_progress import ProgressReader, PROGRESS_ARGS
+
+RUNGS = {rung['name']: rung for rung in LADDER}
+# A 1920x1072 source still counts as 1080p
+SOURCE_TOLERANCE = 0.9
+PROGRESS_INTERVAL = 0.5
+
+
+def parse_renditions(value):
+    """Rendition names from '1080p,720p' (or a list), largest first; [] when not given"""
+    if not value:
+        return []
+    names = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    names = {name.strip().lower() for name in names if name.strip()}
+    unknown = names - set(RUNGS)
+    if unknown:
+        raise ValueError(f"Unknown rendition(s): {', '.join(sorted(unknown))} "
+                         f"(choose from {', '.join(RUNGS)})")
+    return [rung['name'] for rung in LADDER if rung['name'] in names]
+
+
+def plan_renditions(info, names, bitrate='2M', goal=GOAL_SPEED):
+    """
+    Profiles for the renditions a source can fill.
+
+    Returns a list of {'name', 'profile'} dicts, largest first. Raises
+    ValueError if the source size is unknown or smaller than every rung.
+    """
+    width, height = display_size(info or {})
+    short_side = min(width, height)
+    if not short_side:
+        raise ValueError("Renditions need the video size, but the input couldn't be probed")
+
+    requested = parse_bitrate(bitrate)
+    plans = []
+    for name in names:
+        rung = RUNGS[name]
+        if short_side < rung['height'] * SOURCE_TOLERANCE:
+            print(f"Skipping {name} rendition: source is only {width}x{height}")
+            continue
+        # The rung's own bitrate floor applies, so 480p-level bitrates don't shrink 1080p
+        rung_bitrate = format_bitrate(max(requested, rung['min_bitrate']))
+        plans.append({'name': name,
+                      'profile': choose_profile(info, rung_bitrate, goal, rung['height'])})
+    if not plans:
+        raise ValueError(f"Source ({width}x{height}) is smaller than every requested rendition")
+    return plans
+
+
+def _thread_shares(plans, threads):
+    # 0 = let each encoder pick; otherwise split by pixel count (at least 1 each)
+    if not threads:
+        return [0] * len(plans)
+    pixels = [max(p['profile']['width'] * p['profile']['height'], 1) for p in plans]
+    return [max(1, round(threads * n / sum(pixels))) for n in pixels]
+
+
+def build_command(ffmpeg_path, input_path, plans, outputs, has_audio=True, threads=0):
+    """ffmpeg command encoding every planned rendition to outputs[name]"""
+    count = len(plans)
+    if count == 1:
+        graph = [f"[0:v]{plans[0]['profile']['filters'] or 'null'}[v0]"]
+    else:
+        graph = [f"[0:v]split={count}" + ''.join(f"[s{i}]" for i in range(count))]
+        graph += [f"[s{i}]{plan['profile']['filters'] or 'null'}[v{i}]"
+                  for i, plan in enumerate(plans)]
+
+    transcode = {'path': PATH_TRANSCODE, 'video': 'transcode',
+                 'audio': 'transcode' if has_audio else 'none'}
+    cmd = [ffmpeg_path, '-v', 'error', '-nostdin', '-y'] + PROGRESS_ARGS + ['-i', input_path,
+           '-filter_complex', ';'.join(graph)]
+    for i, (plan, share) in enumerate(zip(plans, _thread_shares(plans, threads))):
+        profile = plan['profile']
+        cmd += ['-map', f"[v{i}]"] + (['-map', '0:a:0'] if has_audio else [])
+        cmd += video_args(transcode, profile['maxrate'], preset=profile['preset'], crf=profile['crf'],
+                          encoder=profile['encoder'])
+        cmd += audio_args(transcode)
+        cmd += ['-threads', str(share), '-movflags', 'faststart', outputs[plan['name']]]
+    return cmd
+
+
+def _sizes(outputs):
+    return {name: os.path.getsize(path) if os.path.exists(path) else 0
+            for name, path in outputs.items()}
+
+
+def encode_renditions(ffmpeg_path, input_path, plans, outputs, has_audio=True, threads=0,
+                      on_progress=None):
+    """
+    Encode all renditions in one ffmpeg process.
+
+    Args:
+        plans: From plan_renditions
+        outputs: Output path per rendition name
+        on_progress: Called as on_progress(seconds_encoded, {name: bytes written})
+
+    Returns {name: final size in bytes}.
+    """
+    cmd = build_command(ffmpeg_path, input_path, plans, outputs, has_audio, threads)
+    process = job_control.spawn(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                stdin=subprocess.DEVNULL, universal_newlines=True, bufsize=1)
+    # Progress and errors share stderr: one reader, nothing else to drain
+    reader = ProgressReader(process.stderr)
+
+    last_report = 0
+    for update in reader:
+        now = time.monotonic()
+        if on_progress is not None and update['out_time'] is not None and now - last_report >= PROGRESS_INTERVAL:
+            on_progress(update['out_time'], _sizes(outputs))
+            last_report = now
+
+    process.wait()
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg error: {reader.text()}")
+    return _sizes(outputs)
+
+
+def output_path(base_path, name):
+    """outputs/job_video.mp4 -> outputs/job_video_720p.mp4"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}_{name}{ext or '.mp4'}"
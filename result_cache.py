@@ -0,0 +1,156 @@
+"""
+Content-addressed cache of finished encodes.
+
+An entry's key is a hash of the input's content plus the normalized encode
+parameters, so the same file uploaded again with the same settings is served
+from the cache instead of being re-encoded.
+
+The content hash is a two-level SHA-256: every 256 KB leaf is hashed, and the
+leaf digests plus the total size are hashed again. Streaming uploads can hash
+as bytes arrive, and chunked uploads can hash each chunk on its own (chunk
+sizes are whole leaves) and combine the results at finalize, and all three
+upload paths produce the same digest for the same file.
+
+Entries are plain files named <key>.mp4. The file mtime is the LRU clock: a
+hit touches it, and eviction removes the oldest entries once the folder
+exceeds its size bound. No other index is kept, so every gunicorn worker can
+share the folder.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+LEAF_SIZE = 256 * 1024
+# Bump when encoder settings change so old entries stop matching
+CACHE_VERSION = 1
+
+
+def leaf_digests(data):
+    """SHA-256 of each LEAF_SIZE piece of data (the last one may be short)"""
+    view = memoryview(data)
+    return [hashlib.sha256(view[i:i + LEAF_SIZE]).digest() for i in range(0, len(view), LEAF_SIZE)]
+
+
+def combine_leaves(digests, size):
+    """Content digest from a file's leaf digests, in order"""
+    root = hashlib.sha256()
+    for digest in digests:
+        root.update(digest)
+    root.update(str(size).encode())
+    return root.hexdigest()
+
+
+class ContentHasher:
+    """Incremental content digest for data that arrives in order"""
+
+    def __init__(self):
+        self.size = 0
+        self._leaves = []
+        self._leaf = hashlib.sha256()
+        self._leaf_len = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            take = min(LEAF_SIZE - self._leaf_len, len(view))
+            self._leaf.update(view[:take])
+            self._leaf_len += take
+            self.size += take
+            view = view[take:]
+            if self._leaf_len == LEAF_SIZE:
+                self._leaves.append(self._leaf.digest())
+                self._leaf = hashlib.sha256()
+                self._leaf_len = 0
+
+    def hexdigest(self):
+        leaves = self._leaves + ([self._leaf.digest()] if self._leaf_len else [])
+        return combine_leaves(leaves, self.size)
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """Content digest of a file already on disk"""
+    hasher = ContentHasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def cache_key(content_digest, params):
+    """Cache key for an input digest and a dict of encode parameters"""
+    encoded = json.dumps({'content': content_digest, 'params': params, 'version': CACHE_VERSION},
+                         sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _link_or_copy(source, target):
+    # Hard links make cache stores and hits free on the same filesystem
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+
+
+class ResultCache:
+    """Size-bounded LRU of encoded outputs in a folder"""
+
+    def __init__(self, folder, max_bytes, max_age=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key}.mp4")
+
+    def fetch(self, key, target_path):
+        """Place the cached output for key at target_path. Returns False on a miss."""
+        entry = self.path(key)
+        try:
+            os.utime(entry)  # mark as recently used
+            _link_or_copy(entry, target_path)
+        except FileNotFoundError:
+            return False  # never cached, or evicted by another worker
+        return True
+
+    def store(self, key, output_path):
+        """Add a finished output to the cache (the output itself stays in place)"""
+        _link_or_copy(output_path, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, path) for every entry, least recently used first"""
+        entries = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.mp4'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove expired entries, then the least recently used until under max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for mtime, size, path in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            if not expired and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                print(f"Evicted cached result: {path}")
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
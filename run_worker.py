@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Encode worker for MP4 Compressor
+Run this file (any number of times, on any host that shares uploads/,
+outputs/ and the job database) to encode jobs queued by a web tier
+started with ENCODE_MODE=queue
+"""
+
+import os
+import signal
+import sys
+import threading
+import time
+
+os.environ.setdefault('ENCODE_MODE', 'queue')
+if os.environ['ENCODE_MODE'] != 'queue':
+    sys.exit("run_worker.py needs ENCODE_MODE=queue")
+
+import job_control
+from app import app, job_queue, scheduler, run_queued_job, start_job_watcher, start_process_threads
+from job_control import RELEASED, LOST
+
+app.config['ENCODE_WORKER'] = True
+
+POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 1))
+
+worker_id = job_control.process_owner()
+held = set()  # job ids this worker holds a lease on
+held_lock = threading.Lock()
+stopping = threading.Event()
+
+
+def run_leased(job_id, payload, attempts, threads=0):
+    """Scheduler entry point: encode a leased job, then complete or hand back its lease"""
+    done = True
+    try:
+        done = run_queued_job(job_id, payload, attempts, threads)
+    finally:
+        with held_lock:
+            held.discard(job_id)
+        if done:
+            job_queue.complete(job_id, worker_id)
+        else:
+            job_queue.release(job_id, worker_id)
+            print(f"Job {job_id} handed back to the queue")
+
+
+def keep_leases():
+    """Extend this worker's leases; stop any job whose lease went to another worker"""
+    lease_seconds = app.config['JOB_LEASE_SECONDS']
+    while True:
+        time.sleep(lease_seconds / 3)
+        with held_lock:
+            job_ids = list(held)
+        for job_id in job_ids:
+            try:
+                if not job_queue.heartbeat(job_id, worker_id, lease_seconds):
+                    print(f"Lost the lease on job {job_id}")
+                    job_control.cancel(job_id, LOST, grace=app.config['KILL_GRACE'])
+            except Exception as e:
+                print(f"Lease heartbeat for job {job_id} failed: {e}")
+
+
+def shutdown(signum, frame):
+    """Stop leasing and hand running jobs back to the queue"""
+    if stopping.is_set():
+        return
+    stopping.set()
+    with held_lock:
+        job_ids = list(held)
+    print(f"\n⏹️  Stopping worker, handing back {len(job_ids)} job(s)...")
+    for job_id in job_ids:
+        job_control.cancel(job_id, RELEASED, grace=app.config['KILL_GRACE'])
+
+
+def main():
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    scheduler.start()
+    start_job_watcher()
+    start_process_threads()
+    heartbeat_thread = threading.Thread(target=keep_leases, name='lease-heartbeat')
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+
+    print(f"🎬 Encode worker {worker_id} started")
+    print(f"📡 Queue: {app.config['JOB_QUEUE']} ({scheduler.workers} slots)")
+    print("-" * 50)
+
+    while not stopping.is_set():
+        stats = scheduler.stats()
+        leased = None
+        if stats['running'] + stats['queued'] < scheduler.workers:
+            try:
+                leased = job_queue.lease(worker_id, app.config['JOB_LEASE_SECONDS'])
+            except Exception as e:
+                print(f"Leasing from the queue failed: {e}")
+        if leased is None:
+            stopping.wait(POLL_INTERVAL)
+            continue
+        job_id, payload, attempts = leased
+        print(f"Leased job {job_id}" + (f" (attempt {attempts})" if attempts else ""))
+        with held_lock:
+            held.add(job_id)
+        scheduler.submit(job_id, run_leased, args=(job_id, payload, attempts),
+                         priority=payload.get('priority', 0), force=True)
+
+    # Wait for handed-back jobs to unwind, then leave without the app's timers
+    deadline = time.monotonic() + app.config['KILL_GRACE'] + 10
+    while time.monotonic() < deadline:
+        with held_lock:
+            if not held:
+                break
+        time.sleep(0.2)
+    print("👋 Worker stopped. Goodbye!")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
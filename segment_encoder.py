@@ -0,0 +1,508 @@
+"""
+Segment-parallel encoding.
+
+The input's video is split at keyframe (GOP) boundaries with a stream copy,
+the segments are encoded at the same time, and the results are stitched back
+together with the concat demuxer without re-encoding. Audio is encoded once
+as a single stream so there are no gaps at segment boundaries.
+
+Segments are encoded either locally in a ProcessPoolExecutor or through a
+shared directory that other hosts can help drain:
+
+    python segment_encoder.py --worker /mnt/shared/segments
+
+A resumable encode keeps its work directory when it fails and writes a
+checkpoint (segments.json) after the split. Run again on the same directory,
+it reuses the split and the encoder arguments and only encodes the segments
+that have no output yet. Outputs are renamed into place when complete, so an
+existing one is a finished one.
+"""
+
+import csv
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+
+import job_control
+from ffmpeg_progress import ProgressReader
+
+EXECUTOR_PROCESS = 'process'
+EXECUTOR_SHARED = 'shared'
+
+# Target segment length; the split lands on the first keyframe after each mark
+DEFAULT_SEGMENT_SECONDS = 30
+PROGRESS_INTERVAL = 0.5
+CHECKPOINT_NAME = 'segments.json'
+
+
+def _run(cmd):
+    result = job_control.run(cmd, capture_output=True, universal_newlines=True)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg error: {result.stderr[-2000:]}")
+    return result
+
+
+def split_at_keyframes(ffmpeg_path, input_path, workdir, duration,
+                       segment_seconds=DEFAULT_SEGMENT_SECONDS):
+    """
+    Stream-copy the video into GOP-aligned chunks.
+
+    Returns a list of dicts with 'index', 'path', 'start' and 'duration'.
+    """
+    marks = []
+    t = segment_seconds
+    while t < duration - segment_seconds / 2:
+        marks.append(f"{t:.3f}")
+        t += segment_seconds
+
+    list_path = os.path.join(workdir, 'split.csv')
+    cmd = [
+        ffmpeg_path, '-v', 'error',
+        '-i', input_path,
+        '-map', '0:v:0', '-an', '-sn', '-dn',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_format', 'matroska',
+        '-segment_list', list_path,
+        '-segment_list_type', 'csv',
+        '-reset_timestamps', '1',
+    ]
+    if marks:
+        cmd += ['-segment_times', ','.join(marks)]
+    cmd += ['-y', os.path.join(workdir, 'src_%04d.mkv')]
+    _run(cmd)
+
+    segments = []
+    with open(list_path, newline='') as f:
+        for index, row in enumerate(csv.reader(f)):
+            name, start, end = row[0], float(row[1]), float(row[2])
+            segments.append({
+                'index': index,
+                'path': os.path.join(workdir, name),
+                'start': start,
+                'duration': max(0.0, end - start),
+            })
+    return segments
+
+
+def _encode_cmd(ffmpeg_path, src, dst, video_args, threads, progress):
+    return ([ffmpeg_path, '-v', 'error', '-i', src, '-an']
+            + list(video_args)
+            + ['-threads', str(threads), '-progress', progress, '-nostats', '-y', dst])
+
+
+def encode_segment(ffmpeg_path, index, src, dst, video_args, threads, progress_queue=None,
+                   cancel_event=None, parent_pid=None):
+    """
+    Encode one segment (runs in a worker process). Returns the segment index.
+
+    ffmpeg gets its own process group, and its pid goes to progress_queue as
+    (index, None, pid), so the parent can stop it (job_control.adopt).
+    Progress messages are (index, seconds, None). A pool process whose parent
+    (parent_pid) has died starts nothing: the job resumes elsewhere.
+    """
+    if parent_pid is not None and os.getppid() != parent_pid:
+        raise Exception(f"Segment {index} skipped: the encoding process is gone")
+    if cancel_event is not None and cancel_event.is_set():
+        raise Exception(f"Segment {index} skipped: encode stopped")
+    tmp = dst + '.part.mkv'
+    cmd = _encode_cmd(ffmpeg_path, src, tmp, video_args, threads, 'pipe:2')
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, universal_newlines=True, bufsize=1,
+                               start_new_session=True)
+    if progress_queue is not None:
+        progress_queue.put((index, None, process.pid))
+    # Progress and errors share stderr: one reader, nothing else to drain
+    reader = ProgressReader(process.stderr)
+
+    last_report = 0
+    for update in reader:
+        now = time.monotonic()
+        if progress_queue is not None and update['out_time'] is not None and now - last_report >= PROGRESS_INTERVAL:
+            progress_queue.put((index, update['out_time'], None))
+            last_report = now
+
+    process.wait()
+    if process.returncode != 0:
+        raise Exception(f"Segment {index} failed: {reader.text()}")
+    os.replace(tmp, dst)
+    return index
+
+
+def encode_audio(ffmpeg_path, input_path, dst, audio_args):
+    """Encode (or copy) the whole audio track once"""
+    tmp = dst + '.part.mka'
+    _run([ffmpeg_path, '-v', 'error', '-i', input_path, '-vn', '-sn', '-dn',
+          '-map', '0:a:0'] + list(audio_args) + ['-y', tmp])
+    os.replace(tmp, dst)
+    return dst
+
+
+def load_checkpoint(workdir):
+    """
+    Checkpoint of an interrupted resumable encode in workdir, or None:
+    {'video_args', 'segments', 'done'} where done lists finished segment indexes.
+    """
+    try:
+        with open(os.path.join(workdir, CHECKPOINT_NAME)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    segments = checkpoint.get('segments') or []
+    checkpoint['done'] = [seg['index'] for seg in segments if os.path.exists(seg['output'])]
+    if any(not os.path.exists(seg['path']) for seg in segments
+           if seg['index'] not in checkpoint['done']):
+        return None  # split pieces missing: start over
+    return checkpoint
+
+
+def _write_checkpoint(workdir, video_args, segments):
+    path = os.path.join(workdir, CHECKPOINT_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'video_args': list(video_args), 'segments': segments}, f)
+    os.replace(path + '.tmp', path)
+
+
+def concat_segments(ffmpeg_path, segment_paths, audio_path, output_path, workdir):
+    """Stitch encoded segments (plus the audio track) without re-encoding"""
+    list_path = os.path.join(workdir, 'concat.txt')
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [ffmpeg_path, '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_path:
+        cmd += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', 'faststart', '-y', output_path]
+    _run(cmd)
+
+
+def _exit_with_parent(parent_pid):
+    """Pool/manager initializer: exit once the process that started us has died"""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(1)
+
+    watcher = threading.Thread(target=watch, name='parent-watch')
+    watcher.daemon = True
+    watcher.start()
+
+
+def _encode_local(ffmpeg_path, segments, video_args, processes, threads, report):
+    """
+    Encode segments in a local process pool, streaming progress back. Segment
+    ffmpeg processes count as the calling thread's job (job_control), so a
+    cancel stops them too. Pool and manager processes go away with this one.
+    """
+    job_id = job_control.current_job()
+    manager = SyncManager()
+    manager.start(_exit_with_parent, (os.getpid(),))
+    with manager, ProcessPoolExecutor(max_workers=processes, initializer=_exit_with_parent,
+                                      initargs=(os.getpid(),)) as pool:
+        progress_queue = manager.Queue()
+        cancel_event = manager.Event()
+        futures = [
+            pool.submit(encode_segment, ffmpeg_path, seg['index'], seg['path'],
+                        seg['output'], video_args, threads, progress_queue, cancel_event,
+                        os.getpid())
+            for seg in segments
+        ]
+        pending = set(futures)
+
+        def drain_queue(with_progress=True):
+            while not progress_queue.empty():
+                index, seconds, pid = progress_queue.get_nowait()
+                if pid is not None:
+                    if job_id is not None:
+                        job_control.adopt(job_id, pid)
+                elif with_progress:
+                    report(index, seconds)
+
+        try:
+            while pending:
+                done = {f for f in pending if f.done()}
+                for future in done:
+                    report(future.result(), None)  # re-raises segment failures
+                pending -= done
+                drain_queue()
+                time.sleep(0.2)
+        except Exception:
+            # Segments already handed to a pool process skip themselves
+            cancel_event.set()
+            for future in pending:
+                future.cancel()
+            if job_id is not None and job_control.cancel_reason(job_id):
+                while any(not f.done() for f in pending):
+                    drain_queue(with_progress=False)  # adopt (and so stop) anything started meanwhile
+                    time.sleep(0.1)
+            raise
+        while not progress_queue.empty():
+            progress_queue.get_nowait()
+
+
+def _read_progress_file(path):
+    """Last out_time in an ffmpeg -progress file, in seconds"""
+    try:
+        with open(path) as f:
+            last = ProgressReader(f).drain()
+    except OSError:
+        return 0.0
+    return (last or {}).get('out_time') or 0.0
+
+
+def _claim_task(shared_dir):
+    """Atomically claim one pending task file, or return None"""
+    for task_path in sorted(glob.glob(os.path.join(shared_dir, 'tasks', '*.json'))):
+        claimed = f"{task_path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.rename(task_path, claimed)
+        except OSError:
+            continue  # another worker got it first
+        with open(claimed) as f:
+            return claimed, json.load(f)
+    return None
+
+
+def _claimed_elsewhere(task_path):
+    """
+    True if a live process holds a claim on task_path. Claims made on this
+    host by processes that have since died are removed.
+    """
+    live = False
+    for claimed in glob.glob(glob.escape(task_path) + '.*.*.*'):
+        host, pid, _ = claimed[len(task_path) + 1:].rsplit('.', 2)  # see _claim_task
+        if host == socket.gethostname() and pid.isdigit() and not _pid_alive(int(pid)):
+            os.remove(claimed)
+        else:
+            live = True
+    return live
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_shared_task(claimed, task, ffmpeg_path=None, bind_job=False):
+    """
+    Encode a claimed shared-directory task and mark it done or failed.
+    With bind_job (helper threads inside the job's own process) the ffmpeg is
+    registered under the task's job, so cancelling the job stops it.
+    """
+    from mp4_compressor import find_ffmpeg
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
+    tmp = task['output'] + '.part.mkv'
+    cmd = _encode_cmd(ffmpeg_path, task['input'], tmp, task['video_args'],
+                      task['threads'], task['output'] + '.progress')
+    job_id = task.get('job_id') if bind_job else None
+    try:
+        with job_control.bind(job_id, helper=True):
+            result = job_control.run(cmd, capture_output=True, universal_newlines=True)
+        error = result.stderr[-2000:] if result.returncode != 0 else None
+    except job_control.JobCancelled as e:
+        error = str(e)
+    if error is None:
+        os.replace(tmp, task['output'])
+        open(task['output'] + '.done', 'w').close()
+    else:
+        with open(task['output'] + '.failed', 'w') as f:
+            f.write(error)
+    os.remove(claimed)
+
+
+def run_shared_worker(shared_dir, poll_interval=1.0, stop_event=None, bind_jobs=False):
+    """
+    Keep claiming and encoding segment tasks from a shared directory
+    (bind_jobs: see run_shared_task)
+    """
+    os.makedirs(os.path.join(shared_dir, 'tasks'), exist_ok=True)
+    while not (stop_event and stop_event.is_set()):
+        claim = _claim_task(shared_dir)
+        if claim is None:
+            if stop_event:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        run_shared_task(*claim, bind_job=bind_jobs)
+
+
+def _encode_shared(ffmpeg_path, segments, video_args, processes, threads, report, shared_dir):
+    """Publish segments as task files; local threads and remote hosts drain them"""
+    task_dir = os.path.join(shared_dir, 'tasks')
+    os.makedirs(task_dir, exist_ok=True)
+    task_paths = []
+    for seg in segments:
+        task = {'input': seg['path'], 'output': seg['output'],
+                'video_args': list(video_args), 'threads': threads,
+                'job_id': job_control.current_job()}
+        task_name = f"{os.path.basename(os.path.dirname(seg['output']))}_{seg['index']:04d}.json"
+        if _claimed_elsewhere(os.path.join(task_dir, task_name)):
+            continue  # resumed encode: a live helper is still on it
+        for stale in ('.failed', '.progress'):
+            if os.path.exists(seg['output'] + stale):
+                os.remove(seg['output'] + stale)
+        tmp = os.path.join(task_dir, task_name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(task, f)
+        os.replace(tmp, os.path.join(task_dir, task_name))
+        task_paths.append(os.path.join(task_dir, task_name))
+
+    # This host helps drain its own tasks so the job finishes with no helpers
+    stop_event = threading.Event()
+    helpers = []
+    for _ in range(processes):
+        helper = threading.Thread(target=run_shared_worker,
+                                  args=(shared_dir, 0.5, stop_event, True))
+        helper.daemon = True
+        helper.start()
+        helpers.append(helper)
+
+    try:
+        remaining = {seg['index']: seg for seg in segments}
+        while remaining:
+            for index, seg in list(remaining.items()):
+                if os.path.exists(seg['output'] + '.failed'):
+                    with open(seg['output'] + '.failed') as f:
+                        raise Exception(f"Segment {index} failed: {f.read()}")
+                if os.path.exists(seg['output'] + '.done'):
+                    report(index, None)
+                    del remaining[index]
+                else:
+                    report(index, _read_progress_file(seg['output'] + '.progress'))
+            time.sleep(1)
+    finally:
+        stop_event.set()
+        # Withdraw anything nobody has claimed yet (e.g. after a failure)
+        for task_path in task_paths:
+            if os.path.exists(task_path):
+                os.remove(task_path)
+
+
+def encode_segmented(ffmpeg_path, input_path, output_path, video_args, audio_args,
+                     duration, workdir, processes=2, threads=2, on_progress=None,
+                     segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                     executor=EXECUTOR_PROCESS, shared_dir=None, has_audio=True,
+                     resumable=False):
+    """
+    Encode `input_path` as parallel GOP-aligned segments.
+
+    Args:
+        video_args / audio_args: ffmpeg codec arguments (see encode_plan)
+        duration: Input duration in seconds, used for split marks and progress
+        workdir: Scratch directory for segments (under `shared_dir` when shared)
+        processes: Segments encoded at the same time on this host
+        threads: ffmpeg -threads for each segment encode
+        on_progress: Called as on_progress(encoded_seconds, segments_done, total)
+        executor: EXECUTOR_PROCESS (local pool) or EXECUTOR_SHARED (task files)
+        resumable: Keep workdir on failure and pick up from its checkpoint
+                   (video_args then come from the checkpoint, see load_checkpoint)
+    """
+    checkpoint = load_checkpoint(workdir) if resumable else None
+    if resumable and checkpoint is None and os.path.isdir(workdir):
+        shutil.rmtree(workdir, ignore_errors=True)  # unusable leftovers
+    os.makedirs(workdir, exist_ok=True)
+    completed = False
+    try:
+        if checkpoint:
+            segments, video_args = checkpoint['segments'], checkpoint['video_args']
+        else:
+            segments = split_at_keyframes(ffmpeg_path, input_path, workdir, duration,
+                                          segment_seconds)
+            for seg in segments:
+                seg['output'] = os.path.join(workdir, f"enc_{seg['index']:04d}.mkv")
+            if resumable:
+                _write_checkpoint(workdir, video_args, segments)
+
+        encoded = {seg['index']: 0.0 for seg in segments}
+        finished = set()
+        lock = threading.Lock()
+        for index in (checkpoint or {}).get('done', ()):
+            finished.add(index)
+            encoded[index] = segments[index]['duration']
+        pending = [seg for seg in segments if seg['index'] not in finished]
+
+        def report(index, seconds):
+            with lock:
+                if seconds is None:
+                    finished.add(index)
+                    encoded[index] = segments[index]['duration']
+                elif index not in finished:
+                    encoded[index] = min(seconds, segments[index]['duration'])
+                total = sum(encoded.values())
+                done = len(finished)
+            if on_progress:
+                on_progress(total, done, len(segments))
+
+        # Audio is a single cheap stream; encode it alongside the video segments
+        job_id = job_control.current_job()
+        audio_path = None
+        audio_error = []
+        audio_thread = None
+        if has_audio and audio_args:
+            audio_path = os.path.join(workdir, 'audio.mka')
+        if audio_path and not os.path.exists(audio_path):  # a resumed encode may have it
+
+            def audio_job():
+                try:
+                    # Registered under the job, so cancelling it stops the audio too
+                    with job_control.bind(job_id, helper=True):
+                        encode_audio(ffmpeg_path, input_path, audio_path, audio_args)
+                except Exception as e:
+                    audio_error.append(e)
+
+            audio_thread = threading.Thread(target=audio_job)
+            audio_thread.daemon = True
+            audio_thread.start()
+
+        if finished and on_progress:
+            on_progress(sum(encoded.values()), len(finished), len(segments))  # resumed
+        if not pending:
+            pass
+        elif executor == EXECUTOR_SHARED:
+            _encode_shared(ffmpeg_path, pending, video_args, processes, threads,
+                           report, shared_dir)
+        else:
+            _encode_local(ffmpeg_path, pending, video_args, processes, threads, report)
+
+        if audio_thread:
+            audio_thread.join()
+            if audio_error:
+                raise audio_error[0]
+
+        if job_id is not None:
+            job_control.check(job_id)  # cancelled after the last segment
+        concat_segments(ffmpeg_path, [seg['output'] for seg in segments],
+                        audio_path, output_path, workdir)
+        completed = True
+        return len(segments)
+    finally:
+        if completed or not resumable:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != '--worker':
+        print("Usage: python segment_encoder.py --worker /path/to/shared/dir")
+        sys.exit(1)
+
+    print(f"Segment worker {socket.gethostname()}:{os.getpid()} watching {sys.argv[2]}")
+    try:
+        run_shared_worker(sys.argv[2])
+    except KeyboardInterrupt:
+        print("\nSegment worker stopped")
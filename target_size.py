@@ -0,0 +1,204 @@
+"""
+Encode to a target file size instead of a bitrate.
+
+The video bitrate is solved from the target size, the probed duration and
+the audio budget. A two-pass x264 encode then follows:
+
+    pass 1  - analysis only (x264 turns on its fast first-pass settings
+              automatically, and no output file is written)
+    pass 2  - the real encode, distributing the bitrate using the pass-1 stats
+
+The pass-1 stats don't depend on the target bitrate, so they are kept per
+input and preset. A retry, or a later request for the same file at a
+different size, skips straight to pass 2. If pass 2 overshoots the target, it
+is re-run at a proportionally lower bitrate using the same stats.
+"""
+
+import glob
+import hashlib
+import os
+import re
+import subprocess
+import time
+import uuid
+
+import job_control
+from encode_plan import AUDIO_BITRATE, parse_bitrate, format_bitrate
+from ffmpeg_progress import ProgressReader, PROGRESS_ARGS
+
+# Container overhead: MP4 index + interleaving, as a fraction of the payload
+MUX_OVERHEAD = 0.02
+MUX_OVERHEAD_BYTES = 64 * 1024
+# Below this the result isn't worth watching; ask for a bigger target
+MIN_VIDEO_BITRATE = 100000
+# Accept results up to this far over the target before re-running pass 2
+SIZE_TOLERANCE = 0.01
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 0.5
+# Files x264 writes for a -passlogfile prefix
+STATS_SUFFIXES = ('-0.log', '-0.log.mbtree')
+# These presets turn off mbtree, so pass 1 would write no .mbtree file
+NO_MBTREE_PRESETS = ('ultrafast', 'superfast')
+
+
+def parse_size(value):
+    """Convert a size ('25M', '25MB', '700k', '1.5G', '26214400') to bytes"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([kKmMgG]?)(i?[bB])?\s*', str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit = float(match.group(1)), match.group(2).lower()
+    return int(number * {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[unit])
+
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def audio_budget(info):
+    """Audio bits/s the output will spend (0 if there is no audio track)"""
+    if info and not info.get('has_audio', True):
+        return 0
+    return parse_bitrate(AUDIO_BITRATE)
+
+
+def solve_video_bitrate(target_size, duration, audio_bitrate):
+    """Video bits/s that makes duration seconds of output land on target_size bytes"""
+    if not duration or duration <= 0:
+        raise ValueError("Target size needs the input duration")
+    payload = (target_size - MUX_OVERHEAD_BYTES) / (1 + MUX_OVERHEAD)
+    video_bitrate = int(payload * 8 / duration - audio_bitrate)
+    if video_bitrate < MIN_VIDEO_BITRATE:
+        raise ValueError(f"Target size {format_size(target_size)} is too small for a "
+                         f"{duration:.0f}s video")
+    return video_bitrate
+
+
+def stats_prefix(stats_dir, key, preset, video_filters=None):
+    """Pass-log prefix for an input (key: its content digest), preset and filter chain"""
+    name = f"{key}_{preset}"
+    if video_filters:
+        name += '_' + hashlib.sha256(video_filters.encode()).hexdigest()[:12]
+    return os.path.join(stats_dir, name)
+
+
+def two_pass_preset(preset):
+    """The preset to use for a two-pass encode: no faster than veryfast"""
+    return 'veryfast' if preset in NO_MBTREE_PRESETS else preset
+
+
+def has_stats(prefix):
+    return all(os.path.exists(prefix + suffix) for suffix in STATS_SUFFIXES)
+
+
+def _run_pass(cmd, pass_number, on_progress):
+    process = job_control.spawn(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True, bufsize=1)
+    # Progress and errors share stderr: one reader, nothing else to drain
+    reader = ProgressReader(process.stderr)
+
+    last_report = 0
+    for update in reader:
+        now = time.monotonic()
+        if on_progress is not None and update['out_time'] is not None and now - last_report >= PROGRESS_INTERVAL:
+            on_progress(pass_number, update['out_time'])
+            last_report = now
+
+    process.wait()
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg error (pass {pass_number}): {reader.text()}")
+
+
+def abr_video_args(video_bitrate, preset='veryfast'):
+    """Average-bitrate x264 arguments (single pass; encode_to_size adds the pass flags)"""
+    return [
+        '-c:v', 'libx264',
+        '-preset', preset,
+        '-b:v', format_bitrate(video_bitrate),
+        '-maxrate', format_bitrate(video_bitrate * 2),
+        '-bufsize', format_bitrate(video_bitrate * 4),
+        '-pix_fmt', 'yuv420p',
+    ]
+
+
+def _video_args(video_bitrate, preset, pass_number, prefix):
+    return abr_video_args(video_bitrate, preset) + ['-pass', str(pass_number), '-passlogfile', prefix]
+
+
+def encode_to_size(ffmpeg_path, input_path, output_path, target_size, duration, audio_args,
+                   stats_prefix, audio_bitrate=0, preset='veryfast', threads=0,
+                   video_filters=None, on_progress=None):
+    """
+    Two-pass encode of input_path aimed at target_size bytes.
+
+    Args:
+        audio_args: ffmpeg audio arguments for pass 2 (from encode_plan.audio_args)
+        stats_prefix: Pass-log prefix; existing stats there are reused
+        audio_bitrate: Audio bits/s to budget for (0 = no audio)
+        video_filters: Optional -vf filter string, applied in both passes
+        on_progress: Called as on_progress(pass_number, seconds_encoded)
+
+    Returns a dict with the sizes, the bitrate used, the deviation from the
+    target in percent (negative = under), attempts and whether stats were reused.
+    """
+    preset = two_pass_preset(preset)
+    video_bitrate = solve_video_bitrate(target_size, duration, audio_bitrate)
+    filter_args = ['-vf', video_filters] if video_filters else []
+    common = ['-threads', str(threads)] + PROGRESS_ARGS
+
+    stats_reused = has_stats(stats_prefix)
+    if stats_reused:
+        for suffix in STATS_SUFFIXES:
+            os.utime(stats_prefix + suffix)  # keep them from being cleaned up
+    else:
+        # Write under a private prefix so concurrent jobs on the same input don't mix stats
+        os.makedirs(os.path.dirname(stats_prefix) or '.', exist_ok=True)
+        pass1_prefix = f"{stats_prefix}.{uuid.uuid4().hex}"
+        try:
+            _run_pass([ffmpeg_path, '-v', 'error', '-y', '-i', input_path] + filter_args
+                      + _video_args(video_bitrate, preset, 1, pass1_prefix)
+                      + ['-an', '-sn', '-dn'] + common + ['-f', 'null', os.devnull],
+                      1, on_progress)
+            for suffix in STATS_SUFFIXES:
+                os.replace(pass1_prefix + suffix, stats_prefix + suffix)
+        finally:
+            for path in glob.glob(glob.escape(pass1_prefix) + '*'):
+                os.remove(path)
+
+    attempts = 0
+    while True:
+        attempts += 1
+        _run_pass([ffmpeg_path, '-v', 'error', '-y', '-i', input_path] + filter_args
+                  + _video_args(video_bitrate, preset, 2, stats_prefix)
+                  + list(audio_args) + ['-movflags', 'faststart'] + common + [output_path],
+                  2, on_progress)
+        final_size = os.path.getsize(output_path)
+        overshoot = final_size / target_size - 1
+        if overshoot <= SIZE_TOLERANCE or attempts >= MAX_ATTEMPTS:
+            break
+        # Scale the video share down by the overshoot (plus a little margin)
+        lower = int(video_bitrate / (1 + overshoot) * (1 - SIZE_TOLERANCE))
+        if lower < MIN_VIDEO_BITRATE:
+            break
+        video_bitrate = lower
+        print(f"Output {overshoot * 100:.1f}% over target, re-running pass 2 "
+              f"at {format_bitrate(video_bitrate)}")
+
+    return {
+        'target_size': target_size,
+        'final_size': final_size,
+        'deviation': (final_size / target_size - 1) * 100,
+        'video_bitrate': video_bitrate,
+        'attempts': attempts,
+        'stats_reused': stats_reused,
+    }
+
+
+def cleanup_stats(stats_dir, max_age):
+    """Remove pass logs nobody has used for max_age seconds"""
+    now = time.time()
+    for path in glob.glob(os.path.join(stats_dir, '*.log*')):
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,117 @@
+"""
+Per-job phase traces.
+
+Each job gets a JSON-lines file in the trace folder. Every finished phase
+(upload, assemble, probe, queue, encode, faststart, download) appends one
+span line:
+
+    {"type": "span", "name": "probe", "start": 81234.51, "wall": 1760000000.2,
+     "duration": 0.043, "status": "ok", "pid": 4242, ...attributes}
+
+'start' is time.monotonic(). On Linux that clock is system-wide, so spans
+written by different gunicorn workers line up; 'wall' is only for display.
+The stderr tail of the encode (the last STDERR_LINES lines, kept by
+progress.ProgressReader) ends up in the same file as a "stderr" line.
+One file per job means any worker can serve the trace. Appending a line
+needs no coordination between processes.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STDERR_LINES = 200
+
+
+class Tracer:
+    """Appends job spans to <folder>/<job_id>.jsonl and reads them back"""
+
+    def __init__(self, folder, on_span=None):
+        self.folder = folder
+        self.on_span = on_span  # called with each span dict (e.g. to feed metrics)
+        self._lock = threading.Lock()
+
+    def path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.jsonl")
+
+    def _append(self, job_id, record):
+        if not self.folder:
+            return
+        line = json.dumps(record, default=str) + '\n'
+        try:
+            with self._lock:
+                os.makedirs(self.folder, exist_ok=True)
+                with open(self.path(job_id), 'a') as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"Trace write failed for job {job_id}: {e}")
+
+    def record(self, job_id, name, start, duration, status='ok', **attrs):
+        """Add a finished span (start is a time.monotonic() value)"""
+        span = {'type': 'span', 'name': name, 'start': round(start, 6),
+                'wall': round(time.time() - (time.monotonic() - start), 3),
+                'duration': round(duration, 6), 'status': status, 'pid': os.getpid(), **attrs}
+        self._append(job_id, span)
+        if self.on_span is not None:
+            try:
+                self.on_span(span)
+            except Exception as e:
+                print(f"Span callback failed: {e}")
+        return span
+
+    def record_since(self, job_id, name, wall_start, wall_end=None, **attrs):
+        """Add a span between time.time() values (ending now by default)"""
+        now = time.time()
+        duration = max((wall_end or now) - wall_start, 0)
+        start = time.monotonic() - (now - wall_start)
+        return self.record(job_id, name, start, duration, **attrs)
+
+    @contextmanager
+    def span(self, job_id, name, **attrs):
+        """
+        Time the body as one span. Yields the attribute dict, so the body can
+        add attributes; an exception marks the span as an error and propagates.
+        """
+        start = time.monotonic()
+        try:
+            yield attrs
+        except Exception as e:
+            self.record(job_id, name, start, time.monotonic() - start, status='error',
+                        error=str(e)[:500], **attrs)
+            raise
+        self.record(job_id, name, start, time.monotonic() - start, **attrs)
+
+    def stderr(self, job_id, name, tail):
+        """Store a ProgressReader's stderr tail under the span it belongs to"""
+        self._append(job_id, {'type': 'stderr', 'name': name, 'lines': tail.lines(),
+                              'total_lines': tail.total_lines})
+
+    def read(self, job_id):
+        """All records for a job in write order, or None if it has no trace"""
+        try:
+            with open(self.path(job_id)) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue  # a line another process is still writing
+        return records
+
+    def cleanup(self, max_age):
+        """Remove traces not written to for max_age seconds"""
+        if not os.path.isdir(self.folder):
+            return
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if name.endswith('.jsonl') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
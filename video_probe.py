@@ -0,0 +1,174 @@
+"""
+Fast container-header probing with ffprobe.
+
+Only the container header is read (the moov atom for MP4/MOV, or the format
+duration for other containers); no frames are decoded. Results are cached by
+the file's full content digest (the same SHA-256 tree hash the result cache
+and uploads use), so the web and CLI paths probe each file once.
+"""
+
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import ffmpeg
+
+from mp4_compressor import find_ffmpeg, find_ffprobe
+from result_cache import hash_file
+
+# Keep ffprobe from scanning into the payload looking for stream parameters
+PROBE_OPTIONS = {
+    'probesize': '5000000',
+    'analyzeduration': '0',
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 256
+_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def content_hash(path):
+    """Digest of the whole file, matching the digest recorded at upload time"""
+    return hash_file(path)
+
+
+def moov_layout(path, available=None):
+    """
+    Walk the top-level MP4/MOV atoms looking for 'moov' and 'mdat'.
+
+    Only the first `available` bytes are read, so this works on a file that
+    is still being uploaded. Returns ('front', moov_end) when the moov comes
+    first, ('end', None) when the mdat comes first, and (None, None) when
+    more data is needed or the file is not ISO media.
+    """
+    try:
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            limit = file_size if available is None else min(available, file_size)
+            offset = 0
+            while offset + 8 <= limit:
+                f.seek(offset)
+                size, atom = struct.unpack('>I4s', f.read(8))
+                if size == 1:  # 64-bit extended size follows the type
+                    if offset + 16 > limit:
+                        return None, None
+                    size = struct.unpack('>Q', f.read(8))[0]
+                elif size == 0:  # atom runs to the end of the file
+                    size = file_size - offset
+                if atom == b'moov':
+                    return 'front', offset + size
+                if atom == b'mdat':
+                    return 'end', None
+                if size < 8:
+                    return None, None
+                offset += size
+    except OSError:
+        pass
+    return None, None
+
+
+def moov_at_front(path):
+    """
+    Report whether 'moov' comes before 'mdat' (i.e. the file is already
+    "faststart"). Returns None if the file is not an ISO media file.
+    """
+    layout, _ = moov_layout(path)
+    return None if layout is None else layout == 'front'
+
+
+def _parse_rate(rate):
+    """Turn an ffprobe frame rate like '30000/1001' into a float"""
+    try:
+        num, _, den = str(rate).partition('/')
+        num = float(num)
+        den = float(den) if den else 1.0
+        return round(num / den, 3) if den else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def summarize_probe(probe, size=None):
+    """Reduce raw ffprobe JSON to the fields the encoder needs"""
+    fmt = probe.get('format', {})
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    duration = float(fmt.get('duration') or 0)
+    if not duration and video:
+        duration = float(video.get('duration') or 0)
+
+    info = {
+        'duration': duration,
+        'size': _int(fmt.get('size'), size or 0),
+        'format_name': fmt.get('format_name', ''),
+        'major_brand': (fmt.get('tags') or {}).get('major_brand', '').strip(),
+        'bit_rate': _int(fmt.get('bit_rate')),
+        'has_video': video is not None,
+        'has_audio': audio is not None,
+    }
+    if video:
+        info.update({
+            'width': _int(video.get('width')),
+            'height': _int(video.get('height')),
+            'fps': _parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+            'video_codec': video.get('codec_name', ''),
+            'pix_fmt': video.get('pix_fmt', ''),
+            'video_bit_rate': _int(video.get('bit_rate')),
+            'rotation': _int((video.get('tags') or {}).get('rotate')),
+        })
+    if audio:
+        info.update({
+            'audio_codec': audio.get('codec_name', ''),
+            'audio_channels': _int(audio.get('channels')),
+            'audio_sample_rate': _int(audio.get('sample_rate')),
+            'audio_bit_rate': _int(audio.get('bit_rate')),
+        })
+    return info
+
+
+def cache_stats():
+    """Probe cache hits and misses since startup"""
+    with _cache_lock:
+        return dict(_cache_stats)
+
+
+def probe_video(path, fingerprint=None):
+    """
+    Probe a video's container header and return a summary dict.
+
+    Args:
+        path: Path to the media file
+        fingerprint: Content digest already known for the file, e.g. from its
+            upload (the whole file is hashed if omitted)
+
+    Raises ffmpeg.Error if ffprobe cannot read the file.
+    """
+    key = fingerprint or content_hash(path)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return dict(_cache[key])
+        _cache_stats['misses'] += 1
+
+    ffprobe_path = find_ffprobe(find_ffmpeg())
+    probe = ffmpeg.probe(path, cmd=ffprobe_path, **PROBE_OPTIONS)
+    info = summarize_probe(probe, size=os.path.getsize(path))
+    info['content_hash'] = key
+    info['faststart'] = moov_at_front(path)
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return dict(info)